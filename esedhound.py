@@ -11,9 +11,12 @@
 
 import sys
 import os
+import shutil
 import argparse
 import logging
-from lib.esedbexport import ESEDBExport
+from lib.esedbexport import ESEDBExport, SubprocessError
+from lib.esedb import ESEDB
+from lib.cache import dsCache
 from time import sleep
 from rich.console import Console
 from ntds.version import *
@@ -22,6 +25,11 @@ from ntds.dsrecord import *
 from ntds.dslink import *
 from ntds.dstime import *
 from ntds.dsobjects import *
+from ntds.dsmembership import *
+from ntds.dspath import *
+from ntds.dshashes import *
+from ntds.dsbloodhound import *
+from ntds.dsworkers import *
 from lib.dump import *
 from lib.fs import *
 from lib.hashoutput import *
@@ -30,11 +38,12 @@ from lib.csvoutput import *
 # custom
 from ntds.sd_table import *
 
+ESEDBEXPORT = "/usr/local/bin/esedbexport"
 
 
 def test_esedbexport():
 	try:
-		if os.path.isfile('/usr/local/bin/esedbexport'):
+		if os.path.isfile(ESEDBEXPORT):
 			return 0
 		else:
 			print("[!] The esedbexport tool is not installed !")
@@ -47,7 +56,7 @@ def test_esedbexport():
 				os.chdir("./libesedb-20230318")
 				os.system("./configure && make && make install && ldconfig")
 				os.chdir("..")
-				if os.path.isfile('/usr/local/bin/esedbexport'):
+				if os.path.isfile(ESEDBEXPORT):
 					return 0
 				else:
 					print("[!] Installation failed. Abort.")
@@ -58,39 +67,56 @@ def test_esedbexport():
 
 
 
-def export_tables(ntds):
+def clean_workdir(workdir):
+	# Removes the exported tables, the maps and the cache markers
+	for filename in os.listdir(workdir):
+		f = os.path.join(workdir, filename)
+		if filename in ("datatable.export", "link_table.export", "sd_table.export"):
+			shutil.rmtree(f, ignore_errors=True)
+		elif filename.endswith((".map", ".idx", ".done")):
+			os.remove(f)
+
+
+
+def export_tables(ntds, workdir, jobs=3):
 	try:
 		console = Console()
-		workdir=os.getcwd()
-		with console.status("[bold green][+] Extracting ESE databases (Stage 0)...") as status:
-			esedbexport = ESEDBExport(ntds=ntds, workdir=workdir)
-			datatable = esedbexport.ExportTable(ntds=ntds,table="datatable")
-			link_table = esedbexport.ExportTable(ntds=ntds,table="link_table")
-			sd_table = esedbexport.ExportTable(ntds=ntds,table="sd_table")
 		print("[+] Extracting ESE databases (Stage 0)...")
-		with console.status("[bold green][+] Extracting datatable...") as status:
-			datatable.run()
-		print("[+] Extracting datatable...")
-		with console.status("[bold green][+] Extracting link_table...") as status:
-			link_table.run()
-		print("[+] Extracting link_table...")
-		with console.status("[bold green][+] Extracting sd_table...") as status:
-			sd_table.run()
-		print("[+] Extracting sd_table...")
+		esedbexport = ESEDBExport(ntds=ntds, exe=ESEDBEXPORT, workdir=workdir)
+		datatable = esedbexport.ExportTable(ntds=ntds,table="datatable",exe=ESEDBEXPORT,workdir=workdir)
+		link_table = esedbexport.ExportTable(ntds=ntds,table="link_table",exe=ESEDBEXPORT,workdir=workdir)
+		sd_table = esedbexport.ExportTable(ntds=ntds,table="sd_table",exe=ESEDBEXPORT,workdir=workdir)
+		running = []
+		def started(table):
+			running.append(table)
+			status.update("[bold green][+] Extracting %s..." % ", ".join(running))
+		def finished(table, returncode, elapsed):
+			running.remove(table)
+			print("[+] Extracting %s... exit status %d (%.1fs)" % (table, returncode, elapsed))
+			if running:
+				status.update("[bold green][+] Extracting %s..." % ", ".join(running))
+		with console.status("[bold green][+] Extracting tables...") as status:
+			results = esedbexport.run_concurrently([datatable, link_table, sd_table], jobs=jobs, started=started, finished=finished)
+		failed = ["%s (exit status %d)" % (table, returncode) for table, returncode, elapsed in results if returncode != 0]
+		if failed:
+			raise SubprocessError("esedbexport failed for " + ", ".join(failed))
+	except SubprocessError as e:
+		clean_workdir(workdir)
+		print("\n[!] ERROR : "+str(e))
+		raise
 	except Exception as e:
-		os.system("rm -f ./*.map && rm -rf ./datatable.export && rm -rf ./link_table.export && rm -rf ./sd_table")
+		clean_workdir(workdir)
 		print("Failed to create instance of ESEDBExport : "+str(e))
 		raise
 
 
 
-def read_sd_table():
+def read_sd_table(workdir):
 	try:
 		console = Console()
-		workdir=os.getcwd()
 		with console.status("[bold green][+] Initializing engine for sd_table...") as status:
-			for filename in os.listdir("./sd_table.export"):
-				f = os.path.join("./sd_table.export", filename)
+			for filename in os.listdir(os.path.join(workdir, "sd_table.export")):
+				f = os.path.join(workdir, "sd_table.export", filename)
 				if not os.path.isfile(f):
 					print("\n[!] ERROR : sd_table file not generated.")
 					raise
@@ -99,28 +125,27 @@ def read_sd_table():
 
 		return sd
 	except Exception as e:
-		os.system("rm -f ./*.map && rm -rf ./datatable.export && rm -rf ./link_table.export && rm -rf ./sd_table")
+		clean_workdir(workdir)
 		print("Failed to create instance of ESEDBExport : "+str(e))
 		raise
 
 
 
-def read_datatable():
+def read_datatable(workdir, workers=None):
 	try:
 		console = Console()
-		workdir=os.getcwd()
 		with console.status("[bold green][+] Initializing engine for datatable...") as status:
-			for filename in os.listdir("./datatable.export"):
-				f = os.path.join("./datatable.export", filename)
+			for filename in os.listdir(os.path.join(workdir, "datatable.export")):
+				f = os.path.join(workdir, "datatable.export", filename)
 				if not os.path.isfile(f):
 					print("\n[!] ERROR : datatable file not generated.")
 					raise
 		print("[+] Initializing engine for datatable...")
-		db = dsInitDatabase(f, workdir)
+		db = dsInitDatabase(f, workdir, workers)
 
 		with console.status("[bold green][+] Initializing engine for link_table...") as status:
-			for filename in os.listdir("./link_table.export"):
-				f = os.path.join("./link_table.export", filename)
+			for filename in os.listdir(os.path.join(workdir, "link_table.export")):
+				f = os.path.join(workdir, "link_table.export", filename)
 				if os.path.isfile(f):
 					dl = dsInitLinks(f, workdir)
 				else:
@@ -129,140 +154,279 @@ def read_datatable():
 		print("[+] Initializing engine for link_table...")
 		return db, dl
 	except Exception as e:
-		os.system("rm -f ./*.map && rm -rf ./datatable.export && rm -rf ./link_table.export && rm -rf ./sd_table")
+		clean_workdir(workdir)
 		print("Failed to create instance of ESEDBExport : "+str(e))
 		raise	
 
 
 
 
-def print_users(db):
+def read_ese_database(ntds, workdir):
+	try:
+		console = Console()
+		with console.status("[bold green][+] Opening ESE database...") as status:
+			esedb = ESEDB(ntds)
+		print("[+] Opening ESE database...")
+		print("[+] Initializing engine for datatable...")
+		db = dsInitDatabase(esedb.getTable("datatable"), workdir)
+		with console.status("[bold green][+] Initializing engine for link_table...") as status:
+			dl = dsInitLinks(esedb.getTable("link_table"), workdir)
+		print("[+] Initializing engine for link_table...")
+		return db, dl
+	except Exception as e:
+		clean_workdir(workdir)
+		print("Failed to read ESE database : "+str(e))
+		raise
+
+
+
+
+def stream_tables(ntds, workdir):
+	processes = {}
+	try:
+		console = Console()
+		esedbexport = ESEDBExport(ntds=ntds, workdir=workdir)
+		exporters = {}
+		with console.status("[bold green][+] Starting ESE database extraction (Stage 0)...") as status:
+			for table in ("datatable", "link_table", "sd_table"):
+				exporters[table] = esedbexport.ExportTable(ntds=ntds,table=table,workdir=workdir)
+				processes[table] = exporters[table].start()
+		print("[+] Starting ESE database extraction (Stage 0)...")
+
+		def following(table):
+			return lambda: processes[table].poll() is None
+
+		tables = {}
+		for table in ("datatable", "link_table"):
+			f = exporters[table].wait_for_export(processes[table])
+			if f is None:
+				print("\n[!] ERROR : %s file not generated." % table)
+				raise Exception("esedbexport failed for " + table)
+			tables[table] = dsTextTable(f, follow=following(table))
+
+		print("[+] Initializing engine for datatable while it is exported...")
+		db = dsInitDatabase(tables["datatable"], workdir)
+		with console.status("[bold green][+] Initializing engine for link_table while it is exported...") as status:
+			dl = dsInitLinks(tables["link_table"], workdir)
+		print("[+] Initializing engine for link_table while it is exported...")
+
+		with console.status("[bold green][+] Waiting for esedbexport to finish...") as status:
+			for table in ("datatable", "link_table", "sd_table"):
+				returncode = processes[table].wait()
+				print("[+] Extracting %s... exit status %d" % (table, returncode))
+				if returncode != 0:
+					raise Exception("esedbexport failed for " + table)
+		return db, dl
+	except BaseException as e:
+		for process in processes.values():
+			if process.poll() is None:
+				process.terminate()
+		clean_workdir(workdir)
+		print("Failed to create instance of ESEDBExport : "+str(e))
+		raise
+
+
+
+
+def format_user(db, recordid, record):
+	user = None
+	try:
+		user = dsUser(db, recordid, record)
+	except:
+		print("[!] Unable to instantiate user object (record id: %d)" % recordid)
+		raise
+
+	lines = []
+	lines.append("\n\nRecord ID:\t%d" % user.RecordId)
+	lines.append("User name:\t%s" % user.Name)
+	lines.append("User principal name:\t%s" % user.PrincipalName)
+	lines.append("SAM Account name:\t%s" % user.SAMAccountName)
+	lines.append("SAM Account type:\t%s" % user.getSAMAccountType())
+	lines.append("GUID:\t%s" % str(user.GUID))
+	lines.append("SID:\t%s" % str(user.SID))
+	lines.append("When created:\t%s" % dsGetDSTimeStampStr(user.WhenCreated))
+	lines.append("When changed:\t%s" % dsGetDSTimeStampStr(user.WhenChanged))
+	lines.append("Account expires:\t%s" % dsGetDSTimeStampStr(user.AccountExpires))
+	lines.append("Password last set:\t%s" % dsGetDSTimeStampStr(user.PasswordLastSet))
+	lines.append("Last logon:\t%s" % dsGetDSTimeStampStr(user.LastLogon))
+	lines.append("Last logon timestamp:\t%s" % dsGetDSTimeStampStr(user.LastLogonTimeStamp))
+	lines.append("Bad password time:\t%s" % dsGetDSTimeStampStr(user.BadPwdTime))
+	lines.append("Logon count:\t%d" % user.LogonCount)
+	lines.append("Bad password count:\t%d" % user.BadPwdCount)
+	if user.PrimaryGroupID != -1:
+		lines.append("Member of:")
+		for name in dsGetMemberOfNames(user):
+			lines.append("\t%s" % name)
+	nested = dsGetNestedMemberOfNames(user)
+	if nested:
+		lines.append("Nested member of:")
+		for name in nested:
+			lines.append("\t%s" % name)
+	lines.append("User Account Control:")
+	for uac in user.getUserAccountControl():
+		lines.append("\t%s" % uac)
+	lines.append("Ancestors: " + dsGetAncestorChain(db, user.RecordId))
+	return "\n".join(lines)
+
+
+
+
+def print_users(db, workdir=None, workers=None):
 	try:
 		console = Console()
-		with console.status("[bold green][+] Getting Person object type...") as status:
-			utype = dsGetTypeIdByTypeName(db, "Person")
-		print("[+] Getting Person object type...")
+		with console.status("[bold green][+] Indexing group memberships...") as status:
+			dsInitMemberships(db, workdir)
+		print("[+] Indexing group memberships...")
 		print("\n[+] List of users:")
 		print("==============")
-		for recordid in dsMapLineIdByRecordId:
-			if int(dsGetRecordType(db, recordid)) == utype:
-				user = None
-				try:
-					user = dsUser(db, recordid)
-				except:
-					print("[!] Unable to instantiate user object (record id: %d)" % recordid)
-					raise
-
-				print("\n\nRecord ID:\t%d" % user.RecordId)
-				print("User name:\t%s" % user.Name)
-				print("User principal name:\t%s" % user.PrincipalName)
-				print("SAM Account name:\t%s" % user.SAMAccountName)
-				print("SAM Account type:\t%s" % user.getSAMAccountType())
-				print("GUID:\t%s" % str(user.GUID))
-				print("SID:\t%s" % str(user.SID))
-				print("When created:\t%s" % dsGetDSTimeStampStr(user.WhenCreated))
-				print("When changed:\t%s" % dsGetDSTimeStampStr(user.WhenChanged))
-				print("Account expires:\t%s" % dsGetDSTimeStampStr(user.AccountExpires))
-				print("Password last set:\t%s" % dsGetDSTimeStampStr(user.PasswordLastSet))
-				print("Last logon:\t%s" % dsGetDSTimeStampStr(user.LastLogon))
-				print("Last logon timestamp:\t%s" % dsGetDSTimeStampStr(user.LastLogonTimeStamp))
-				print("Bad password time:\t%s" % dsGetDSTimeStampStr(user.BadPwdTime))
-				print("Logon count:\t%d" % user.LogonCount)
-				print("Bad password count:\t%d" % user.BadPwdCount)
-				gtype = dsGetTypeIdByTypeName(db, "Group")
-				groups=[]
-				ugroups=[]
-				if user.PrimaryGroupID != -1:
-					print("Member of:")
-					for recordid in dsMapLineIdByRecordId:
-						if int(dsGetRecordType(db, recordid)) == gtype:
-							groups.append(dsGroup(db, recordid))
-					grouplist = user.getMemberOf()
-					for g in groups:
-						if g.SID.RID == user.PrimaryGroupID:
-							print("\t%s" % g.Name)
-						else:
-							for g_user in grouplist:
-								if g.RecordId == g_user[0]:
-									print("\t%s" % g.Name)
-				print("User Account Control:")
-				for uac in user.getUserAccountControl():
-					print("\t%s" % uac)
-				i=0
-				str_anc = ""
-				for ancestor in user.getAncestors(db):
-					if i<1:
-						i=1
-					else:
-						str_anc = str_anc + "->"
-					str_anc = str_anc + ancestor.Name 
-				print("Ancestors: " + str(str_anc))		
+		# Person is the category of the users, its subclasses have their own
+		for text in dsMapObjects(db, dsIterObjects(db, "Person", subclasses=False), format_user, workdir, workers):
+			print(text)
 	except Exception as e:
-		os.system("rm -f ./*.map && rm -rf ./datatable.export && rm -rf ./link_table.export && rm -rf ./sd_table")
 		print("Failed to create instance of ESEDBExport : "+str(e))
 		raise
 
 
 
 
-def print_computers(db):
+def format_computer(db, recordid, record):
+	computer = None
+	try:
+	    computer = dsComputer(db, recordid, record)
+	except KeyboardInterrupt:
+	    raise KeyboardInterrupt
+	except:
+	    print("[!] Unable to instantiate user object (record id: %d)" % recordid)
+	    return None
+	lines = []
+	lines.append("\n\nRecord ID:\t%d" % computer.RecordId)
+	lines.append("Computer name:\t%s" % computer.Name)
+	lines.append("Computer DNS Hostname:\t%s" % computer.DNSHostName)
+	lines.append("GUID:\t%s" % str(computer.GUID))
+	lines.append("SID:\t%s" % str(computer.SID))
+	lines.append("Computer OS Name:\t%s" % computer.OSName)
+	lines.append("Computer OS Version:\t%s" % computer.OSVersion)
+	lines.append("When created:\t%s" % dsGetDSTimeStampStr(computer.WhenCreated))
+	lines.append("When changed:\t%s" % dsGetDSTimeStampStr(computer.WhenChanged))
+	return "\n".join(lines)
+
+
+
+
+def print_computers(db, workdir=None, workers=None):
 	try:	
 		print("\n[+] List of computers:")
 		print("==============")
-		for recordid in dsMapRecordIdByTypeId[dsGetTypeIdByTypeName(db, "Computer")]:
-		    computer = None
-		    try:
-		        computer = dsComputer(db, recordid)
-		    except KeyboardInterrupt:
-		        raise KeyboardInterrupt
-		    except:
-		        print("[!] Unable to instantiate user object (record id: %d)" % recordid)
-		        continue
-		    print("\n\nRecord ID:\t%d" % computer.RecordId)
-		    print("Computer name:\t%s" % computer.Name)
-		    print("Computer DNS Hostname:\t%s" % computer.DNSHostName)
-		    print("GUID:\t%s" % str(computer.GUID))
-		    print("SID:\t%s" % str(computer.SID))
-		    print("Computer OS Name:\t%s" % computer.OSName)
-		    print("Computer OS Version:\t%s" % computer.OSVersion)
-		    print("When created:\t%s" % dsGetDSTimeStampStr(computer.WhenCreated))
-		    print("When changed:\t%s" % dsGetDSTimeStampStr(computer.WhenChanged))
+		for text in dsMapObjects(db, dsIterObjects(db, "Computer"), format_computer, workdir, workers):
+		    print(text)
 	except Exception as e:
-		os.system("rm -f ./*.map && rm -rf ./datatable.export && rm -rf ./link_table.export && rm -rf ./sd_table")
 		print("Failed to create instance of ESEDBExport : "+str(e))
 		raise
 
 
 
 
-def print_groups(db):
+def format_group(db, recordid, record):
+	try:
+	    group = dsGroup(db, recordid, record)
+	except:
+	    print("\n[!] Unable to instantiate group object (record id: %d)" % recordid)
+	    return None
+	lines = []
+	lines.append("\n\nRecord ID:\t%d" % group.RecordId)
+	lines.append("Group Name:\t%s" % group.Name)
+	lines.append("GUID:\t%s" % str(group.GUID))
+	lines.append("SID:\t%s" % str(group.SID))
+	lines.append("When created:\t%s" % dsGetDSTimeStampStr(group.WhenCreated))
+	lines.append("When changed:\t%s" % dsGetDSTimeStampStr(group.WhenChanged))
+	return "\n".join(lines)
+
+
+
+
+def print_groups(db, workdir=None, workers=None):
 	try:
-		console = Console()
-		with console.status("[bold green][+] Getting Group object type...") as status:
-			gtype = dsGetTypeIdByTypeName(db, "Group")
-		print("[+] Getting Group object type...")	
 		print("\n[+] List of groups:")
 		print("==============")
-		for recordid in dsMapLineIdByRecordId:
-		    if int(dsGetRecordType(db, recordid)) == gtype:
-		        try:
-		            group = dsGroup(db, recordid)
-		        except:
-		            print("\n[!] Unable to instantiate group object (record id: %d)" % recordid)
-		            continue		  
-		        print("\n\nRecord ID:\t%d" % group.RecordId)
-		        print("Group Name:\t%s" % group.Name)
-		        print("GUID:\t%s" % str(group.GUID))
-		        print("SID:\t%s" % str(group.SID))
-		        print("When created:\t%s" % dsGetDSTimeStampStr(group.WhenCreated))
-		        print("When changed:\t%s" % dsGetDSTimeStampStr(group.WhenChanged))
+		for text in dsMapObjects(db, dsIterObjects(db, "Group"), format_group, workdir, workers):
+		    print(text)
 	except Exception as e:
-		os.system("rm -f ./*.map && rm -rf ./datatable.export && rm -rf ./link_table.export && rm -rf ./sd_table")
 		print("Failed to create instance of ESEDBExport : "+str(e))
 		raise
 
 
-	
+
+
+def write_bloodhound(db, filename, ntds, workdir, native=False, workers=None):
+	try:
+		# ACEs are only written when the sd_table can be read
+		if native:
+			dsInitSdTable(ESEDB(ntds).getTable("sd_table"), workdir)
+		elif os.path.isdir(os.path.join(workdir, "sd_table.export")):
+			read_sd_table(workdir)
+		else:
+			print("[!] Warning! sd_table not exported, the ACEs will not be written")
+		console = Console()
+		with console.status("[bold green][+] Writing BloodHound files to %s..." % filename) as status:
+			counts = dsWriteBloodHound(db, BloodHoundOutput(filename), workdir, workers)
+		print("[+] Writing BloodHound files to %s... %d users, %d computers, %d groups, %d domains" %
+			(filename, counts["users"], counts["computers"], counts["groups"], counts["domains"]))
+	except Exception as e:
+		print("Failed to write BloodHound files : "+str(e))
+		raise
+
+
+
+
+def init_encryption(system):
+	try:
+		print("[+] Decrypting the PEK with the boot key of %s..." % system)
+		dsInitEncryption(system)
+	except Exception as e:
+		print("Failed to decrypt the PEK : "+str(e))
+		raise
+
+
+
+def write_hashes(db, filename, format="john", workers=None):
+	try:
+		console = Console()
+		with console.status("[bold green][+] Writing password hashes to %s..." % filename) as status:
+			with open(filename, "w") as output:
+				lines = dsWritePasswordHashes(db, output, format, workers)
+		print("[+] Writing password hashes to %s... %d lines" % (filename, lines))
+	except Exception as e:
+		print("Failed to write the password hashes : "+str(e))
+		raise
+
+
+
+
+def write_history(db, filename, format="john"):
+	try:
+		console = Console()
+		with console.status("[bold green][+] Writing password histories to %s..." % filename) as status:
+			with open(filename, "w") as output:
+				lines = dsWritePasswordHistory(db, output, format)
+		print("[+] Writing password histories to %s... %d lines" % (filename, lines))
+	except Exception as e:
+		print("Failed to write the password histories : "+str(e))
+		raise
+
+
+
+
+def write_kerberos(db, filename):
+	try:
+		console = Console()
+		with console.status("[bold green][+] Writing Kerberos keys to %s..." % filename) as status:
+			with open(filename, "w") as output:
+				lines = dsWriteKerberosKeys(db, output)
+		print("[+] Writing Kerberos keys to %s... %d keys" % (filename, lines))
+	except Exception as e:
+		print("Failed to write the Kerberos keys : "+str(e))
+		raise
+
 
 
 
@@ -272,6 +436,20 @@ def main():
 	parser.add_argument('-v', action="store_true", help='verbose mode')
 	file = parser.add_argument_group('File')
 	file.add_argument('-ntds', action='store', required=True, help='ntds file location')
+	file.add_argument('-native', action="store_true", help='read the ntds file directly instead of exporting it with esedbexport')
+	file.add_argument('-jobs', action='store', type=int, default=3, help='number of tables exported concurrently by esedbexport (default: 3)')
+	file.add_argument('-stream', action="store_true", help='build the indexes while esedbexport is still writing the tables')
+	file.add_argument('-workers', action='store', type=int, default=None, help='number of processes building the indexes of an exported datatable and materializing the objects (default: number of CPUs)')
+	file.add_argument('-record-cache', action='store', type=int, default=64, help='memory cap of the parsed record cache in MiB, 0 disables it (default: 64)')
+	file.add_argument('-cache', action='store', default=None, help='cache directory for the exported tables and indexes (default: ~/.cache/esedhound)')
+	file.add_argument('-no-cache', action="store_true", help='work in the current directory and remove the exported tables and indexes when done')
+	file.add_argument('-system', action='store', default=None, help='SYSTEM hive file location, needed to decrypt the password hashes and the Kerberos keys')
+	output = parser.add_argument_group('Output')
+	output.add_argument('-bloodhound', action='store', default=None, metavar='PATH', help='write the users, computers, groups and domains as BloodHound JSON files to the directory PATH, or to the zip archive PATH if it ends with .zip')
+	output.add_argument('-hashes', action='store', default=None, metavar='FILE', help='write the password hashes of the accounts to FILE (requires -system)')
+	output.add_argument('-history', action='store', default=None, metavar='FILE', help='write the password histories of the accounts to FILE (requires -system)')
+	output.add_argument('-kerberos', action='store', default=None, metavar='FILE', help='write the Kerberos keys of the accounts to FILE, one <account>:<key type>:<key> per line (requires -system)')
+	output.add_argument('-pwdformat', action='store', choices=['john', 'ophc'], default='john', help='format of the password hashes and histories: one hash per line (john) or one LM/NT pair per line (ophc) (default: john)')
 	if len(sys.argv)==1:
 		parser.print_help()
 		sys.exit(1)
@@ -280,23 +458,69 @@ def main():
 		print("No ntds file")
 		sys.exit(1)
 	else:
-		ntds = options.ntds
+		# esedbexport runs in the work directory
+		ntds = os.path.abspath(options.ntds)
+	secrets = options.hashes != None or options.history != None or options.kerberos != None
+	if secrets and options.system is None:
+		print("No SYSTEM hive file to decrypt the password hashes and the Kerberos keys")
+		sys.exit(1)
 	debug = options.v
+	dsSetRecordCacheSize(options.record_cache * 1024 * 1024)
 
-	export_tables(ntds)
-	db, dl = read_datatable()
-	
-	print_users(db)
+	if options.no_cache:
+		cache = None
+		workdir = os.getcwd()
+	else:
+		cache = dsCache(ntds, options.cache)
+		workdir = cache.Directory
+		print("[+] Using cache directory %s" % workdir)
 
-	#print_computers(db)
+	try:
+		if options.native:
+			if cache != None:
+				# Line offsets of the native reader are not those of the exports
+				workdir = os.path.join(workdir, "native")
+				os.makedirs(workdir, exist_ok=True)
+			db, dl = read_ese_database(ntds, workdir)
+		elif cache != None and cache.isComplete("export"):
+			print("[+] Reusing the tables exported by a previous run (Stage 0)...")
+			db, dl = read_datatable(workdir, options.workers)
+		else:
+			if cache != None:
+				# Leftovers of an interrupted run
+				cache.invalidate()
+			test_esedbexport()
+			if options.stream:
+				db, dl = stream_tables(ntds, workdir)
+			else:
+				export_tables(ntds, workdir, options.jobs)
+				db, dl = read_datatable(workdir, options.workers)
+			if cache != None:
+				cache.setComplete("export")
+
+		if secrets:
+			init_encryption(os.path.abspath(options.system))
+		if options.hashes != None:
+			write_hashes(db, os.path.abspath(options.hashes), options.pwdformat, options.workers)
+		if options.history != None:
+			write_history(db, os.path.abspath(options.history), options.pwdformat)
+		if options.kerberos != None:
+			write_kerberos(db, os.path.abspath(options.kerberos))
+
+		if options.bloodhound != None:
+			write_bloodhound(db, os.path.abspath(options.bloodhound), ntds, workdir, options.native, options.workers)
+		else:
+			print_users(db, workdir, options.workers)
 
-	#print_groups(db)
-	
-	# For further uses : extract ACLs from sd table
-	#read_sd_table()
+		#print_computers(db, workdir, options.workers)
 
+		#print_groups(db, workdir, options.workers)
 
-	os.system("rm -f ./*.map && rm -rf ./datatable.export && rm -rf ./link_table.export && rm -rf ./sd_table")
+		if debug:
+			print("\n[+] Record cache: %d hits, %d misses, %d evictions, %d records (%d bytes)" % dsGetRecordCacheStats())
+	finally:
+		if cache == None:
+			clean_workdir(workdir)
 
 
 
@@ -304,9 +528,4 @@ def main():
 
 
 if __name__ == "__main__":
-	try:
-		test_esedbexport()
-		main()
-	except KeyboardInterrupt:
-		os.system("rm -f ./*.map && rm -rf ./datatable.export && rm -rf ./link_table.export && rm -rf ./sd_table.export")
-		raise
+	main()
@@ -0,0 +1,142 @@
+'''
+Streaming writer for the BloodHound collector files.
+
+A collector file is {"data": [object, ...], "meta": {...}}. Objects are
+encoded one at a time and written in chunks as they come, and the meta
+block (which holds the object count) is written last, so the memory used
+does not depend on the number of objects. The files can be written
+directly into a zip archive, as BloodHound ingests them.
+'''
+
+import os
+import zipfile
+from json.encoder import encode_basestring
+
+BLOODHOUND_VERSION = 5
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def json_encode(value, parts):
+    '''
+    Appends the JSON encoding of value (dicts, lists, tuples, strings,
+    integers, booleans, None) to the list parts
+    '''
+    if isinstance(value, str):
+        parts.append(encode_basestring(value))
+    elif value is None:
+        parts.append("null")
+    elif value is True:
+        parts.append("true")
+    elif value is False:
+        parts.append("false")
+    elif isinstance(value, int):
+        parts.append(str(value))
+    elif isinstance(value, dict):
+        parts.append("{")
+        first = True
+        for (key, item) in value.items():
+            if not first:
+                parts.append(",")
+            first = False
+            parts.append(encode_basestring(key))
+            parts.append(":")
+            json_encode(item, parts)
+        parts.append("}")
+    elif isinstance(value, (list, tuple)):
+        parts.append("[")
+        first = True
+        for item in value:
+            if not first:
+                parts.append(",")
+            first = False
+            json_encode(item, parts)
+        parts.append("]")
+    elif isinstance(value, float):
+        parts.append(repr(value))
+    else:
+        raise TypeError("Cannot encode %r to JSON" % (value,))
+
+
+def json_dumps(value):
+    '''
+    Returns the JSON encoding of value, see json_encode
+    '''
+    parts = []
+    json_encode(value, parts)
+    return "".join(parts)
+
+
+class BloodHoundWriter(object):
+    '''
+    Writes the objects of one collector file (users, groups...) to a binary
+    file object
+    '''
+    def __init__(self, output, kind):
+        self.Output = output
+        self.Kind = kind
+        self.Count = 0
+        self._parts = ['{"data":[']
+        self._size = 0
+
+    def write(self, obj):
+        '''
+        Appends an object to the data array
+        '''
+        self.writeEncoded(json_dumps(obj))
+
+    def writeEncoded(self, text):
+        '''
+        Appends an object already encoded with json_dumps to the data array
+        '''
+        if self.Count > 0:
+            self._parts.append(",")
+        self._parts.append(text)
+        self.Count += 1
+        self._size += len(text) + 1
+        if self._size >= _CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.Output.write("".join(self._parts).encode('utf-8'))
+        self._parts = []
+        self._size = 0
+
+    def close(self):
+        '''
+        Writes the meta block and closes the file object
+        '''
+        self._parts.append('],"meta":')
+        json_encode({"methods" : 0, "type" : self.Kind, "count" : self.Count, "version" : BLOODHOUND_VERSION}, self._parts)
+        self._parts.append("}")
+        self.flush()
+        self.Output.close()
+
+
+class BloodHoundOutput(object):
+    '''
+    The collector files of a run, in a directory or in a zip archive
+    (filename ending with .zip)
+    '''
+    def __init__(self, filename):
+        self.Filename = filename
+        self.Zip = None
+        if filename.lower().endswith(".zip"):
+            self.Zip = zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED)
+        else:
+            os.makedirs(filename, exist_ok=True)
+
+    def open(self, kind):
+        '''
+        Returns a BloodHoundWriter for the file of kind (users, computers,
+        groups, domains). In a zip archive only one file can be written at
+        a time.
+        '''
+        name = "%s.json" % kind
+        if self.Zip != None:
+            return BloodHoundWriter(self.Zip.open(name, "w", force_zip64=True), kind)
+        return BloodHoundWriter(open(os.path.join(self.Filename, name), "wb"), kind)
+
+    def close(self):
+        if self.Zip != None:
+            self.Zip.close()
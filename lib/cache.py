@@ -0,0 +1,94 @@
+'''
+Per-DIT cache directory for the exported tables and the indexes.
+
+Every ntds.dit gets its own directory named after its fingerprint: the
+size and modification time of the file, a digest of its database header
+pages and a digest of the table and column definitions of its catalog.
+Maps built from one database can therefore never be loaded against
+another one, and repeated runs on the same evidence file reuse the exports
+and the indexes of the previous run.
+
+A stage only counts as cached once it has been marked complete, so the
+leftovers of an interrupted run are discarded instead of being reused.
+'''
+
+import hashlib
+import os
+import shutil
+from lib.esedb import ESEDB
+from lib.index import INDEX_VERSION
+
+CACHE_VERSION = 1
+
+_HEADER_SIZE = 8192
+
+
+def dsGetCacheRoot():
+    '''
+    Returns the default cache root, honouring XDG_CACHE_HOME
+    '''
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(root, "esedhound")
+
+
+def dsGetFingerprint(ntds):
+    '''
+    Returns the fingerprint of an ntds.dit file as a hex string
+    '''
+    st = os.stat(ntds)
+    digest = hashlib.sha256()
+    digest.update(("%d:%d:%d:%d\n" % (CACHE_VERSION, INDEX_VERSION, st.st_size, st.st_mtime_ns)).encode('ascii'))
+    try:
+        esedb = ESEDB(ntds)
+    except Exception:
+        # Not something the native reader understands, the raw header
+        # still tells databases apart
+        with open(ntds, 'rb') as f:
+            digest.update(f.read(2 * _HEADER_SIZE))
+        return digest.hexdigest()
+    try:
+        # The header and its shadow copy (checksum, state, log positions...)
+        digest.update(esedb.View[:2 * esedb.PageSize])
+        for name in sorted(esedb.getTableNames()):
+            table = esedb.getTable(name)
+            digest.update(("%s:%d:%d\n" % (name, table.ObjectId, table.RootPageNumber)).encode('utf-8'))
+            for column in table.Columns:
+                digest.update(("\t%s:%d:%d\n" % (column.Name, column.Identifier, column.Type)).encode('utf-8'))
+    finally:
+        esedb.close()
+    return digest.hexdigest()
+
+
+class dsCache(object):
+    '''
+    The cache directory of one ntds.dit file
+    '''
+    def __init__(self, ntds, root=None):
+        if root == None:
+            root = dsGetCacheRoot()
+        self.Fingerprint = dsGetFingerprint(ntds)
+        self.Directory = os.path.join(root, self.Fingerprint)
+        os.makedirs(self.Directory, exist_ok=True)
+
+    def _marker(self, stage):
+        return os.path.join(self.Directory, "%s.done" % stage)
+
+    def isComplete(self, stage):
+        '''
+        Returns True if stage has been completed by a previous run
+        '''
+        return os.path.isfile(self._marker(stage))
+
+    def setComplete(self, stage):
+        '''
+        Marks stage as complete
+        '''
+        with open(self._marker(stage), "w") as f:
+            f.write(self.Fingerprint + "\n")
+
+    def invalidate(self):
+        '''
+        Removes everything cached for this database
+        '''
+        shutil.rmtree(self.Directory, ignore_errors=True)
+        os.makedirs(self.Directory, exist_ok=True)
@@ -0,0 +1,646 @@
+'''
+Pure python reader for the Extensible Storage Engine (ESE) database format
+used by ntds.dit.
+
+The database file is memory-mapped and the table B-trees are walked
+directly, so records can be handed to ntds.dsdatabase without going
+through esedbexport and its TSV files. Records are returned as lists of
+strings formatted the same way esedbexport writes its cells (integers in
+decimal, binary data in hex, text decoded), so the rest of the code does
+not need to know where a record came from.
+
+Format notes are based on https://github.com/libyal/libesedb
+'''
+
+import mmap
+from os import stat
+from struct import Struct, unpack_from
+from binascii import hexlify
+
+ESE_SIGNATURE = 0x89abcdef
+
+CATALOG_PAGE_NUMBER = 4
+
+#===============================================================================
+# Page flags
+#===============================================================================
+PAGE_FLAG_ROOT       = 0x0001
+PAGE_FLAG_LEAF       = 0x0002
+PAGE_FLAG_PARENT     = 0x0004
+PAGE_FLAG_EMPTY      = 0x0008
+PAGE_FLAG_SPACE_TREE = 0x0020
+PAGE_FLAG_INDEX      = 0x0040
+PAGE_FLAG_LONG_VALUE = 0x0080
+
+#===============================================================================
+# Page tag flags
+#===============================================================================
+TAG_FLAG_VERSION = 0x1
+TAG_FLAG_DEFUNCT = 0x2
+TAG_FLAG_COMMON  = 0x4
+
+#===============================================================================
+# Tagged data flags
+#===============================================================================
+TAGGED_FLAG_LONG_VALUE  = 0x01
+TAGGED_FLAG_COMPRESSED  = 0x02
+TAGGED_FLAG_SEPARATED   = 0x04
+TAGGED_FLAG_MULTI_VALUE = 0x08
+TAGGED_FLAG_TWO_VALUES  = 0x10
+
+#===============================================================================
+# Catalog types
+#===============================================================================
+CATALOG_TYPE_TABLE      = 1
+CATALOG_TYPE_COLUMN     = 2
+CATALOG_TYPE_INDEX      = 3
+CATALOG_TYPE_LONG_VALUE = 4
+CATALOG_TYPE_CALLBACK   = 5
+
+#===============================================================================
+# Column types
+#===============================================================================
+JET_coltypNil           = 0
+JET_coltypBit           = 1
+JET_coltypUnsignedByte  = 2
+JET_coltypShort         = 3
+JET_coltypLong          = 4
+JET_coltypCurrency      = 5
+JET_coltypIEEESingle    = 6
+JET_coltypIEEEDouble    = 7
+JET_coltypDateTime      = 8
+JET_coltypBinary        = 9
+JET_coltypText          = 10
+JET_coltypLongBinary    = 11
+JET_coltypLongText      = 12
+JET_coltypSLV           = 13
+JET_coltypUnsignedLong  = 14
+JET_coltypLongLong      = 15
+JET_coltypGUID          = 16
+JET_coltypUnsignedShort = 17
+
+_COLUMN_FORMATS = {
+    JET_coltypBit           : Struct('<B'),
+    JET_coltypUnsignedByte  : Struct('<B'),
+    JET_coltypShort         : Struct('<h'),
+    JET_coltypLong          : Struct('<l'),
+    JET_coltypCurrency      : Struct('<q'),
+    JET_coltypIEEESingle    : Struct('<f'),
+    JET_coltypIEEEDouble    : Struct('<d'),
+    JET_coltypDateTime      : Struct('<d'),
+    JET_coltypUnsignedLong  : Struct('<L'),
+    JET_coltypLongLong      : Struct('<q'),
+    JET_coltypUnsignedShort : Struct('<H'),
+}
+
+_TEXT_COLUMN_TYPES = (JET_coltypText, JET_coltypLongText)
+
+_CODEPAGES = {
+    1200  : 'utf-16-le',
+    1252  : 'cp1252',
+    20127 : 'ascii',
+}
+
+#===============================================================================
+# Compression types (first byte of compressed data >> 3)
+#===============================================================================
+COMPRESSION_7BIT_ASCII   = 1
+COMPRESSION_7BIT_UNICODE = 2
+COMPRESSION_XPRESS       = 3
+
+_UINT16 = Struct('<H')
+_UINT32 = Struct('<I')
+_DB_HEADER = Struct('<4xI')
+_DB_FORMAT = Struct('<II')
+_PAGE_HEADER = Struct('<8x8xIIIHHHHI')
+_TAG = Struct('<HH')
+_DATA_DEFINITION_HEADER = Struct('<BBH')
+_CATALOG_ENTRY = Struct('<IHII')
+
+
+class ESEError(Exception):
+    """Raised when the database file cannot be parsed."""
+
+
+def _decompress7bit(data, widen):
+    '''
+    Decompresses 7-bit packed ASCII (or UTF-16 when widen is set) data
+    '''
+    cbitfinal = (data[0] & 0x07) + 1
+    cbittotal = (len(data) - 2) * 8 + cbitfinal
+    out = bytearray()
+    value = 0
+    bits = 0
+    for byte in data[1:]:
+        value |= byte << bits
+        bits += 8
+        while bits >= 7 and cbittotal >= 7:
+            out.append(value & 0x7f)
+            if widen:
+                out.append(0)
+            value >>= 7
+            bits -= 7
+            cbittotal -= 7
+    return bytes(out)
+
+
+def _decompressXpress(data):
+    '''
+    Decompresses plain LZ77 (MS-XCA "Xpress") data
+    '''
+    out = bytearray()
+    size = len(data)
+    i = 0
+    flags = 0
+    flagcount = 0
+    halfbyte = -1
+    while i < size:
+        if flagcount == 0:
+            if i + 4 > size:
+                break
+            (flags,) = _UINT32.unpack_from(data, i)
+            i += 4
+            flagcount = 32
+        flagcount -= 1
+        if flags & (1 << flagcount) == 0:
+            out.append(data[i])
+            i += 1
+            continue
+        if i + 2 > size:
+            break
+        (match,) = _UINT16.unpack_from(data, i)
+        i += 2
+        length = match & 0x07
+        distance = (match >> 3) + 1
+        if length == 7:
+            if halfbyte == -1:
+                halfbyte = i
+                length = data[i] & 0x0f
+                i += 1
+            else:
+                length = data[halfbyte] >> 4
+                halfbyte = -1
+            if length == 15:
+                length = data[i]
+                i += 1
+                if length == 255:
+                    (length,) = _UINT16.unpack_from(data, i)
+                    i += 2
+                    if length == 0:
+                        (length,) = _UINT32.unpack_from(data, i)
+                        i += 4
+                    length -= 15 + 7
+                length += 15
+            length += 7
+        length += 3
+        start = len(out) - distance
+        if start < 0:
+            raise ESEError("Invalid Xpress back reference")
+        for j in range(length):
+            out.append(out[start + j])
+    return bytes(out)
+
+
+def _decompress(data):
+    '''
+    Decompresses a compressed column value
+    '''
+    if len(data) == 0:
+        return b""
+    ctype = data[0] >> 3
+    if ctype == COMPRESSION_7BIT_ASCII:
+        return _decompress7bit(data, False)
+    if ctype == COMPRESSION_7BIT_UNICODE:
+        return _decompress7bit(data, True)
+    if ctype == COMPRESSION_XPRESS:
+        return _decompressXpress(data[3:])
+    raise ESEError("Unsupported compression type %d" % ctype)
+
+
+class ESEColumn(object):
+    '''
+    A column definition read from the catalog
+    '''
+    def __init__(self, name, identifier, coltype, size, codepage, recordoffset=0):
+        self.Name = name
+        self.Identifier = identifier
+        self.Type = coltype
+        self.Size = size
+        self.CodePage = codepage
+        self.RecordOffset = recordoffset
+        self.Index = -1
+        self.FixedOffset = -1
+
+
+class ESEPage(object):
+    '''
+    A single database page
+    '''
+    def __init__(self, db, pagenum):
+        self.Number = pagenum
+        self.Offset = (pagenum + 1) * db.PageSize
+        if self.Offset + db.PageSize > db.Size:
+            raise ESEError("Page %d is beyond the end of the file" % pagenum)
+        self._db = db
+        (self.PreviousPageNumber,
+         self.NextPageNumber,
+         self.FatherDataPageId,
+         _available,
+         _uncommitted,
+         _firstoffset,
+         self.TagCount,
+         self.Flags) = _PAGE_HEADER.unpack_from(db.Map, self.Offset)
+
+    def getTag(self, tagnum):
+        '''
+        Returns the flags and the data of a page tag
+        '''
+        db = self._db
+        (size, offset) = _TAG.unpack_from(db.Map, self.Offset + db.PageSize - 4 * (tagnum + 1))
+        if db.LargePages:
+            size &= 0x7fff
+            offset &= 0x7fff
+            start = self.Offset + db.PageHeaderSize + offset
+            flags = db.Map[start + 1] >> 5
+        else:
+            flags = offset >> 13
+            size &= 0x1fff
+            offset &= 0x1fff
+            start = self.Offset + db.PageHeaderSize + offset
+        return flags, db.View[start:start + size]
+
+    def getEntry(self, tagnum):
+        '''
+        Returns the flags, the full key and the data of a page entry
+        '''
+        (flags, data) = self.getTag(tagnum)
+        pos = 0
+        common = 0
+        if flags & TAG_FLAG_COMMON:
+            (common,) = _UINT16.unpack_from(data, 0)
+            pos = 2
+        (local,) = _UINT16.unpack_from(data, pos)
+        if pos == 0 and self._db.LargePages:
+            local &= 0x1fff
+        elif self._db.LargePages:
+            common &= 0x1fff
+        pos += 2
+        key = bytes(data[pos:pos + local])
+        if common > 0:
+            key = bytes(self.getTag(0)[1][:common]) + key
+        return flags, key, data[pos + local:]
+
+    def isLeaf(self):
+        return self.Flags & PAGE_FLAG_LEAF != 0
+
+
+class ESETable(object):
+    '''
+    A table of the database. Offers the same record access methods as the
+    TSV tables read by ntds.dsdatabase.
+    '''
+    def __init__(self, db, name, objid, root):
+        self.Name = name
+        self.ObjectId = objid
+        self.RootPageNumber = root
+        self.LongValueRootPageNumber = -1
+        self.Columns = []
+        self.Size = db.Size
+        self._db = db
+        self._fixed = []
+        self._variable = {}
+        self._tagged = {}
+        self._position = 0
+        self.Offsets = []
+
+    def _addColumn(self, column):
+        column.Index = len(self.Columns)
+        self.Columns.append(column)
+
+    def _finalize(self):
+        '''
+        Sorts the columns and precomputes the fixed column layout. Fixed
+        columns are stored in identifier order and deleted ones keep their
+        space, so the offset recorded in the catalog is used when there is
+        one. Otherwise it is computed from the preceding identifiers, and is
+        unknown (-1, the column is not decoded) after an identifier missing
+        from the catalog.
+        '''
+        self.Columns.sort(key=lambda c: c.Identifier)
+        offset = _DATA_DEFINITION_HEADER.size
+        identifier = 1
+        for (index, column) in enumerate(self.Columns):
+            column.Index = index
+            if column.Identifier <= 127:
+                if column.Identifier != identifier:
+                    offset = -1
+                if column.RecordOffset >= _DATA_DEFINITION_HEADER.size:
+                    offset = column.RecordOffset
+                column.FixedOffset = offset
+                if offset != -1:
+                    offset += column.Size
+                identifier = column.Identifier + 1
+                self._fixed.append(column)
+            elif column.Identifier <= 255:
+                self._variable[column.Identifier] = column
+            else:
+                self._tagged[column.Identifier] = column
+
+    def getFieldNames(self):
+        '''
+        Returns the column names, the equivalent of the esedbexport header line
+        '''
+        return [column.Name for column in self.Columns]
+
+    def records(self):
+        '''
+        Yields (position, record) for every record of the table
+        '''
+        for page in self._db.iterLeafPages(self.RootPageNumber):
+            self._position = page.Offset
+            for tagnum in range(1, page.TagCount):
+                (flags, key, data) = page.getEntry(tagnum)
+                if flags & TAG_FLAG_DEFUNCT:
+                    continue
+                yield (page.Number << 16) | tagnum, self._decodeRecord(data)
+        self._position = self.Size
+
+    def setOffsets(self, offsets):
+        '''
+        Sets the array mapping line ids to record positions
+        '''
+        self.Offsets = offsets
+
+    def setProjection(self, projection):
+        '''
+        Records are decoded column by column from the page data, there is no
+        line to project
+        '''
+        pass
+
+    def getRecord(self, lineid):
+        '''
+        Returns the record of line lineid
+        '''
+        return self.getRecordAt(self.Offsets[lineid])
+
+    def getRecordAt(self, position):
+        '''
+        Returns the record stored at position (as yielded by records())
+        '''
+        try:
+            page = self._db.getPage(position >> 16)
+            (flags, key, data) = page.getEntry(position & 0xffff)
+        except Exception:
+            return None
+        return self._decodeRecord(data)
+
+    def getRecords(self, lineids):
+        '''
+        Yields (lineid, record) for lineids, which must be sorted by
+        position. Records stored on the same page share one page read.
+        '''
+        page = None
+        for lineid in lineids:
+            position = self.Offsets[lineid]
+            try:
+                if page is None or page.Number != position >> 16:
+                    page = self._db.getPage(position >> 16)
+                (flags, key, data) = page.getEntry(position & 0xffff)
+            except Exception:
+                page = None
+                yield lineid, None
+                continue
+            yield lineid, self._decodeRecord(data)
+
+    def getProgress(self):
+        return self._position * 100 / self.Size
+
+    def _decodeRecord(self, data):
+        '''
+        Decodes the raw record data into a list of strings
+        '''
+        record = [""] * len(self.Columns)
+        (lastfixed, lastvariable, varoffset) = _DATA_DEFINITION_HEADER.unpack_from(data, 0)
+
+        # Fixed size columns, followed by a null bitmap
+        if lastfixed > 0:
+            nullmap = varoffset - (lastfixed + 7) // 8
+            for column in self._fixed:
+                if column.Identifier > lastfixed:
+                    break
+                bit = column.Identifier - 1
+                if column.FixedOffset == -1 or data[nullmap + bit // 8] & (1 << (bit % 8)):
+                    continue
+                record[column.Index] = self._formatValue(column, data[column.FixedOffset:column.FixedOffset + column.Size])
+
+        # Variable size columns
+        numvariable = lastvariable - 127 if lastvariable > 127 else 0
+        varstart = varoffset + 2 * numvariable
+        previous = 0
+        for i in range(numvariable):
+            (end,) = _UINT16.unpack_from(data, varoffset + 2 * i)
+            isnull = end & 0x8000
+            end &= 0x7fff
+            column = self._variable.get(128 + i)
+            if column is not None and not isnull:
+                record[column.Index] = self._formatValue(column, data[varstart + previous:varstart + end])
+            previous = end
+
+        # Tagged columns
+        tagstart = varstart + previous
+        if tagstart < len(data):
+            self._decodeTagged(data, tagstart, record)
+        return record
+
+    def _decodeTagged(self, data, tagstart, record):
+        largepages = self._db.LargePages
+        mask = 0x7fff if largepages else 0x3fff
+        (_identifier, first) = _TAG.unpack_from(data, tagstart)
+        count = (first & mask) // 4
+        items = []
+        for i in range(count):
+            (identifier, offset) = _TAG.unpack_from(data, tagstart + 4 * i)
+            items.append((identifier, offset & mask, largepages or offset & 0x4000))
+        for i in range(count):
+            (identifier, start, hasflags) = items[i]
+            end = items[i + 1][1] if i + 1 < count else len(data) - tagstart
+            column = self._tagged.get(identifier)
+            if column is None or end <= start:
+                continue
+            value = data[tagstart + start:tagstart + end]
+            flags = 0
+            if hasflags:
+                flags = value[0]
+                value = value[1:]
+            record[column.Index] = self._formatTagged(column, value, flags)
+
+    def _formatTagged(self, column, value, flags):
+        if flags & TAGGED_FLAG_MULTI_VALUE:
+            (first,) = _UINT16.unpack_from(value, 0)
+            count = (first & 0x7fff) // 2
+            offsets = [_UINT16.unpack_from(value, 2 * i)[0] for i in range(count)]
+            values = []
+            for i in range(count):
+                start = offsets[i] & 0x7fff
+                end = offsets[i + 1] & 0x7fff if i + 1 < count else len(value)
+                item = value[start:end]
+                if offsets[i] & 0x8000:
+                    item = self._readLongValue(item)
+                values.append(self._formatValue(column, item))
+            return ";".join(values)
+        if flags & TAGGED_FLAG_TWO_VALUES:
+            size = value[0]
+            return ";".join([self._formatValue(column, value[1:1 + size]),
+                             self._formatValue(column, value[1 + size:])])
+        if flags & TAGGED_FLAG_SEPARATED:
+            value = self._readLongValue(value)
+        if flags & TAGGED_FLAG_COMPRESSED:
+            value = _decompress(value)
+        return self._formatValue(column, value)
+
+    def _formatValue(self, column, value):
+        '''
+        Formats a raw column value the way esedbexport does
+        '''
+        if column.Type in _TEXT_COLUMN_TYPES:
+            codec = _CODEPAGES.get(column.CodePage, 'utf-16-le')
+            return bytes(value).decode(codec, 'replace').rstrip('\x00')
+        fmt = _COLUMN_FORMATS.get(column.Type)
+        if fmt is not None and len(value) == fmt.size:
+            return str(fmt.unpack_from(value)[0])
+        return hexlify(value).decode('ascii')
+
+    def _readLongValue(self, reference):
+        '''
+        Reassembles a value stored in the long value tree of the table
+        '''
+        if self.LongValueRootPageNumber == -1:
+            return b""
+        lid = int.from_bytes(bytes(reference), 'little').to_bytes(len(reference), 'big')
+        chunks = []
+        for (key, data) in self._db.iterEntriesFrom(self.LongValueRootPageNumber, lid):
+            if not key.startswith(lid):
+                break
+            if len(key) > len(lid):
+                chunks.append(bytes(data))
+        return b"".join(chunks)
+
+
+class ESEDB(object):
+    '''
+    A memory-mapped ESE database file
+    '''
+    def __init__(self, filename):
+        self.Filename = filename
+        self.Size = stat(filename).st_size
+        self._file = open(filename, 'rb')
+        self.Map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.View = memoryview(self.Map)
+        (signature,) = _DB_HEADER.unpack_from(self.Map, 0)
+        if signature != ESE_SIGNATURE:
+            self.close()
+            raise ESEError("%s is not an ESE database" % filename)
+        (self.Version,) = _UINT32.unpack_from(self.Map, 8)
+        (self.FormatRevision, self.PageSize) = _DB_FORMAT.unpack_from(self.Map, 232)
+        self.LargePages = self.FormatRevision >= 0x11 and self.PageSize > 8192
+        self.PageHeaderSize = 80 if self.LargePages else 40
+        self.PageCount = self.Size // self.PageSize - 1
+        self._tables = {}
+        self._parseCatalog()
+
+    def close(self):
+        try:
+            self.View.release()
+            self.Map.close()
+        finally:
+            self._file.close()
+
+    def getPage(self, pagenum):
+        return ESEPage(self, pagenum)
+
+    def iterLeafPages(self, root):
+        '''
+        Yields the leaf pages of the B-tree starting at root, in key order
+        '''
+        page = self.getPage(root)
+        while not page.isLeaf():
+            if page.TagCount <= 1:
+                return
+            (flags, key, data) = page.getEntry(1)
+            page = self.getPage(_UINT32.unpack_from(data, 0)[0])
+        while True:
+            yield page
+            if page.NextPageNumber == 0:
+                break
+            page = self.getPage(page.NextPageNumber)
+
+    def iterEntriesFrom(self, root, key):
+        '''
+        Yields (key, data) for the leaf entries of the B-tree starting at
+        root, beginning with the leaf page that may contain key
+        '''
+        page = self.getPage(root)
+        while not page.isLeaf():
+            child = -1
+            for tagnum in range(1, page.TagCount):
+                (flags, separator, data) = page.getEntry(tagnum)
+                child = _UINT32.unpack_from(data, 0)[0]
+                if separator == b"" or separator >= key:
+                    break
+            if child == -1:
+                return
+            page = self.getPage(child)
+        while True:
+            for tagnum in range(1, page.TagCount):
+                (flags, entrykey, data) = page.getEntry(tagnum)
+                if flags & TAG_FLAG_DEFUNCT or entrykey < key:
+                    continue
+                yield entrykey, data
+            if page.NextPageNumber == 0:
+                break
+            page = self.getPage(page.NextPageNumber)
+
+    def _parseCatalog(self):
+        objects = {}
+        for page in self.iterLeafPages(CATALOG_PAGE_NUMBER):
+            for tagnum in range(1, page.TagCount):
+                (flags, key, data) = page.getEntry(tagnum)
+                if flags & TAG_FLAG_DEFUNCT:
+                    continue
+                (lastfixed, lastvariable, varoffset) = _DATA_DEFINITION_HEADER.unpack_from(data, 0)
+                (objid, ctype, identifier, pagenum) = _CATALOG_ENTRY.unpack_from(data, 4)
+                size = _UINT32.unpack_from(data, 18)[0] if lastfixed >= 5 else 0
+                codepage = _UINT32.unpack_from(data, 26)[0] if lastfixed >= 7 else 0
+                recordoffset = 0
+                if lastfixed >= 9 and not data[varoffset - (lastfixed + 7) // 8 + 1] & 0x01:
+                    # RecordOffset (column 9) is not null
+                    (recordoffset,) = _UINT16.unpack_from(data, 31)
+                numvariable = lastvariable - 127 if lastvariable > 127 else 0
+                if numvariable == 0:
+                    continue
+                namelen = _UINT16.unpack_from(data, varoffset)[0] & 0x7fff
+                namestart = varoffset + 2 * numvariable
+                name = bytes(data[namestart:namestart + namelen]).decode('ascii', 'replace')
+                if ctype == CATALOG_TYPE_TABLE:
+                    table = ESETable(self, name, objid, pagenum)
+                    objects[objid] = table
+                    self._tables[name] = table
+                elif ctype == CATALOG_TYPE_COLUMN and objid in objects:
+                    objects[objid]._addColumn(ESEColumn(name, identifier, pagenum, size, codepage & 0xffff, recordoffset))
+                elif ctype == CATALOG_TYPE_LONG_VALUE and objid in objects:
+                    objects[objid].LongValueRootPageNumber = pagenum
+        for table in self._tables.values():
+            table._finalize()
+
+    def getTableNames(self):
+        return list(self._tables.keys())
+
+    def getTable(self, name):
+        '''
+        Returns the table called name
+        '''
+        try:
+            return self._tables[name]
+        except KeyError:
+            raise ESEError("Table %s not found in %s" % (name, self.Filename))
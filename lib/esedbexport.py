@@ -32,7 +32,8 @@ esedbxtract extracting hashes from ntds.dit and system files.
 
 import logging
 import os
-from subprocess import DEVNULL, STDOUT, check_call
+import time
+from subprocess import DEVNULL, STDOUT, Popen, check_call
 from command import Command
 
 
@@ -129,6 +130,36 @@ class ESEDBExport(object):
             #cmd = ' '.join(cmd)
             return cmd
 
+        def _build_args(self, exe, table, source):
+            """Build argument list for a subprocess (no shell, output discarded by the caller)"""
+            return [exe, "-t", "./"+table, "-T", table, source]
+
+        def start(self):
+            """Start extraction in the background and return the Popen object"""
+            args = self._build_args(source=self._get_ntds(),
+                                    table=self._get_table(),
+                                    exe=self._get_exe())
+            self.log.debug("starting {0}".format(' '.join(args)))
+            return Popen(args, cwd=self._get_workdir(), stdout=DEVNULL, stderr=STDOUT)
+
+        def wait_for_export(self, process, interval=0.1):
+            """Wait until the exporter has created its output file and return its path.
+
+            Returns None if the process exits without creating the file.
+            """
+            directory = os.path.join(self._get_workdir(), "{0}.export".format(self._get_table()))
+            prefix = "{0}.".format(self._get_table())
+            while True:
+                exited = process.poll() is not None
+                if os.path.isdir(directory):
+                    for filename in sorted(os.listdir(directory)):
+                        if filename.startswith(prefix):
+                            self._table_name = os.path.join(directory, filename)
+                            return self._table_name
+                if exited:
+                    return None
+                time.sleep(interval)
+
         def run(self):
             """Run extraction"""
             cmd = self._build_cmd(source=self._get_ntds(),
@@ -163,6 +194,44 @@ class ESEDBExport(object):
         """Return linktable"""
         return self._linktable
 
+    def run_concurrently(self, exporters, jobs=3, started=None, finished=None):
+        """Run ExportTable objects as supervised subprocesses, at most jobs at a time.
+
+        started(table) and finished(table, returncode, seconds) are called as
+        the subprocesses start and exit. Returns a list of
+        (table, returncode, seconds) in the order of exporters.
+        """
+        jobs = max(1, jobs)
+        pending = list(exporters)
+        running = {}
+        results = {}
+        try:
+            while pending or running:
+                while pending and len(running) < jobs:
+                    exporter = pending.pop(0)
+                    running[exporter._get_table()] = (exporter.start(), time.time())
+                    if started is not None:
+                        started(exporter._get_table())
+                for table, (process, start) in list(running.items()):
+                    returncode = process.poll()
+                    if returncode is None:
+                        continue
+                    elapsed = time.time() - start
+                    del running[table]
+                    results[table] = (table, returncode, elapsed)
+                    self.log.debug("{0} extractor exit status: {1} ({2:.1f}s)".format(table, returncode, elapsed))
+                    if finished is not None:
+                        finished(table, returncode, elapsed)
+                if running:
+                    time.sleep(0.1)
+        except BaseException:
+            for table, (process, start) in running.items():
+                self.log.debug("terminating {0} extractor".format(table))
+                process.terminate()
+                process.wait()
+            raise
+        return [results[exporter._get_table()] for exporter in exporters]
+
     def extract(self):
         """Extract tables"""
         if self.get_datatable() is None:
@@ -26,4 +26,15 @@ def format_john(user, hash, type):
         return user + ':' + hash + ':::'
 
 def format_ophc(user, lmhash, nthash):
-    return user + '::' + lmhash + ':' + nthash + ":::"
\ No newline at end of file
+    return user + '::' + lmhash + ':' + nthash + ":::"
+# Names of the Kerberos encryption types (see NTSecAPI.h)
+kerberos_key_types = {
+    1    : 'des-cbc-crc',
+    3    : 'des-cbc-md5',
+    17   : 'aes128-cts-hmac-sha1-96',
+    18   : 'aes256-cts-hmac-sha1-96',
+    -140 : 'rc4_hmac',
+}
+
+def format_kerberos(user, keytype, key):
+    return user + ':' + kerberos_key_types.get(keytype, str(keytype)) + ':' + key
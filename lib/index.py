@@ -0,0 +1,125 @@
+'''
+Versioned binary container for the maps built from the datatable.
+
+The file starts with a fixed header followed by a directory of named
+sections. Every section is a raw, 8-byte aligned block (typed arrays,
+string blobs) so that it can be memory-mapped and used in place without
+unpickling or copying.
+
+    header    : magic (8) | version (4) | section count (4)
+    directory : name (24, NUL padded) | offset (8) | length (8), per section
+    sections  : raw data
+'''
+
+import mmap
+import os
+from struct import Struct
+
+INDEX_MAGIC = b"ESEDHIDX"
+INDEX_VERSION = 2
+
+_HEADER = Struct('<8sII')
+_ENTRY = Struct('<24sQQ')
+_ALIGNMENT = 8
+
+
+class IndexFileError(Exception):
+    """Raised when an index file is missing, truncated or of another version."""
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class IndexWriter(object):
+    '''
+    Collects sections and writes them to an index file
+    '''
+    def __init__(self, filename):
+        self.Filename = filename
+        self._sections = []
+
+    def add(self, name, data):
+        '''
+        Adds a section. data can be bytes, an array or a memoryview
+        '''
+        if len(name.encode('ascii')) > _ENTRY.size - 16:
+            raise IndexFileError("Section name too long: %s" % name)
+        self._sections.append((name, memoryview(data).cast('B')))
+
+    def close(self):
+        '''
+        Writes the file, replacing any previous index atomically
+        '''
+        tmpname = self.Filename + ".tmp"
+        offset = _align(_HEADER.size + _ENTRY.size * len(self._sections))
+        directory = []
+        for (name, data) in self._sections:
+            directory.append((name, offset, len(data)))
+            offset = _align(offset + len(data))
+        with open(tmpname, "wb") as f:
+            f.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self._sections)))
+            for (name, offset, length) in directory:
+                f.write(_ENTRY.pack(name.encode('ascii'), offset, length))
+            for (name, offset, length), (_name, data) in zip(directory, self._sections):
+                f.write(b"\x00" * (offset - f.tell()))
+                f.write(data)
+        os.replace(tmpname, self.Filename)
+
+
+class IndexFile(object):
+    '''
+    A read-only, memory-mapped index file
+    '''
+    def __init__(self, filename):
+        self.Filename = filename
+        self._file = open(filename, "rb")
+        try:
+            self.Map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise IndexFileError("Empty index file %s" % filename)
+        self.View = memoryview(self.Map)
+        if len(self.Map) < _HEADER.size:
+            self.close()
+            raise IndexFileError("Truncated index file %s" % filename)
+        (magic, version, count) = _HEADER.unpack_from(self.Map, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            self.close()
+            raise IndexFileError("%s is not a version %d index file" % (filename, INDEX_VERSION))
+        self._sections = {}
+        for i in range(count):
+            (name, offset, length) = _ENTRY.unpack_from(self.Map, _HEADER.size + i * _ENTRY.size)
+            if offset + length > len(self.Map):
+                self.close()
+                raise IndexFileError("Truncated index file %s" % filename)
+            self._sections[name.rstrip(b"\x00").decode('ascii')] = (offset, length)
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def getBytes(self, name):
+        '''
+        Returns a section as a memoryview of bytes
+        '''
+        try:
+            (offset, length) = self._sections[name]
+        except KeyError:
+            raise IndexFileError("Section %s not found in %s" % (name, self.Filename))
+        return self.View[offset:offset + length]
+
+    def getArray(self, name, typecode):
+        '''
+        Returns a section as a typed memoryview (array typecode)
+        '''
+        return self.getBytes(name).cast(typecode)
+
+    def close(self):
+        try:
+            self.View.release()
+            self.Map.close()
+        except BufferError:
+            # Views handed out are still alive, the map goes away with them
+            pass
+        finally:
+            self._file.close()
@@ -19,12 +19,365 @@
 @contact:       csaba.barta@gmail.com
 '''
 
-import pickle
-
-def dsLoadMap(filename, map):
-    fmap = open(filename, "rb")
-    tmp = {}
-    tmp = pickle.load(fmap)
-    fmap.close()
-    for id in tmp:
-        map[id] = tmp[id]
\ No newline at end of file
+from array import array
+from bisect import bisect_left
+
+class dsArrayMap:
+    '''
+    Map from small non-negative integers (DNTs, line ids) to integers, stored
+    in a dense typed array indexed by the key. Holes hold the sentinel value
+    and behave like missing keys.
+    '''
+    def __init__(self, typecode='i', sentinel=-1):
+        self.Typecode = typecode
+        self.Values = array(typecode)
+        self.Sentinel = sentinel
+
+    def __getitem__(self, key):
+        try:
+            value = self.Values[key]
+        except IndexError:
+            raise KeyError(key)
+        if value == self.Sentinel or key < 0:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key < 0:
+            raise KeyError(key)
+        values = self.Values
+        if key >= len(values):
+            # Grow geometrically so that out of order keys stay cheap
+            size = max(key + 1, 2 * len(values))
+            values.extend(array(values.typecode, [self.Sentinel]) * (size - len(values)))
+        values[key] = value
+
+    def __contains__(self, key):
+        return 0 <= key < len(self.Values) and self.Values[key] != self.Sentinel
+
+    def __iter__(self):
+        sentinel = self.Sentinel
+        for key, value in enumerate(self.Values):
+            if value != sentinel:
+                yield key
+
+    def __len__(self):
+        if isinstance(self.Values, memoryview):
+            return sum(1 for key in self)
+        return len(self.Values) - self.Values.count(self.Sentinel)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        sentinel = self.Sentinel
+        for key, value in enumerate(self.Values):
+            if value != sentinel:
+                yield key, value
+
+    def clear(self):
+        self.Values = array(self.Typecode)
+
+    def save(self, index, name):
+        '''
+        Adds the map to an IndexWriter as section name
+        '''
+        index.add(name, self.Values)
+
+    def load(self, index, name):
+        '''
+        Uses section name of an IndexFile in place. The map is read-only
+        until clear() is called.
+        '''
+        self.Values = index.getArray(name, self.Typecode)
+
+class dsStringMap:
+    '''
+    Map from strings (names, SIDs, GUIDs) to integers.
+
+    While the map is built it is backed by a dict. Once saved to an index it
+    can be loaded as three sections: the UTF-8 keys sorted bytewise and
+    concatenated (.k), the offsets of every key in that blob (.o) and the
+    values in the same order (.v). Lookups are a binary search over the
+    mapped keys.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.Dict = {}
+        self.Keys = None
+        self.KeyOffsets = None
+        self.Values = None
+
+    def _key(self, i):
+        return bytes(self.Keys[self.KeyOffsets[i]:self.KeyOffsets[i + 1]])
+
+    def _find(self, key):
+        key = key.encode('utf-8')
+        lo = 0
+        hi = len(self.Values)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.Values) and self._key(lo) == key:
+            return lo
+        return -1
+
+    def __getitem__(self, key):
+        if self.Dict != None:
+            return self.Dict[key]
+        if not isinstance(key, str):
+            raise KeyError(key)
+        i = self._find(key)
+        if i == -1:
+            raise KeyError(key)
+        return self.Values[i]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if self.Dict == None:
+            raise TypeError("A loaded dsStringMap is read-only")
+        self.Dict[key] = value
+
+    def __contains__(self, key):
+        return self.get(key) != None
+
+    def __iter__(self):
+        if self.Dict != None:
+            for key in self.Dict:
+                yield key
+            return
+        for i in range(len(self.Values)):
+            yield self._key(i).decode('utf-8')
+
+    def __len__(self):
+        if self.Dict != None:
+            return len(self.Dict)
+        return len(self.Values)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+    def save(self, index, name):
+        '''
+        Adds the map to an IndexWriter as sections name.k, name.o and name.v
+        '''
+        entries = sorted((key.encode('utf-8'), value) for (key, value) in self.items())
+        offsets = array('q', [0])
+        values = array('i')
+        for (key, value) in entries:
+            offsets.append(offsets[-1] + len(key))
+            values.append(value)
+        index.add(name + ".k", b"".join(key for (key, value) in entries))
+        index.add(name + ".o", offsets)
+        index.add(name + ".v", values)
+
+    def load(self, index, name):
+        '''
+        Uses the sections of an IndexFile in place
+        '''
+        self.Keys = index.getBytes(name + ".k")
+        self.KeyOffsets = index.getArray(name + ".o", 'q')
+        self.Values = index.getArray(name + ".v", 'i')
+        self.Dict = None
+
+class dsListMap:
+    '''
+    Map from integers (DNTs, type ids) to lists of integers.
+
+    While the map is built it is backed by a dict of lists. Once saved to an
+    index it can be loaded in compressed sparse row form: the sorted keys
+    (.k), the start of every key's list in the values (.o, one more entry
+    than keys) and all the lists concatenated (.v). A lookup returns a
+    read-only slice of the mapped values. Keys are saved as int32 unless
+    another array typecode is given (sd_ids are int64).
+    '''
+    def __init__(self, keytypecode='i'):
+        self.KeyTypecode = keytypecode
+        self.clear()
+
+    def clear(self):
+        self.Dict = {}
+        self.Keys = None
+        self.Offsets = None
+        self.Values = None
+
+    def _find(self, key):
+        i = bisect_left(self.Keys, key)
+        if i < len(self.Keys) and self.Keys[i] == key:
+            return i
+        return -1
+
+    def __getitem__(self, key):
+        if self.Dict != None:
+            return self.Dict[key]
+        if not isinstance(key, int):
+            raise KeyError(key)
+        i = self._find(key)
+        if i == -1:
+            raise KeyError(key)
+        return self.Values[self.Offsets[i]:self.Offsets[i + 1]]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if self.Dict == None:
+            raise TypeError("A loaded dsListMap is read-only")
+        self.Dict[key] = value
+
+    def __contains__(self, key):
+        return self.get(key) != None
+
+    def __iter__(self):
+        if self.Dict != None:
+            return iter(self.Dict)
+        return iter(self.Keys)
+
+    def __len__(self):
+        if self.Dict != None:
+            return len(self.Dict)
+        return len(self.Keys)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+    def save(self, index, name):
+        '''
+        Adds the map to an IndexWriter as sections name.k, name.o and name.v
+        '''
+        keys = array(self.KeyTypecode, sorted(self.keys()))
+        offsets = array('q', [0])
+        values = array('i')
+        for key in keys:
+            values.extend(self[key])
+            offsets.append(len(values))
+        index.add(name + ".k", keys)
+        index.add(name + ".o", offsets)
+        index.add(name + ".v", values)
+
+    def load(self, index, name):
+        '''
+        Uses the sections of an IndexFile in place
+        '''
+        self.Keys = index.getArray(name + ".k", self.KeyTypecode)
+        self.Offsets = index.getArray(name + ".o", 'q')
+        self.Values = index.getArray(name + ".v", 'i')
+        self.Dict = None
+
+class dsAdjacencyMap:
+    '''
+    Map from DNTs to the list of (linked DNT, deltime) of their links, in
+    compressed sparse row form: the links of key are Neighbours[o:e] and
+    DelTimes[o:e] with o = Offsets[key] and e = Offsets[key + 1]. Offsets
+    is indexed by the key, so a lookup is two array reads. Keys without
+    links behave like missing keys.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.Offsets = array('q', [0])
+        self.Neighbours = array('i')
+        self.DelTimes = array('q')
+
+    def build(self, keys, neighbours, deltimes):
+        '''
+        Fills the map from three parallel arrays (one entry per link) with a
+        counting sort on the keys. The links of a key keep their order.
+        '''
+        size = max(keys) + 1 if len(keys) else 0
+        counts = array('q', [0]) * (size + 1)
+        for key in keys:
+            counts[key + 1] += 1
+        for i in range(size):
+            counts[i + 1] += counts[i]
+        self.Offsets = array('q', counts)
+        positions = counts
+        self.Neighbours = array('i', [0]) * len(keys)
+        self.DelTimes = array('q', [0]) * len(keys)
+        for i in range(len(keys)):
+            key = keys[i]
+            position = positions[key]
+            positions[key] = position + 1
+            self.Neighbours[position] = neighbours[i]
+            self.DelTimes[position] = deltimes[i]
+
+    def _range(self, key):
+        if not isinstance(key, int) or key < 0 or key + 1 >= len(self.Offsets):
+            return (0, 0)
+        return (self.Offsets[key], self.Offsets[key + 1])
+
+    def __getitem__(self, key):
+        (start, end) = self._range(key)
+        if start == end:
+            raise KeyError(key)
+        return list(zip(self.Neighbours[start:end], self.DelTimes[start:end]))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        (start, end) = self._range(key)
+        return start != end
+
+    def __iter__(self):
+        offsets = self.Offsets
+        for key in range(len(offsets) - 1):
+            if offsets[key] != offsets[key + 1]:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+    def save(self, index, name):
+        '''
+        Adds the map to an IndexWriter as sections name.o, name.n and name.d
+        '''
+        index.add(name + ".o", self.Offsets)
+        index.add(name + ".n", self.Neighbours)
+        index.add(name + ".d", self.DelTimes)
+
+    def load(self, index, name):
+        '''
+        Uses the sections of an IndexFile in place, read-only
+        '''
+        self.Offsets = index.getArray(name + ".o", 'q')
+        self.Neighbours = index.getArray(name + ".n", 'i')
+        self.DelTimes = index.getArray(name + ".d", 'q')
@@ -0,0 +1,168 @@
+'''
+Minimal reader for the registry hive files (regf), enough to read the keys,
+their class names and their values from an offline SYSTEM hive.
+
+The hive starts with a 4096 byte base block, followed by the hive bins.
+Cell offsets are relative to the first bin, and every cell starts with its
+size (negative when the cell is allocated).
+
+Format notes are based on https://github.com/libyal/libregf
+'''
+
+from struct import Struct
+
+REGF_SIGNATURE = b"regf"
+
+REG_SZ        = 1
+REG_EXPAND_SZ = 2
+REG_BINARY    = 3
+REG_DWORD     = 4
+
+KEY_COMP_NAME   = 0x0020
+VALUE_COMP_NAME = 0x0001
+
+_BINS_OFFSET = 4096
+
+_BASE_BLOCK = Struct('<4s32xI')
+_CELL_SIZE = Struct('<i')
+_KEY = Struct('<2sH8x4x4xI4xI4xII4xI16x4xHH')
+_LIST = Struct('<2sH')
+_VALUE = Struct('<2sHIIIH2x')
+_UINT32 = Struct('<I')
+
+
+class RegistryError(Exception):
+    """Raised when the hive file cannot be parsed."""
+
+
+class RegistryKey(object):
+    '''
+    A key (nk record) of a hive
+    '''
+    def __init__(self, hive, offset):
+        data = hive.getCell(offset)
+        (signature, flags, self.SubKeyCount, self._subkeys, self.ValueCount, self._values,
+         self._classname, namelength, self._classlength) = _KEY.unpack_from(data, 0)
+        if signature != b"nk":
+            raise RegistryError("No key at offset 0x%x" % offset)
+        self._hive = hive
+        name = bytes(data[_KEY.size:_KEY.size + namelength])
+        self.Name = name.decode('latin-1') if flags & KEY_COMP_NAME else name.decode('utf-16-le')
+
+    def getClassName(self):
+        '''
+        Returns the class name of the key, "" if it has none
+        '''
+        if self._classlength == 0:
+            return ""
+        return bytes(self._hive.getCell(self._classname)[:self._classlength]).decode('utf-16-le')
+
+    def _iterSubKeyOffsets(self, offset):
+        data = self._hive.getCell(offset)
+        (signature, count) = _LIST.unpack_from(data, 0)
+        if signature in (b"lf", b"lh"):
+            step = 8
+        elif signature in (b"li", b"ri"):
+            step = 4
+        else:
+            raise RegistryError("Unknown subkey list %r at offset 0x%x" % (signature, offset))
+        for i in range(count):
+            (child,) = _UINT32.unpack_from(data, _LIST.size + step * i)
+            if signature == b"ri":
+                # Index of lists
+                for grandchild in self._iterSubKeyOffsets(child):
+                    yield grandchild
+            else:
+                yield child
+
+    def getSubKeys(self):
+        '''
+        Returns the subkeys of the key
+        '''
+        if self.SubKeyCount == 0:
+            return []
+        return [RegistryKey(self._hive, offset) for offset in self._iterSubKeyOffsets(self._subkeys)]
+
+    def getSubKey(self, name):
+        '''
+        Returns the subkey called name (case insensitive), or None
+        '''
+        name = name.lower()
+        for key in self.getSubKeys():
+            if key.Name.lower() == name:
+                return key
+        return None
+
+    def getValue(self, name):
+        '''
+        Returns (type, data) of the value called name (case insensitive, ""
+        for the default value), or None
+        '''
+        if self.ValueCount == 0:
+            return None
+        name = name.lower()
+        offsets = self._hive.getCell(self._values)
+        for i in range(self.ValueCount):
+            (offset,) = _UINT32.unpack_from(offsets, 4 * i)
+            data = self._hive.getCell(offset)
+            (signature, namelength, size, dataoffset, valuetype, flags) = _VALUE.unpack_from(data, 0)
+            if signature != b"vk":
+                raise RegistryError("No value at offset 0x%x" % offset)
+            valuename = bytes(data[_VALUE.size:_VALUE.size + namelength])
+            valuename = valuename.decode('latin-1') if flags & VALUE_COMP_NAME else valuename.decode('utf-16-le')
+            if valuename.lower() != name:
+                continue
+            if size & 0x80000000:
+                # Up to 4 bytes stored in the data offset
+                value = _UINT32.pack(dataoffset)[:size & 0x7fffffff]
+            else:
+                value = bytes(self._hive.getCell(dataoffset)[:size])
+            if valuetype == REG_DWORD and len(value) == 4:
+                return (valuetype, _UINT32.unpack(value)[0])
+            if valuetype in (REG_SZ, REG_EXPAND_SZ):
+                return (valuetype, value.decode('utf-16-le').rstrip('\x00'))
+            return (valuetype, value)
+        return None
+
+
+class RegistryHive(object):
+    '''
+    A registry hive file, read into memory
+    '''
+    def __init__(self, filename):
+        self.Filename = filename
+        with open(filename, 'rb') as f:
+            self.Data = f.read()
+        self.View = memoryview(self.Data)
+        if len(self.Data) < _BINS_OFFSET:
+            raise RegistryError("%s is too short to be a registry hive" % filename)
+        (signature, self._root) = _BASE_BLOCK.unpack_from(self.Data, 0)
+        if signature != REGF_SIGNATURE:
+            raise RegistryError("%s is not a registry hive" % filename)
+
+    def getCell(self, offset):
+        '''
+        Returns the data of the cell at offset
+        '''
+        position = _BINS_OFFSET + offset
+        if position + _CELL_SIZE.size > len(self.Data):
+            raise RegistryError("Cell offset 0x%x is beyond the end of the file" % offset)
+        (size,) = _CELL_SIZE.unpack_from(self.Data, position)
+        return self.View[position + _CELL_SIZE.size:position + abs(size)]
+
+    def getRootKey(self):
+        return RegistryKey(self, self._root)
+
+    def getKey(self, keypath):
+        '''
+        Returns the key at keypath (backslash separated, relative to the
+        root key), or None
+        '''
+        key = self.getRootKey()
+        for name in keypath.strip("\\").split("\\"):
+            if name == "":
+                continue
+            key = key.getSubKey(name)
+            if key == None:
+                return None
+        return key
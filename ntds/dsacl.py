@@ -0,0 +1,166 @@
+'''
+BloodHound edges from the security descriptors.
+
+Every ACE of a DACL is turned into the attack edges it grants (GenericAll,
+WriteDacl, ForceChangePassword, AddMember...) through tables keyed by
+access mask bits and by object type GUID, the latter only on the types of
+objects they are an attack path on (AddMember on groups...). The owner of
+the descriptor gets an Owns edge. Objects share a few thousand
+descriptors, and whether an inherited ACE applies only depends on the
+class of the object, so the edges are computed once per (sd_id, object
+type) and reused for every object having the same descriptor.
+'''
+from ntds.dsrecord import *
+from ntds.sd_table import *
+
+# Access mask bits (ADS_RIGHT_*)
+dsRightGenericAll    = 0x10000000
+dsRightGenericWrite  = 0x40000000
+dsRightWriteOwner    = 0x00080000
+dsRightWriteDacl     = 0x00040000
+dsRightControlAccess = 0x00000100
+dsRightWriteProperty = 0x00000020
+dsRightSelf          = 0x00000008
+dsRightFullControl   = 0x000F01FF
+
+# Edges granted by an access mask bit, whatever the object type of the ACE
+dsEdgesByRight = (
+    (dsRightWriteDacl,  "WriteDacl"),
+    (dsRightWriteOwner, "WriteOwner"),
+)
+
+# Edges granted for a specific object type GUID, by access mask bit, with
+# the BloodHound types of the objects they are an attack path on
+dsEdgesByGUID = {
+    dsRightControlAccess : {
+        "00299570-246d-11d0-a768-00aa006e0529" : ("ForceChangePassword", ("User", "Computer")),   # User-Force-Change-Password
+        "1131f6aa-9c07-11d1-f79f-00c04fc2dcd2" : ("GetChanges", ("Domain",)),                      # DS-Replication-Get-Changes
+        "1131f6ad-9c07-11d1-f79f-00c04fc2dcd2" : ("GetChangesAll", ("Domain",)),                   # DS-Replication-Get-Changes-All
+        "89e95b76-444d-4c62-991a-0facbeda640c" : ("GetChangesInFilteredSet", ("Domain",)),         # DS-Replication-Get-Changes-In-Filtered-Set
+    },
+    dsRightWriteProperty : {
+        "bf9679c0-0de6-11d0-a285-00aa003049e2" : ("AddMember", ("Group",)),                        # member
+        "f3a64788-5306-11d1-a9c5-0000f80367c1" : ("WriteSPN", ("User", "Computer")),               # servicePrincipalName
+        "5b47d60f-6090-40b2-9f37-2a4de88f3063" : ("AddKeyCredentialLink", ("User", "Computer")),   # msDS-KeyCredentialLink
+        "4c164200-20c0-11d0-a768-00aa006e0529" : ("WriteAccountRestrictions", ("Computer",)),      # User-Account-Restrictions
+    },
+    dsRightSelf : {
+        "bf9679c0-0de6-11d0-a285-00aa003049e2" : ("AddSelf", ("Group",)),                          # member
+    },
+}
+
+# BloodHound type of the object categories
+dsBloodHoundTypes = {
+    "Person"     : "User",
+    "Group"      : "Group",
+    "Computer"   : "Computer",
+    "Domain-DNS" : "Domain",
+}
+
+# Principals that are not accounts of the domain
+dsIgnoredPrincipals = frozenset([
+    "S-1-3-0",  # Creator Owner
+    "S-1-5-10", # Principal Self
+    "S-1-5-18", # Local System
+])
+
+dsACETypeAllowed       = 0x00
+dsACETypeAllowedObject = 0x05
+dsACEFlagInheritOnly   = 0x08
+dsACEFlagInherited     = 0x10
+
+dsMapEdgesBySdId = {} #Map that can be used to find the edges of a (sd_id, object type)
+dsMapBloodHoundTypeByTypeId = {} #Map that can be used to find the BloodHound type of an object type
+
+def dsGetBloodHoundType(dsDatabase, dsTypeId):
+    '''
+    Returns the BloodHound type (User, Computer, Group, Domain or Base) of
+    an object type
+    '''
+    try:
+        return dsMapBloodHoundTypeByTypeId[dsTypeId]
+    except KeyError:
+        bhtype = dsBloodHoundTypes.get(dsGetTypeName(dsDatabase, dsTypeId), "Base")
+        dsMapBloodHoundTypeByTypeId[dsTypeId] = bhtype
+        return bhtype
+
+def dsGetACEEdges(ace, objecttype):
+    '''
+    Returns the names of the edges granted by an ACE to its SID on an object
+    of the BloodHound type objecttype
+    '''
+    mask = ace.Mask
+    edges = []
+    if ace.ObjectType == None and (mask & dsRightGenericAll or mask & dsRightFullControl == dsRightFullControl):
+        # Full control scoped to an object type only grants that property
+        # set / extended right, see below
+        return ["GenericAll"]
+    for (right, edge) in dsEdgesByRight:
+        if mask & right:
+            edges.append(edge)
+    if ace.ObjectType == None:
+        # No object type, the rights apply to every property / extended right
+        if mask & dsRightGenericWrite or mask & dsRightWriteProperty:
+            edges.append("GenericWrite")
+        if mask & dsRightControlAccess:
+            edges.append("AllExtendedRights")
+    else:
+        if mask & dsRightGenericWrite:
+            edges.append("GenericWrite")
+        for (right, edgesbyguid) in dsEdgesByGUID.items():
+            if mask & right:
+                (edge, objecttypes) = edgesbyguid.get(ace.ObjectType, (None, ()))
+                if objecttype in objecttypes:
+                    edges.append(edge)
+    return edges
+
+def dsGetDescriptorEdges(sd, classguids, objecttype):
+    '''
+    Returns the sorted (principal SID, edge, inherited) of a decoded
+    security descriptor, for an object of one of the classes classguids and
+    of the BloodHound type objecttype
+    '''
+    edges = set()
+    if sd.Owner != None and not sd.Owner in dsIgnoredPrincipals:
+        edges.add((sd.Owner, "Owns", False))
+    for ace in sd.DACL or ():
+        # Deny ACEs grant nothing, inherit only ACEs apply to the children
+        if ace.Type != dsACETypeAllowed and ace.Type != dsACETypeAllowedObject:
+            continue
+        if ace.Flags & dsACEFlagInheritOnly or ace.SID in dsIgnoredPrincipals:
+            continue
+        if ace.InheritedObjectType != None and not ace.InheritedObjectType in classguids:
+            continue
+        inherited = ace.Flags & dsACEFlagInherited != 0
+        for edge in dsGetACEEdges(ace, objecttype):
+            edges.add((ace.SID, edge, inherited))
+    return sorted(edges)
+
+def dsGetSdIdEdges(dsDatabase, dsSdId, dsTypeId):
+    '''
+    Returns the sorted (principal SID, edge, inherited) granted by the
+    security descriptor dsSdId on an object of type dsTypeId, computed once
+    per (sd_id, type)
+    '''
+    key = (dsSdId, dsTypeId)
+    try:
+        return dsMapEdgesBySdId[key]
+    except KeyError:
+        pass
+    sd = dsGetSecurityDescriptor(dsSdId)
+    if sd == None:
+        edges = []
+    else:
+        edges = dsGetDescriptorEdges(sd, dsGetClassGUIDs(dsDatabase, dsTypeId), dsGetBloodHoundType(dsDatabase, dsTypeId))
+    dsMapEdgesBySdId[key] = edges
+    return edges
+
+def dsGetRecordEdges(dsDatabase, dsRecordId):
+    '''
+    Returns the sorted (principal SID, edge, inherited) granted on a record
+    by its security descriptor
+    '''
+    sdid = dsMapSdIdByRecordId.get(int(dsRecordId))
+    if sdid == None:
+        return []
+    return dsGetSdIdEdges(dsDatabase, sdid, dsGetRecordType(dsDatabase, dsRecordId))
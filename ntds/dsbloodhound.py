@@ -0,0 +1,269 @@
+'''
+BloodHound objects built from the datatable.
+
+Users, computers, groups and domains are converted one at a time into the
+objects of the BloodHound collector files (version 5) and handed to a
+lib.bloodhound writer, so nothing but the small per-principal caches is
+kept in memory. ACEs come from the security descriptor edges when the
+sd_table has been loaded.
+'''
+from ntds.dsrecord import *
+from ntds.dsobjects import *
+from ntds.dspath import *
+from ntds.dsacl import *
+from ntds.dsworkers import *
+import ntds.sd_table
+from lib.bloodhound import *
+
+# userAccountControl flags
+dsUACAccountDisable        = 0x00000002
+dsUACPasswordNotRequired   = 0x00000020
+dsUACDontExpirePassword    = 0x00010000
+dsUACTrustedForDelegation  = 0x00080000
+dsUACNotDelegated          = 0x00100000
+dsUACDontRequirePreauth    = 0x00400000
+dsUACTrustedToAuth         = 0x01000000
+
+dsMapDomainNameBySID       = {} #Map that can be used to find the DNS name of a domain
+dsMapPrincipalByRecordId   = {} #Map that can be used to find the (identifier, type) of a record
+dsDefaultDomainName = ""
+
+def dsGetDomainNameFromDN(dn):
+    '''
+    Returns the DNS name of a domain from its DN (DC=corp,DC=com -> CORP.COM)
+    '''
+    return ".".join(rdn[3:] for rdn in dn.split(",") if rdn[:3].upper() == "DC=").upper()
+
+def dsInitBloodHound(dsDatabase):
+    '''
+    Loads the SID and the name of the domains of the database
+    '''
+    global dsDefaultDomainName
+    dsMapDomainNameBySID.clear()
+    dsMapPrincipalByRecordId.clear()
+    dsMapBloodHoundTypeByTypeId.clear()
+    dsDefaultDomainName = ""
+    for recordid in dsIterObjects(dsDatabase, "Domain-DNS"):
+        record = dsGetRecordByRecordId(dsDatabase, recordid)
+        if record == None or record[ntds.dsfielddictionary.dsSIDIndex] == "":
+            # Parents of the domain (DC=com) are Domain-DNS objects too
+            continue
+        try:
+            sid = str(SID(record[ntds.dsfielddictionary.dsSIDIndex]))
+        except:
+            continue
+        name = dsGetDomainNameFromDN(dsGetDN(dsDatabase, recordid))
+        dsMapDomainNameBySID[sid] = name
+        if dsDefaultDomainName == "":
+            dsDefaultDomainName = name
+
+def dsGetDomainSID(sid):
+    return sid[:sid.rfind("-")]
+
+def dsGetPrincipal(dsDatabase, sid):
+    '''
+    Returns the BloodHound (identifier, type) of a SID. Well-known SIDs not
+    issued by a domain are prefixed with the domain name, as BloodHound
+    does.
+    '''
+    recordid = dsMapRecordIdBySID.get(sid)
+    if recordid != None:
+        bhtype = dsGetBloodHoundType(dsDatabase, dsGetRecordType(dsDatabase, recordid))
+    else:
+        bhtype = "Group"
+    if sid.startswith("S-1-5-21-"):
+        return (sid, bhtype)
+    return ("%s-%s" % (dsDefaultDomainName, sid), bhtype)
+
+def dsGetPrincipalByRecordId(dsDatabase, dsRecordId):
+    '''
+    Returns the BloodHound (identifier, type) of a record, or None if it has
+    no SID
+    '''
+    try:
+        return dsMapPrincipalByRecordId[dsRecordId]
+    except KeyError:
+        pass
+    principal = None
+    record = dsGetRecordByRecordId(dsDatabase, dsRecordId)
+    if record != None and record[ntds.dsfielddictionary.dsSIDIndex] != "":
+        try:
+            principal = dsGetPrincipal(dsDatabase, str(SID(record[ntds.dsfielddictionary.dsSIDIndex])))
+        except:
+            pass
+    dsMapPrincipalByRecordId[dsRecordId] = principal
+    return principal
+
+def dsGetBloodHoundAces(dsDatabase, dsRecordId):
+    '''
+    Returns the ACEs of a record in BloodHound form, and whether its DACL
+    is protected from inheritance
+    '''
+    if ntds.sd_table.dsSdTable == None:
+        return ([], False)
+    aces = []
+    for (sid, right, inherited) in dsGetRecordEdges(dsDatabase, dsRecordId):
+        (identifier, bhtype) = dsGetPrincipal(dsDatabase, sid)
+        aces.append({"PrincipalSID" : identifier, "PrincipalType" : bhtype,
+                     "RightName" : right, "IsInherited" : inherited})
+    protected = False
+    sdid = dsMapSdIdByRecordId.get(int(dsRecordId))
+    if sdid != None:
+        sd = dsGetSecurityDescriptor(sdid)
+        protected = sd != None and sd.Control & ntds.sd_table.SE.SE_DACL_PROTECTED != 0
+    return (aces, protected)
+
+def dsGetBloodHoundTime(dsTimeStamp):
+    if dsVerifyDSTimeStamp(dsTimeStamp) == -1:
+        return -1
+    return dsGetPOSIXTimeStamp(dsTimeStamp)
+
+def dsGetBloodHoundProperties(dsDatabase, obj, name):
+    sid = str(obj.SID)
+    domainsid = dsGetDomainSID(sid)
+    domain = dsMapDomainNameBySID.get(domainsid, dsDefaultDomainName)
+    return {
+        "name"              : ("%s@%s" % (name, domain)).upper(),
+        "domain"            : domain,
+        "domainsid"         : domainsid,
+        "distinguishedname" : dsGetDN(dsDatabase, obj.RecordId).upper(),
+        "samaccountname"    : obj.SAMAccountName if isinstance(obj, dsAccount) else obj.Name,
+        "whencreated"       : dsGetBloodHoundTime(obj.WhenCreated),
+    }
+
+def dsGetBloodHoundAccount(dsDatabase, account, properties):
+    uac = account.UserAccountControl
+    if uac == -1:
+        uac = 0
+    properties["enabled"] = uac & dsUACAccountDisable == 0
+    properties["unconstraineddelegation"] = uac & dsUACTrustedForDelegation != 0
+    properties["trustedtoauth"] = uac & dsUACTrustedToAuth != 0
+    properties["lastlogon"] = dsGetBloodHoundTime(account.LastLogon)
+    properties["lastlogontimestamp"] = dsGetBloodHoundTime(account.LastLogonTimeStamp)
+    properties["pwdlastset"] = dsGetBloodHoundTime(account.PasswordLastSet)
+    (aces, protected) = dsGetBloodHoundAces(dsDatabase, account.RecordId)
+    sid = str(account.SID)
+    primarygroup = None
+    if account.PrimaryGroupID != -1:
+        primarygroup = "%s-%d" % (dsGetDomainSID(sid), account.PrimaryGroupID)
+    return {
+        "ObjectIdentifier"  : sid,
+        "Properties"        : properties,
+        "PrimaryGroupSID"   : primarygroup,
+        "Aces"              : aces,
+        "AllowedToDelegate" : [],
+        "HasSIDHistory"     : [],
+        "IsDeleted"         : account.IsDeleted,
+        "IsACLProtected"    : protected,
+    }
+
+def dsGetBloodHoundUser(dsDatabase, user):
+    '''
+    Returns the BloodHound object of a dsUser
+    '''
+    properties = dsGetBloodHoundProperties(dsDatabase, user, user.SAMAccountName)
+    uac = max(user.UserAccountControl, 0)
+    properties["userprincipalname"] = user.PrincipalName if user.PrincipalName != "" else None
+    properties["sensitive"] = uac & dsUACNotDelegated != 0
+    properties["dontreqpreauth"] = uac & dsUACDontRequirePreauth != 0
+    properties["passwordnotreqd"] = uac & dsUACPasswordNotRequired != 0
+    properties["pwdneverexpires"] = uac & dsUACDontExpirePassword != 0
+    obj = dsGetBloodHoundAccount(dsDatabase, user, properties)
+    obj["SPNTargets"] = []
+    return obj
+
+def dsGetBloodHoundComputer(dsDatabase, computer):
+    '''
+    Returns the BloodHound object of a dsComputer
+    '''
+    name = computer.DNSHostName if computer.DNSHostName != "" else computer.Name
+    properties = dsGetBloodHoundProperties(dsDatabase, computer, name)
+    if computer.DNSHostName != "":
+        properties["name"] = computer.DNSHostName.upper()
+    properties["operatingsystem"] = computer.OSName if computer.OSName != "" else None
+    obj = dsGetBloodHoundAccount(dsDatabase, computer, properties)
+    obj["AllowedToAct"] = []
+    notcollected = {"Collected" : False, "FailureReason" : None, "Results" : []}
+    for collection in ("Sessions", "PrivilegedSessions", "RegistrySessions", "LocalAdmins", "RemoteDesktopUsers", "DcomUsers", "PSRemoteUsers"):
+        obj[collection] = notcollected
+    return obj
+
+def dsGetBloodHoundGroup(dsDatabase, group):
+    '''
+    Returns the BloodHound object of a dsGroup
+    '''
+    properties = dsGetBloodHoundProperties(dsDatabase, group, group.Name)
+    members = []
+    for (member, deltime) in group.getMembers():
+        if deltime != -1:
+            continue
+        principal = dsGetPrincipalByRecordId(dsDatabase, member)
+        if principal != None:
+            members.append({"ObjectIdentifier" : principal[0], "ObjectType" : principal[1]})
+    (aces, protected) = dsGetBloodHoundAces(dsDatabase, group.RecordId)
+    return {
+        "ObjectIdentifier" : str(group.SID),
+        "Properties"       : properties,
+        "Members"          : members,
+        "Aces"             : aces,
+        "IsDeleted"        : group.IsDeleted,
+        "IsACLProtected"   : protected,
+    }
+
+def dsGetBloodHoundDomain(dsDatabase, domain):
+    '''
+    Returns the BloodHound object of a domain (dsObject)
+    '''
+    sid = str(SID(domain.Record[ntds.dsfielddictionary.dsSIDIndex]))
+    dn = dsGetDN(dsDatabase, domain.RecordId)
+    name = dsGetDomainNameFromDN(dn)
+    (aces, protected) = dsGetBloodHoundAces(dsDatabase, domain.RecordId)
+    return {
+        "ObjectIdentifier" : sid,
+        "Properties"       : {"name" : name, "domain" : name, "domainsid" : sid,
+                              "distinguishedname" : dn.upper(),
+                              "whencreated" : dsGetBloodHoundTime(domain.WhenCreated)},
+        "Aces"             : aces,
+        "Trusts"           : [],
+        "Links"            : [],
+        "ChildObjects"     : [],
+        "IsDeleted"        : domain.IsDeleted,
+        "IsACLProtected"   : protected,
+    }
+
+# Collector files: (kind, object category, subclasses, object class, converter)
+dsBloodHoundFiles = (
+    ("users",     "Person",     False, dsUser,     dsGetBloodHoundUser),
+    ("computers", "Computer",   True,  dsComputer, dsGetBloodHoundComputer),
+    ("groups",    "Group",      True,  dsGroup,    dsGetBloodHoundGroup),
+    ("domains",   "Domain-DNS", True,  dsObject,   dsGetBloodHoundDomain),
+)
+
+def dsEncodeBloodHoundObject(dsDatabase, recordid, record, cls, convert):
+    if record == None or record[ntds.dsfielddictionary.dsSIDIndex] == "":
+        # Contacts, deleted objects without SID...
+        return None
+    try:
+        return json_dumps(convert(dsDatabase, cls(dsDatabase, recordid, record)))
+    except Exception as e:
+        print("[!] Warning! Unable to convert object (record id: %d): %s" % (recordid, str(e)))
+        return None
+
+def dsWriteBloodHound(dsDatabase, output, workdir=None, workers=None):
+    '''
+    Writes the users, computers, groups and domains to a lib.bloodhound
+    BloodHoundOutput, the objects being converted and encoded by workers
+    processes (see dsMapObjects). Returns the number of objects written per
+    file.
+    '''
+    dsInitBloodHound(dsDatabase)
+    counts = {}
+    for (kind, typename, subclasses, cls, convert) in dsBloodHoundFiles:
+        writer = output.open(kind)
+        encode = lambda db, recordid, record: dsEncodeBloodHoundObject(db, recordid, record, cls, convert)
+        for text in dsMapObjects(dsDatabase, dsIterObjects(dsDatabase, typename, subclasses), encode, workdir, workers):
+            writer.writeEncoded(text)
+        writer.close()
+        counts[kind] = writer.Count
+    output.close()
+    return counts
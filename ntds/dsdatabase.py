@@ -20,6 +20,10 @@
 '''
 
 import sys
+import re
+import mmap
+import multiprocessing
+from array import array
 from stat import *
 from os import stat
 from os import path
@@ -27,56 +31,279 @@ import time
 import ntds.dsfielddictionary
 from ntds.dsencryption import *
 from lib.map import *
+from lib.index import *
 from lib.sid import *
 from lib.guid import *
-import pickle
 from rich.console import Console
 
 
-dsMapOffsetByLineId   = {} #Map that can be used to find the offset for line
-dsMapLineIdByRecordId = {} #Map that can be used to find the line for record
-dsMapTypeByRecordId   = {} #Map that can be used to find the type for record
-dsMapRecordIdByName   = {} #Map that can be used to find the record for name
-dsMapChildsByRecordId = {} #Map that can be used to find child objects
-dsMapTypeIdByTypeName = {} #Map that can be used to find child objects
-dsMapRecordIdByTypeId = {} #Map that can be used to find all the records that have a type
-dsMapRecordIdBySID    = {} #Map that can be used to find the record for a SID
-dsMapRecordIdByGUID   = {} #Map that can be used to find the record for a GUID
+dsMapOffsetByLineId   = array('q') #Map that can be used to find the offset for line
+dsMapLineIdByRecordId = dsArrayMap() #Map that can be used to find the line for record
+dsMapTypeByRecordId   = dsArrayMap() #Map that can be used to find the type for record
+dsMapRecordIdByName   = dsStringMap() #Map that can be used to find the record for name
+dsMapChildsByRecordId = dsListMap() #Map that can be used to find child objects
+dsMapTypeIdByTypeName = dsStringMap() #Map that can be used to find child objects
+dsMapRecordIdByTypeId = dsListMap() #Map that can be used to find all the records that have a type
+dsMapRecordIdBySID    = dsStringMap() #Map that can be used to find the record for a SID
+dsMapRecordIdByGUID   = dsStringMap() #Map that can be used to find the record for a GUID
+dsMapPrimaryGroupByRecordId = dsArrayMap() #Map that can be used to find the primary group of an account
+dsMapSdIdByRecordId   = dsArrayMap('q') #Map that can be used to find the sd_id of the security descriptor of a record
+dsMapRecordIdsBySdId  = dsListMap('q') #Map that can be used to find the records sharing a security descriptor
+
+dsIndexFileName = "datatable.idx"
+dsIndex = None #The open index file, the loaded maps point into it
 
 dsSchemaTypeId = -1
 
-dsDatabaseSize = -1
+dsMinShardSize = 16 * 1024 * 1024 #Smallest byte range worth handing to a worker of the sharded build
 
-def dsLoadMap(filename, map):
-    fmap = open(filename, "rb")
-    tmp = {}
-    tmp = pickle.load(fmap)
-    fmap.close()
-    for id in tmp:
-        map[id] = tmp[id]
+dsDatabaseSize = -1
 
-def dsInitDatabase(dsESEFile, workdir):
+class dsProjection:
+    '''
+    A precompiled parser that only extracts the given columns of a TSV line.
+
+    A single regular expression skips the unused columns without creating
+    any object for them, so parsing a record allocates one string per
+    projected column instead of one per column of the table.
+    '''
+    def __init__(self, columns):
+        self.Columns = sorted(set(c for c in columns if c >= 0))
+        self.Groups = dict((c, i) for (i, c) in enumerate(self.Columns))
+        try:
+            self.Regex = self._compile(b"(?:[^\t]*+\t){%d}")
+        except re.error:
+            # No possessive quantifiers before Python 3.11
+            self.Regex = self._compile(b"(?:[^\t]*\t){%d}")
+
+    def _compile(self, skip):
+        pattern = b""
+        previous = -1
+        for (i, c) in enumerate(self.Columns):
+            if c - previous > 1:
+                pattern += skip % (c - previous - 1)
+            pattern += b"([^\t]*)"
+            if i < len(self.Columns) - 1:
+                pattern += b"\t"
+            previous = c
+        return re.compile(pattern)
+
+    def parse(self, line):
+        '''
+        Returns a dsRecordView of line (bytes)
+        '''
+        m = self.Regex.match(line)
+        if m == None:
+            return dsRecordView(line, self, None)
+        return dsRecordView(line, self, [field.decode('utf-8') for field in m.groups()])
+
+class dsRecordView:
+    '''
+    A record parsed by a dsProjection. Indexing it with a projected column
+    is a lookup; any other column falls back to splitting the whole line.
+    '''
+    __slots__ = ('Line', 'Projection', 'Fields', 'Record')
+
+    def __init__(self, line, projection, fields):
+        self.Line = line
+        self.Projection = projection
+        self.Fields = fields
+        self.Record = None
+
+    def _split(self):
+        if self.Record == None:
+            self.Record = self.Line.decode('utf-8').split('\t')
+        return self.Record
+
+    def __getitem__(self, index):
+        if self.Fields != None:
+            group = self.Projection.Groups.get(index)
+            if group != None:
+                return self.Fields[group]
+            if index == -1:
+                # Unknown columns are -1 in dsfielddictionary, i.e. the last one
+                return self.Line[self.Line.rfind(b"\t") + 1:].decode('utf-8')
+        return self._split()[index]
+
+    def __len__(self):
+        return len(self._split())
+
+    def __iter__(self):
+        return iter(self._split())
+
+class dsTextTable:
+    '''
+    A table exported to TSV by esedbexport. Records are addressed by the byte
+    offset of their line.
+
+    The file is scanned sequentially through a buffered reader. Random
+    access goes through a read-only memory map of the file and the offset
+    array given to setOffsets(), so fetching a record by line id is a single
+    slice of the map.
+
+    When follow is given, the file is treated as still being written:
+    reaching the end of the file (or a partial line) waits for more data as
+    long as follow() returns True.
+    '''
+    def __init__(self, dsESEFile, follow=None):
+        self.Filename = dsESEFile
+        self.Size = stat(dsESEFile).st_size
+        self.File = open(dsESEFile, 'rb')
+        self.Follow = follow
+        self.Map = None
+        self.Offsets = array('q')
+        self.Projection = None
+
+    def _readLine(self):
+        '''
+        Reads the next complete line, waiting for the writer if needed
+        '''
+        offset = self.File.tell()
+        line = self.File.readline()
+        while self.Follow != None and not line.endswith(b"\n"):
+            if not self.Follow():
+                # The writer is gone, whatever is in the file now is final
+                self.Follow = None
+                self.Size = stat(self.Filename).st_size
+                self.File.seek(offset)
+                line = self.File.readline()
+                break
+            time.sleep(0.05)
+            self.File.seek(offset)
+            line = self.File.readline()
+        return line
+
+    def _getMap(self):
+        '''
+        Maps the file once it is complete
+        '''
+        if self.Map == None:
+            self.Size = stat(self.Filename).st_size
+            if self.Size == 0:
+                return b""
+            self.Map = mmap.mmap(self.File.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.Map
+
+    def getFieldNames(self):
+        '''
+        Returns the column names from the first line of the export
+        '''
+        self.File.seek(0)
+        line = self._readLine().decode('utf-8')
+        if line == "":
+            return []
+        return line.rstrip('\r\n').split('\t')
+
+    def _parse(self, line):
+        if self.Projection != None:
+            return self.Projection.parse(line)
+        return line.decode('utf-8').split('\t')
+
+    def records(self):
+        '''
+        Yields (offset, record) for every line following the header
+        '''
+        self.File.seek(0)
+        self._readLine()
+        while True:
+            offset = self.File.tell()
+            line = self._readLine()
+            if line == b"":
+                break
+            yield offset, self._parse(line)
+
+    def setProjection(self, projection):
+        '''
+        Sets the dsProjection used to parse records, None parses every column
+        '''
+        self.Projection = projection
+
+    def setOffsets(self, offsets):
+        '''
+        Sets the array of line offsets used by getRecord()
+        '''
+        self.Offsets = offsets
+
+    def getRecord(self, lineid):
+        '''
+        Returns the parsed record of line lineid
+        '''
+        offsets = self.Offsets
+        start = offsets[lineid]
+        if lineid + 1 < len(offsets):
+            line = self._getMap()[start:offsets[lineid + 1]]
+        else:
+            return self.getRecordAt(start)
+        if line == b"":
+            return None
+        return self._parse(line)
+
+    def getRecords(self, lineids):
+        '''
+        Yields (lineid, parsed record) for lineids, which must be sorted by
+        offset. Runs of consecutive lines are read as a single block.
+        '''
+        offsets = self.Offsets
+        m = self._getMap()
+        i = 0
+        while i < len(lineids):
+            j = i + 1
+            while j < len(lineids) and lineids[j] == lineids[j - 1] + 1:
+                j += 1
+            if lineids[j - 1] + 1 >= len(offsets):
+                # The last line has no end offset
+                for lineid in lineids[i:j]:
+                    yield lineid, self.getRecord(lineid)
+            else:
+                start = offsets[lineids[i]]
+                block = m[start:offsets[lineids[j - 1] + 1]]
+                for lineid in lineids[i:j]:
+                    line = block[offsets[lineid] - start:offsets[lineid + 1] - start]
+                    yield lineid, None if line == b"" else self._parse(line)
+            i = j
+
+    def getRecordAt(self, offset):
+        '''
+        Returns the parsed record of the line starting at offset
+        '''
+        m = self._getMap()
+        end = m.find(b"\n", offset)
+        line = m[offset:] if end == -1 else m[offset:end + 1]
+        if line == b"":
+            return None
+        return self._parse(line)
+
+    def getProgress(self):
+        if self.Follow != None:
+            self.Size = max(self.Size, stat(self.Filename).st_size)
+        return self.File.tell() * 100 / max(self.Size, 1)
+
+def dsOpenTable(dsESEFile):
+    '''
+    Returns a table object for either the path of an esedbexport TSV file or
+    a table already opened by lib.esedb
+    '''
+    if isinstance(dsESEFile, str):
+        return dsTextTable(dsESEFile)
+    return dsESEFile
+
+def dsInitDatabase(dsESEFile, workdir, workers=None):
     global dsDatabaseSize
-    dsDatabaseSize = stat(dsESEFile).st_size
-    db = open(dsESEFile , 'rb', 0)
-    db.seek(0)
-    #line = str([x.decode('utf8').strip() for x in db.readlines()])
-    line = db.readline()
-    line = line.decode('utf-8')
-    if line == "":
+    db = dsOpenTable(dsESEFile)
+    dsDatabaseSize = db.Size
+    record = db.getFieldNames()
+    if len(record) == 0:
         print("[!] Warning! Error processing the first line!\n")
         sys.exit()
     else:
-        dsFieldNameRecord = line.split('\t')
-        record = line.split('\t')
-
         for cid in range(0, len(record)):
 #------------------------------------------------------------------------------ 
 # filling indexes for object attributes
 #------------------------------------------------------------------------------ 
             
-            #if (record[cid] == "ATTp131353"):
-            #    # NT-Security-Descriptor (in fact an index, big endian, to sd_id from sd_table)
+            if (record[cid] == "ATTp131353"):
+                # NT-Security-Descriptor (in fact an index, big endian, to sd_id from sd_table)
+                ntds.dsfielddictionary.dsNTSecurityDescriptorIndex = cid
             if (record[cid] == "DNT_col"):
                 ntds.dsfielddictionary.dsRecordIdIndex = cid
             if (record[cid] == "PDNT_col"):
@@ -93,6 +320,14 @@ def dsInitDatabase(dsESEFile, workdir):
                 ntds.dsfielddictionary.dsObjectName2Index = cid
             if (record[cid] == "ATTk589826"):
                 ntds.dsfielddictionary.dsObjectGUIDIndex = cid
+            if (record[cid] == "ATTc131094"):
+                ntds.dsfielddictionary.dsGovernsIdIndex = cid
+            if (record[cid] == "ATTc131093"):
+                ntds.dsfielddictionary.dsSubClassOfIndex = cid
+            if (record[cid] == "ATTb590607"):
+                ntds.dsfielddictionary.dsDefaultObjectCategoryIndex = cid
+            if (record[cid] == "ATTk589972"):
+                ntds.dsfielddictionary.dsSchemaIdGuidIndex = cid
             if (record[cid] == "ATTl131074"):
                 ntds.dsfielddictionary.dsWhenCreatedIndex = cid
             if (record[cid] == "ATTl131075"):
@@ -185,52 +420,221 @@ def dsInitDatabase(dsESEFile, workdir):
 #===============================================================================
             if (record[cid] == "ATTk590689"):
                 ntds.dsfielddictionary.dsPEKIndex = cid
-    db.seek(0)
-    dsCheckMaps(db, workdir)
+    db.setProjection(dsProjection(dsGetRecordColumns()))
+    dsCheckMaps(db, workdir, workers)
     return db
 
-
-
-
-
-def dsCheckMaps(dsDatabase, workdir):
+def dsGetRecordColumns():
+    '''
+    Returns the indexes of all the datatable columns in dsfielddictionary
+    '''
+    columns = []
+    for (name, value) in vars(ntds.dsfielddictionary).items():
+        if name.startswith("ds") and isinstance(value, int) and value >= 0:
+            columns.append(value)
+    return columns
+
+
+
+
+
+def dsClearMaps():
+    '''
+    Empties every map before a rebuild
+    '''
+    global dsIndex
+
+    del dsMapOffsetByLineId[:]
+    dsMapLineIdByRecordId.clear()
+    dsMapRecordIdByName.clear()
+    dsMapTypeByRecordId.clear()
+    dsMapChildsByRecordId.clear()
+    dsMapTypeIdByTypeName.clear()
+    dsMapRecordIdBySID.clear()
+    dsMapRecordIdByGUID.clear()
+    dsMapRecordIdByTypeId.clear()
+    dsMapPrimaryGroupByRecordId.clear()
+    dsMapSdIdByRecordId.clear()
+    dsMapRecordIdsBySdId.clear()
+    if dsIndex != None:
+        dsIndex.close()
+        dsIndex = None
+
+def dsSaveIndex(workdir):
+    '''
+    Writes all the maps of the datatable to a single index file
+    '''
+    index = IndexWriter(path.join(workdir, dsIndexFileName))
+    index.add("offlid", dsMapOffsetByLineId)
+    dsMapLineIdByRecordId.save(index, "lidrid")
+    dsMapRecordIdByName.save(index, "ridname")
+    dsMapTypeByRecordId.save(index, "typerid")
+    dsMapChildsByRecordId.save(index, "childsrid")
+    dsMapTypeIdByTypeName.save(index, "typeidname")
+    dsMapRecordIdBySID.save(index, "ridsid")
+    dsMapRecordIdByGUID.save(index, "ridguid")
+    dsMapRecordIdByTypeId.save(index, "ridtype")
+    dsMapPrimaryGroupByRecordId.save(index, "pgrid")
+    dsMapSdIdByRecordId.save(index, "sdrid")
+    dsMapRecordIdsBySdId.save(index, "ridssd")
+    index.add("pek", ntds.dsfielddictionary.dsEncryptedPEK.encode("utf-8"))
+    index.close()
+
+def dsLoadIndex(workdir):
+    '''
+    Maps the index file and points all the maps of the datatable into it.
+    Returns the line offsets.
+    '''
+    global dsIndex
+
+    dsIndex = IndexFile(path.join(workdir, dsIndexFileName))
+    dsMapLineIdByRecordId.load(dsIndex, "lidrid")
+    dsMapRecordIdByName.load(dsIndex, "ridname")
+    dsMapTypeByRecordId.load(dsIndex, "typerid")
+    dsMapChildsByRecordId.load(dsIndex, "childsrid")
+    dsMapTypeIdByTypeName.load(dsIndex, "typeidname")
+    dsMapRecordIdBySID.load(dsIndex, "ridsid")
+    dsMapRecordIdByGUID.load(dsIndex, "ridguid")
+    dsMapRecordIdByTypeId.load(dsIndex, "ridtype")
+    dsMapPrimaryGroupByRecordId.load(dsIndex, "pgrid")
+    dsMapSdIdByRecordId.load(dsIndex, "sdrid")
+    dsMapRecordIdsBySdId.load(dsIndex, "ridssd")
+    ntds.dsfielddictionary.dsEncryptedPEK = bytes(dsIndex.getBytes("pek")).decode("utf-8")
+    return dsIndex.getArray("offlid", 'q')
+
+def dsCheckMaps(dsDatabase, workdir, workers=None):
     try:
-        global dsMapOffsetByLineId
-        global dsMapLineIdByRecordId
-        global dsMapRecordIdByName
-        global dsMapTypeByRecordId
-        global dsMapChildsByRecordId
-        global dsMapTypeIdByTypeName
-        global dsMapRecordIdByTypeId
-        global dsMapRecordIdBySID
-        global dsMapRecordIdByGUID
-
         print("\n[+] Loading saved map files (Stage 1)...")
-        dsLoadMap(path.join(workdir, "offlid.map"), dsMapOffsetByLineId)
-        dsLoadMap(path.join(workdir, "lidrid.map"), dsMapLineIdByRecordId)
-        dsLoadMap(path.join(workdir, "ridname.map"), dsMapRecordIdByName)
-        dsLoadMap(path.join(workdir, "typerid.map"), dsMapTypeByRecordId)
-        dsLoadMap(path.join(workdir, "childsrid.map"), dsMapChildsByRecordId)
-        dsLoadMap(path.join(workdir, "typeidname.map"), dsMapTypeIdByTypeName)
-        dsLoadMap(path.join(workdir, "ridsid.map"), dsMapRecordIdBySID)
-        dsLoadMap(path.join(workdir, "ridguid.map"), dsMapRecordIdByGUID)
-        dsLoadMap(path.join(workdir, "ridtype.map"), dsMapRecordIdByTypeId)
-        
-        pek = open(path.join(workdir, "pek.map"), "rb")
-        ntds.dsfielddictionary.dsEncryptedPEK = pek.read()
-        pek.close()
-        
+        dsDatabase.setOffsets(dsLoadIndex(workdir))
     except Exception as e:
         print("[+] Rebuilding maps...")
-        dsBuildMaps(dsDatabase, workdir)
-        pass
-
-
-
-
-
-
-def dsBuildMaps(dsDatabase, workdir):
+        dsClearMaps()
+        dsBuildMaps(dsDatabase, workdir, workers)
+        dsDatabase.setOffsets(dsMapOffsetByLineId)
+
+
+
+
+
+
+def dsGetMapColumns():
+    '''
+    Returns the indexes of the columns dsBuildMaps needs, in the order of
+    the fields returned by dsProjectRecord
+    '''
+    return (ntds.dsfielddictionary.dsRecordIdIndex,
+            ntds.dsfielddictionary.dsParentRecordIdIndex,
+            ntds.dsfielddictionary.dsObjectTypeIdIndex,
+            ntds.dsfielddictionary.dsObjectName2Index,
+            ntds.dsfielddictionary.dsSIDIndex,
+            ntds.dsfielddictionary.dsObjectGUIDIndex,
+            ntds.dsfielddictionary.dsPEKIndex,
+            ntds.dsfielddictionary.dsPrimaryGroupIdIndex,
+            ntds.dsfielddictionary.dsNTSecurityDescriptorIndex)
+
+def dsProjectRecord(record, columns):
+    '''
+    Reduces a record to the fields used by dsBuildMaps:
+    (DNT, PDNT, type id, name, SID, GUID, PEK, primary group id, sd_id)
+    The SID and the GUID are already converted to their string form, or
+    None if they cannot be parsed. The sd_id is -1 if the record has none.
+    '''
+    (rid, pdnt, typeid, name, sid, guid, pek, pgid, sd) = columns
+    try:
+        sidstr = str(SID(record[sid]))
+    except:
+        sidstr = None
+    try:
+        guidstr = str(GUID(record[guid]))
+    except:
+        guidstr = None
+    sdid = -1
+    if sd != -1:
+        # Not in the export otherwise
+        try:
+            # Stored as a big endian integer
+            sdid = int(record[sd], 16)
+        except ValueError:
+            pass
+    return (record[rid], record[pdnt], record[typeid], record[name], sidstr, guidstr, record[pek], record[pgid], sdid)
+
+def dsScanShard(shard):
+    '''
+    Worker of the sharded build: parses the lines of a byte range of a
+    datatable export. Returns the line offsets and the projected records.
+    '''
+    (filename, start, end, columns) = shard
+    projection = dsProjection(columns)
+    offsets = array('q')
+    records = []
+    with open(filename, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = start
+            while pos < end:
+                nl = m.find(b"\n", pos, end)
+                stop = end if nl == -1 else nl + 1
+                offsets.append(pos)
+                records.append(dsProjectRecord(projection.parse(m[pos:stop]), columns))
+                pos = stop
+        finally:
+            m.close()
+    return offsets, records
+
+def dsGetShards(dsDatabase, count):
+    '''
+    Splits the lines following the header of a datatable export into count
+    byte ranges aligned to line boundaries
+    '''
+    m = dsDatabase._getMap()
+    size = len(m)
+    start = m.find(b"\n") + 1
+    if start == 0:
+        return []
+    bounds = [start]
+    for i in range(1, count):
+        pos = m.find(b"\n", max(start + (size - start) * i // count, bounds[-1]))
+        pos = size if pos == -1 else pos + 1
+        if pos > bounds[-1]:
+            bounds.append(pos)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+def dsIterProjectedRecords(dsDatabase, workers, status):
+    '''
+    Yields (offset, projected record) for all the records of the table, in
+    order. Complete TSV exports are scanned in parallel by a pool of
+    workers; tables still being written and native tables are scanned
+    sequentially.
+    '''
+    columns = dsGetMapColumns()
+    shards = []
+    if workers > 1 and isinstance(dsDatabase, dsTextTable) and dsDatabase.Follow == None:
+        count = min(workers * 4, dsDatabase.Size // dsMinShardSize)
+        if count > 1:
+            shards = dsGetShards(dsDatabase, count)
+    if len(shards) < 2:
+        lineid = 1
+        for offset, record in dsDatabase.records():
+            if lineid % 1024 == 0:
+                status.update("[bold green][+] Scanning database - %d%% -> %d records processed" % (dsDatabase.getProgress(), lineid))
+            yield offset, dsProjectRecord(record, columns)
+            lineid += 1
+        return
+    lineid = 1
+    with multiprocessing.Pool(min(workers, len(shards))) as pool:
+        done = 0
+        # imap keeps the order of the shards, so the maps are merged exactly
+        # as a sequential scan would fill them
+        for offsets, records in pool.imap(dsScanShard, [(dsDatabase.Filename, start, end, columns) for (start, end) in shards]):
+            for i in range(len(offsets)):
+                yield offsets[i], records[i]
+            done += 1
+            lineid += len(offsets)
+            status.update("[bold green][+] Scanning database - %d%% -> %d records processed (%d/%d shards)" % (done * 100 / len(shards), lineid, done, len(shards)))
+
+def dsBuildMaps(dsDatabase, workdir, workers=None):
     
     global dsMapOffsetByLineId
     global dsMapLineIdByRecordId
@@ -240,139 +644,112 @@ def dsBuildMaps(dsDatabase, workdir):
     global dsMapRecordIdBySID
     global dsMapRecordIdbyGUID
     global dsSchemaTypeId
+
+    if workers == None:
+        workers = multiprocessing.cpu_count()
         
-    lineid = 0
+    # Line 0 is the header of the table
+    dsMapOffsetByLineId.append(0)
+    lineid = 1
+    primarygroups = []
     console = Console()
-    with console.status("[bold green][+] Scanning database - %d%% -> %d records processed" % (dsDatabase.tell()*100/dsDatabaseSize, lineid+1)) as status:
-        while True:
-            status.update("[bold green][+] Scanning database - %d%% -> %d records processed" % (dsDatabase.tell()*100/dsDatabaseSize, lineid+1))
+    with console.status("[bold green][+] Scanning database - %d%% -> %d records processed" % (0, lineid)) as status:
+        for offset, (rid, pdnt, typeid, name, sid, guid, pek, pgid, sdid) in dsIterProjectedRecords(dsDatabase, workers, status):
+            dsMapOffsetByLineId.append(offset)
+            #===================================================================
+            # This record will always be the record representing the domain
+            # object
+            # This should be the only record containing the PEK
+            #===================================================================
+            if pek != "":
+                if ntds.dsfielddictionary.dsEncryptedPEK != "":
+                    print("\n[!] Warning! Multiple records with PEK entry!\n")
+                ntds.dsfielddictionary.dsEncryptedPEK = pek
+                
             try:
-                dsMapOffsetByLineId[lineid] = dsDatabase.tell()
+                dsMapLineIdByRecordId[int(rid)] = lineid
+            except:
+                print("\n[!] Warning! Error at dsMapLineIdByRecordId!\n")
+                pass
+            
+            try:
+                tmp = dsMapRecordIdByName[name]
+                # Also save the Schema type id for future use
+                if name == "Schema":
+                    if dsSchemaTypeId == -1 and typeid != "":
+                        dsSchemaTypeId = int(typeid)
+                    else:
+                        print("\n[!] Warning! There is more than one Schema object! The DB is inconsistent!\n")
+            except:
+                dsMapRecordIdByName[name] = int(rid)
+                if name == "Schema":
+                    if dsSchemaTypeId == -1 and typeid != "":
+                        dsSchemaTypeId = int(typeid)
+                    else:
+                        print("\n[!] Warning! There is more than one Schema object! The DB is inconsistent!\n")
+                pass
+            
+            try:
+                if typeid != "":
+                    dsMapTypeByRecordId[int(rid)] = int(typeid)
+            except:
+                print("\n[!] Warning! Error at dsMapTypeByRecordId!\n")
+                pass
+            
+            try:
+                tmp = dsMapChildsByRecordId[int(rid)]
+            except KeyError:
+                dsMapChildsByRecordId[int(rid)] = []
+                pass
+            except:
+                pass
+            
+            try:
+                dsMapChildsByRecordId[int(pdnt)].append(int(rid))
+            except KeyError:
+                dsMapChildsByRecordId[int(pdnt)] = []
+                dsMapChildsByRecordId[int(pdnt)].append(int(rid))
             except:
-                print("\n[!] Warning! Error at dsMapOffsetByLineId!\n")
                 pass
-            line = dsDatabase.readline()
-            line = line.decode('utf-8')
-            if line == "":
-                break
-            record = line.split('\t')
-            if lineid != 0:
-                #===================================================================
-                # This record will always be the record representing the domain
-                # object
-                # This should be the only record containing the PEK
-                #===================================================================
-                if record[ntds.dsfielddictionary.dsPEKIndex] != "":
-                    if ntds.dsfielddictionary.dsEncryptedPEK != "":
-                        print("\n[!] Warning! Multiple records with PEK entry!\n")
-                    ntds.dsfielddictionary.dsEncryptedPEK = record[ntds.dsfielddictionary.dsPEKIndex]
-                    
-                try:
-                    dsMapLineIdByRecordId[int(record[ntds.dsfielddictionary.dsRecordIdIndex])] = lineid
-                except:
-                    print("\n[!] Warning! Error at dsMapLineIdByRecordId!\n")
-                    pass
-                
-                try:
-                    tmp = dsMapRecordIdByName[record[ntds.dsfielddictionary.dsObjectName2Index]]
-                    # Also save the Schema type id for future use
-                    if record[ntds.dsfielddictionary.dsObjectName2Index] == "Schema":
-                        if dsSchemaTypeId == -1 and record[ntds.dsfielddictionary.dsObjectTypeIdIndex] != "":
-                            dsSchemaTypeId = int(record[ntds.dsfielddictionary.dsObjectTypeIdIndex])
-                        else:
-                            print("\n[!] Warning! There is more than one Schema object! The DB is inconsistent!\n")
-                except:
-                    dsMapRecordIdByName[record[ntds.dsfielddictionary.dsObjectName2Index]] = int(record[ntds.dsfielddictionary.dsRecordIdIndex])
-                    if record[ntds.dsfielddictionary.dsObjectName2Index] == "Schema":
-                        if dsSchemaTypeId == -1 and record[ntds.dsfielddictionary.dsObjectTypeIdIndex] != "":
-                            dsSchemaTypeId = int(record[ntds.dsfielddictionary.dsObjectTypeIdIndex])
-                        else:
-                            print("\n[!] Warning! There is more than one Schema object! The DB is inconsistent!\n")
-                    pass
-                
-                try:
-                    dsMapTypeByRecordId[int(record[ntds.dsfielddictionary.dsRecordIdIndex])] = record[ntds.dsfielddictionary.dsObjectTypeIdIndex]
-                except:
-                    print("\n[!] Warning! Error at dsMapTypeByRecordId!\n")
-                    pass
-                
-                try:
-                    tmp = dsMapChildsByRecordId[int(record[ntds.dsfielddictionary.dsRecordIdIndex])]
-                except KeyError:
-                    dsMapChildsByRecordId[int(record[ntds.dsfielddictionary.dsRecordIdIndex])] = []
-                    pass
-                except:
-                    pass
-                
-                try:
-                    dsMapChildsByRecordId[int(record[ntds.dsfielddictionary.dsParentRecordIdIndex])].append(int(record[ntds.dsfielddictionary.dsRecordIdIndex]))
-                except KeyError:
-                    dsMapChildsByRecordId[int(record[ntds.dsfielddictionary.dsParentRecordIdIndex])] = []
-                    dsMapChildsByRecordId[int(record[ntds.dsfielddictionary.dsParentRecordIdIndex])].append(int(record[ntds.dsfielddictionary.dsRecordIdIndex]))
-                except:
-                    pass
 
+            if sid != None:
                 try:
-                    dsMapRecordIdBySID[str(SID(record[ntds.dsfielddictionary.dsSIDIndex]))]
+                    dsMapRecordIdBySID[sid]
                 except KeyError:
-                    dsMapRecordIdBySID[str(SID(record[ntds.dsfielddictionary.dsSIDIndex]))] = int(record[ntds.dsfielddictionary.dsRecordIdIndex])
-                except:
-                    pass
+                    dsMapRecordIdBySID[sid] = int(rid)
 
+            if guid != None:
                 try:
-                    dsMapRecordIdByGUID[str(GUID(record[ntds.dsfielddictionary.dsObjectGUIDIndex]))]
+                    dsMapRecordIdByGUID[guid]
                 except KeyError:
-                    dsMapRecordIdByGUID[str(GUID(record[ntds.dsfielddictionary.dsObjectGUIDIndex]))] = int(record[ntds.dsfielddictionary.dsRecordIdIndex])
-                except:
-                    pass
+                    dsMapRecordIdByGUID[guid] = int(rid)
+
+            try:
+                if typeid != "":
+                    dsMapRecordIdByTypeId[int(typeid)].append(int(rid))
+            except KeyError:
+                dsMapRecordIdByTypeId[int(typeid)] = []
+                dsMapRecordIdByTypeId[int(typeid)].append(int(rid))
+            except:
+                pass
 
+            if pgid != "" and sid != None:
+                primarygroups.append((rid, sid, pgid))
+
+            if sdid != -1:
                 try:
-                    if record[ntds.dsfielddictionary.dsObjectTypeIdIndex] != "":
-                        dsMapRecordIdByTypeId[int(record[ntds.dsfielddictionary.dsObjectTypeIdIndex])].append(int(record[ntds.dsfielddictionary.dsRecordIdIndex]))
-                except KeyError:
-                    dsMapRecordIdByTypeId[int(record[ntds.dsfielddictionary.dsObjectTypeIdIndex])] = []
-                    dsMapRecordIdByTypeId[int(record[ntds.dsfielddictionary.dsObjectTypeIdIndex])].append(int(record[ntds.dsfielddictionary.dsRecordIdIndex]))
-                except:
-                    pass
+                    dsMapSdIdByRecordId[int(rid)] = sdid
+                except (ValueError, OverflowError):
+                    print("\n[!] Warning! Error at dsMapSdIdByRecordId!\n")
 
             lineid += 1    
-    offlid = open(path.join(workdir, "offlid.map"), "wb")
-    pickle.dump(dsMapOffsetByLineId, offlid)
-    offlid.close()
-    
-    lidrid = open(path.join(workdir, "lidrid.map"), "wb")
-    pickle.dump(dsMapLineIdByRecordId, lidrid)
-    lidrid.close()
-    
-    ridname = open(path.join(workdir, "ridname.map"), "wb")
-    pickle.dump(dsMapRecordIdByName, ridname)
-    ridname.close()
-    
-    typerid = open(path.join(workdir, "typerid.map"), "wb")
-    pickle.dump(dsMapTypeByRecordId, typerid)
-    typerid.close()
-    
-    childsrid = open(path.join(workdir, "childsrid.map"), "wb")
-    pickle.dump(dsMapChildsByRecordId, childsrid)
-    childsrid.close()
-    
-    pek = open(path.join(workdir, "pek.map"), "wb")
-    pek.write(ntds.dsfielddictionary.dsEncryptedPEK.encode("utf-8"))
-    pek.close()
-    
-    ridsid = open(path.join(workdir, "ridsid.map"), "wb")
-    pickle.dump(dsMapRecordIdBySID, ridsid)
-    ridsid.close()
-    
-    ridguid = open(path.join(workdir, "ridguid.map"), "wb")
-    pickle.dump(dsMapRecordIdByGUID, ridguid)
-    ridguid.close()
-    
-    ridtype = open(path.join(workdir, "ridtype.map"), "wb")
-    pickle.dump(dsMapRecordIdByTypeId, ridtype)
-    ridtype.close()
-    
+    dsResolvePrimaryGroups(primarygroups)
+    dsBuildSdIdMap()
+    # Closing offset so that the last line can be sliced like the others
+    dsMapOffsetByLineId.append(dsDatabase.Size)
+    dsDatabase.setOffsets(dsMapOffsetByLineId)
     dsBuildTypeMap(dsDatabase, workdir)
+    dsSaveIndex(workdir)
 
 
 
@@ -381,6 +758,30 @@ def dsBuildMaps(dsDatabase, workdir):
 
 
 
+def dsResolvePrimaryGroups(primarygroups):
+    '''
+    Fills dsMapPrimaryGroupByRecordId from (DNT, SID, primary group id) of
+    the accounts. The primary group is the group of the account's domain
+    having the primary group id as RID.
+    '''
+    for (rid, sid, pgid) in primarygroups:
+        try:
+            domain = sid[:sid.rindex("-")]
+            dsMapPrimaryGroupByRecordId[int(rid)] = dsMapRecordIdBySID["%s-%d" % (domain, int(pgid))]
+        except (ValueError, KeyError):
+            pass
+
+def dsBuildSdIdMap():
+    '''
+    Fills dsMapRecordIdsBySdId from dsMapSdIdByRecordId, the records of
+    every descriptor sorted by DNT
+    '''
+    for (rid, sdid) in dsMapSdIdByRecordId.items():
+        try:
+            dsMapRecordIdsBySdId[sdid].append(rid)
+        except KeyError:
+            dsMapRecordIdsBySdId[sdid] = [rid]
+
 def dsBuildTypeMap(dsDatabase, workdir):
     global dsMapTypeIdByTypeName
     global dsMapLineIdByRecordId
@@ -428,27 +829,25 @@ def dsBuildTypeMap(dsDatabase, workdir):
             status.update("[bold green][+] Extracting schema information - %d%% -> %d records processed" % (i*100/l,i+1))
             sys.stderr.flush()
             lineid = int(dsMapLineIdByRecordId[int(child)])
-            offset = int(dsMapOffsetByLineId[int(lineid)])
-            dsDatabase.seek(offset)
-            
-            record = ""
-            line = ""
-            line = dsDatabase.readline()
-            line = line.decode('utf-8')
-            if line != "":
-                record = line.split('\t')
+            record = dsDatabase.getRecord(lineid)
+            if record != None:
                 name = record[ntds.dsfielddictionary.dsObjectName2Index]
                 dsMapTypeIdByTypeName[name] = child
             i += 1
     
-    typeidname = open(path.join(workdir, "typeidname.map"), "wb")
-    pickle.dump(dsMapTypeIdByTypeName, typeidname)
-    typeidname.close()
-    
     print("[+] Extracting schema information - %d%% -> %d records processed" % (100,i))
     sys.stderr.flush()
 
 def dsInitEncryption(syshive_fname):
+    '''
+    Decrypts the PEK of the database with the boot key of the SYSTEM hive
+    '''
+    if ntds.dsfielddictionary.dsEncryptedPEK == "":
+        raise Exception("No encrypted PEK found in the datatable")
+    # Windows 2016 and later encrypt the PEK with AES (version 3)
+    (version,) = unpack('<I', unhexlify(ntds.dsfielddictionary.dsEncryptedPEK[:8]))
+    if version != 2:
+        raise Exception("Unsupported PEK encryption (version %d)" % version)
     bootkey = get_syskey(syshive_fname)
     enc_pek = unhexlify(ntds.dsfielddictionary.dsEncryptedPEK[16:])
     ntds.dsfielddictionary.dsPEK=dsDecryptPEK(bootkey, enc_pek)
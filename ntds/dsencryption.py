@@ -33,6 +33,33 @@ from struct import unpack,pack
 from binascii import *
 import sys
 import datetime
+from lib.registry import *
+
+# Order of the bytes of the scrambled boot key
+dsBootKeyPermutation = (0x8, 0x5, 0x4, 0x2, 0xb, 0x9, 0xd, 0x3, 0x0, 0x6, 0x1, 0xc, 0xe, 0xa, 0xf, 0x7)
+
+def get_syskey(syshive_fname):
+    '''
+    Returns the boot key (syskey) stored in a SYSTEM hive file: the class
+    names of the JD, Skew1, GBG and Data keys of the Lsa key of the current
+    control set, unscrambled
+    '''
+    hive = RegistryHive(syshive_fname)
+    select = hive.getKey("Select")
+    current = select.getValue("Current") if select != None else None
+    if current == None:
+        raise RegistryError("%s has no current control set" % syshive_fname)
+    lsa = hive.getKey("ControlSet%03d\\Control\\Lsa" % current[1])
+    if lsa == None:
+        raise RegistryError("%s has no Lsa key" % syshive_fname)
+    scrambled = ""
+    for name in ("JD", "Skew1", "GBG", "Data"):
+        key = lsa.getSubKey(name)
+        if key == None:
+            raise RegistryError("%s has no %s key" % (syshive_fname, name))
+        scrambled += key.getClassName()[:8]
+    scrambled = unhexlify(scrambled)
+    return bytes(scrambled[i] for i in dsBootKeyPermutation)
 
 
 def dsDecryptPEK(bootkey, enc_pek):
@@ -46,17 +73,86 @@ def dsDecryptPEK(bootkey, enc_pek):
     #return pek[36:]
     return pek[len(pek) - 16:]
 
+dsPEKDigest = (None, None) #The PEK and the MD5 state it starts every hash key with
+
 def dsDecryptWithPEK(pek, enc_hash):
-    md5=MD5.new()
-    md5.update(pek)
+    global dsPEKDigest
+    if dsPEKDigest[0] != pek:
+        dsPEKDigest = (pek, MD5.new(pek))
+    md5=dsPEKDigest[1].copy()
     md5.update(enc_hash[0:16])
     rc4_key=md5.digest();
     rc4 = ARC4.new(rc4_key)
     return rc4.encrypt(enc_hash[16:])
 
-def dsDecryptSingleHash(rid, enc_hash):
+def str_to_key(s):
+    '''
+    Expands 7 bytes into a DES key with odd parity
+    '''
+    key = [s[0] >> 1,
+           ((s[0] & 0x01) << 6) | (s[1] >> 2),
+           ((s[1] & 0x03) << 5) | (s[2] >> 3),
+           ((s[2] & 0x07) << 4) | (s[3] >> 4),
+           ((s[3] & 0x0F) << 3) | (s[4] >> 5),
+           ((s[4] & 0x1F) << 2) | (s[5] >> 6),
+           ((s[5] & 0x3F) << 1) | (s[6] >> 7),
+           s[6] & 0x7F]
+    for i in range(8):
+        key[i] = key[i] << 1
+        if bin(key[i]).count("1") % 2 == 0:
+            key[i] |= 1
+    return bytes(key)
+
+def sid_to_key(rid):
+    '''
+    Returns the two DES keys derived from a RID
+    '''
+    s1 = pack("<I", rid)
+    s1 += s1[:3]
+    s2 = s1[3:4] + s1[0:3]
+    s2 += s2[:3]
+    return (str_to_key(s1), str_to_key(s2))
+
+dsNoPassword = "NO PASSWORD" #Decrypted value of a hash attribute holding no hash
+
+def dsGetDESCiphers(rid):
+    '''
+    Returns the two DES ciphers (key schedules) of a RID. Callers decrypting
+    several hashes of an account derive them once and pass them along.
+    '''
     (des_k1,des_k2) = sid_to_key(rid)
-    d1 = DES.new(des_k1, DES.MODE_ECB)
-    d2 = DES.new(des_k2, DES.MODE_ECB)
-    hash = d1.decrypt(enc_hash[:8]) + d2.decrypt(enc_hash[8:])
+    return (DES.new(des_k1, DES.MODE_ECB), DES.new(des_k2, DES.MODE_ECB))
+
+def dsDecryptSingleHash(rid, enc_hash, ciphers=None):
+    (d1, d2) = ciphers if ciphers != None else dsGetDESCiphers(rid)
+    hash = d1.decrypt(enc_hash[:8]) + d2.decrypt(enc_hash[8:16])
     return hash
+
+def dsDecryptHash(pek, rid, value, ciphers=None):
+    '''
+    Returns the hex encoded hash decrypted from a hash attribute of the
+    datatable, "" when the attribute is empty and "NO PASSWORD" when it
+    holds no hash
+    '''
+    if value == "":
+        return ""
+    enc_hash = unhexlify(value[16:])
+    hash = hexlify(dsDecryptSingleHash(rid, dsDecryptWithPEK(pek, enc_hash), ciphers)).decode('ascii')
+    if hash == "":
+        hash = dsNoPassword
+    return hash
+
+def dsDecryptHashHistory(pek, rid, value):
+    '''
+    Returns the hex encoded hashes decrypted from a hash history attribute
+    of the datatable. The blob is decrypted with the PEK once, then every
+    16 byte entry with the DES keys of the RID.
+    '''
+    if value == "":
+        return []
+    history = memoryview(dsDecryptWithPEK(pek, unhexlify(value[16:])))
+    (d1, d2) = dsGetDESCiphers(rid)
+    hashes = []
+    for offset in range(0, len(history) - 15, 16):
+        hashes.append(hexlify(d1.decrypt(history[offset:offset + 8]) + d2.decrypt(history[offset + 8:offset + 16])).decode('ascii'))
+    return hashes
@@ -44,6 +44,15 @@ dsUSNCreatedIndex       = -1 #ATTq131091
 dsUSNChangedIndex       = -1 #ATTq131192
 dsObjectColIndex        = -1 #OBJ_col
 dsIsDeletedIndex        = -1 #ATTi131120
+dsNTSecurityDescriptorIndex = -1 #ATTp131353
+
+#===============================================================================
+# Attributes related to schema objects
+#===============================================================================
+dsGovernsIdIndex              = -1 #ATTc131094
+dsSubClassOfIndex             = -1 #ATTc131093
+dsDefaultObjectCategoryIndex  = -1 #ATTb590607
+dsSchemaIdGuidIndex           = -1 #ATTk589972
 
 #===============================================================================
 # Attributes related to deleted objects
@@ -0,0 +1,200 @@
+'''
+Batch decryption of the password hashes.
+
+The encrypted LM and NT hashes of every account are read in one pass over
+the type index (records in offset order), then decrypted in chunks by a
+pool of workers. Each worker keeps the MD5 state of the PEK and derives
+the DES ciphers of an account once for its LM and NT hashes, so a hash
+costs one RC4 and two DES block decryptions. The (sam, rid, lm, nt) tuples are streamed in the order of the
+accounts.
+
+Password histories are decrypted account by account as they are written
+out: one RC4 over the whole history blob, then two DES block decryptions
+per 16 byte entry. The Kerberos keys are read the same way from the
+supplemental credentials, parsing only their Kerberos properties.
+'''
+import multiprocessing
+from ntds.dsrecord import *
+from ntds.dsencryption import *
+from ntds.dsobjects import dsSupplCredentials
+import ntds.dsfielddictionary
+from lib.hashoutput import *
+
+dsHashChunkSize = 2048 #Number of accounts decrypted per task of the pool
+
+def dsGetEncryptedColumns(dsDatabase, indexes):
+    '''
+    Yields (sam, rid, value, ...) of every account having a value in one of
+    the columns indexes, the values as stored in the datatable (hex)
+    '''
+    recordids = list(dsIterObjects(dsDatabase, "User"))
+    for record in dsGetRecordsByRecordIds(dsDatabase, recordids):
+        if record == None:
+            continue
+        values = tuple(record[index] for index in indexes)
+        if not any(values):
+            continue
+        try:
+            # The RID is the last sub authority, stored big endian
+            rid = int(record[ntds.dsfielddictionary.dsSIDIndex].strip()[-8:], 16)
+        except ValueError:
+            continue
+        yield (record[ntds.dsfielddictionary.dsSAMAccountNameIndex], rid) + values
+
+def dsGetEncryptedHashes(dsDatabase, lmindex=None, ntindex=None):
+    '''
+    Yields (sam, rid, encrypted lm, encrypted nt) of every account having a
+    password hash. lmindex and ntindex select other columns, such as the
+    hash histories.
+    '''
+    if lmindex == None:
+        lmindex = ntds.dsfielddictionary.dsLMHashIndex
+    if ntindex == None:
+        ntindex = ntds.dsfielddictionary.dsNTHashIndex
+    return dsGetEncryptedColumns(dsDatabase, (lmindex, ntindex))
+
+def dsGetEncryptedColumn(dsDatabase, index):
+    '''
+    Yields (sam, rid, encrypted value) of every account having a value in
+    the column index
+    '''
+    return dsGetEncryptedColumns(dsDatabase, (index,))
+
+def dsInitHashWorker(pek):
+    ntds.dsfielddictionary.dsPEK = pek
+
+def dsDecryptHashChunk(chunk):
+    '''
+    Returns (sam, rid, lm, nt) for a list of (sam, rid, encrypted lm,
+    encrypted nt)
+    '''
+    pek = ntds.dsfielddictionary.dsPEK
+    hashes = []
+    for (sam, rid, lm, nt) in chunk:
+        try:
+            ciphers = dsGetDESCiphers(rid)
+            hashes.append((sam, rid, dsDecryptHash(pek, rid, lm, ciphers), dsDecryptHash(pek, rid, nt, ciphers)))
+        except Exception:
+            print("[!] Warning! Unable to decrypt the hashes of %s (RID: %d)" % (sam, rid))
+    return hashes
+
+def dsGetHashChunks(encrypted):
+    chunk = []
+    for hashes in encrypted:
+        chunk.append(hashes)
+        if len(chunk) == dsHashChunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def dsIterPasswordHashes(dsDatabase, workers=None):
+    '''
+    Yields (sam, rid, lm, nt) for every account having a password hash, the
+    hashes hex encoded ("" when not set, dsNoPassword when empty). The PEK
+    must have been decrypted (dsInitEncryption) first.
+    '''
+    pek = ntds.dsfielddictionary.dsPEK
+    if workers == None:
+        workers = multiprocessing.cpu_count()
+    chunks = dsGetHashChunks(dsGetEncryptedHashes(dsDatabase))
+    if workers <= 1:
+        for chunk in chunks:
+            for hashes in dsDecryptHashChunk(chunk):
+                yield hashes
+        return
+    with multiprocessing.Pool(workers, dsInitHashWorker, (pek,)) as pool:
+        # imap keeps the order of the chunks and only holds a few of them
+        for decrypted in pool.imap(dsDecryptHashChunk, chunks):
+            for hashes in decrypted:
+                yield hashes
+
+def dsWritePasswordHashes(dsDatabase, output, format="john", workers=None):
+    '''
+    Writes the password hashes of every account to the file object output
+    as they are decrypted, one hash per line (format "john") or one LM/NT
+    pair per line (format "ophc"). Returns the number of lines written.
+    '''
+    lines = 0
+    for (sam, rid, lm, nt) in dsIterPasswordHashes(dsDatabase, workers):
+        if lm == dsNoPassword:
+            lm = ""
+        if nt == dsNoPassword:
+            nt = ""
+        if format == "ophc":
+            output.write(format_ophc(sam, lm, nt) + "\n")
+            lines += 1
+            continue
+        if nt != "":
+            output.write(format_john(sam, nt, 'NT') + "\n")
+            lines += 1
+        if lm != "":
+            output.write(format_john(sam, lm, 'LM') + "\n")
+            lines += 1
+    return lines
+
+def dsIterPasswordHistories(dsDatabase):
+    '''
+    Yields (sam, rid, lm history, nt history) for every account having a
+    password history, the hashes hex encoded
+    '''
+    pek = ntds.dsfielddictionary.dsPEK
+    for (sam, rid, lm, nt) in dsGetEncryptedHashes(dsDatabase,
+                                                  ntds.dsfielddictionary.dsLMHashHistoryIndex,
+                                                  ntds.dsfielddictionary.dsNTHashHistoryIndex):
+        try:
+            yield (sam, rid, dsDecryptHashHistory(pek, rid, lm), dsDecryptHashHistory(pek, rid, nt))
+        except Exception:
+            print("[!] Warning! Unable to decrypt the password history of %s (RID: %d)" % (sam, rid))
+
+def dsWritePasswordHistory(dsDatabase, output, format="john"):
+    '''
+    Writes the password history of every account to the file object output
+    as it is decrypted, one hash per line (format "john") or one LM/NT pair
+    per line (format "ophc"). The entries are named <sam>_history<n>.
+    Returns the number of lines written.
+    '''
+    lines = 0
+    for (sam, rid, lmhistory, nthistory) in dsIterPasswordHistories(dsDatabase):
+        if format == "ophc":
+            for i in range(max(len(lmhistory), len(nthistory))):
+                lm = lmhistory[i] if i < len(lmhistory) else ""
+                nt = nthistory[i] if i < len(nthistory) else ""
+                output.write(format_ophc("%s_history%d" % (sam, i), lm, nt) + "\n")
+                lines += 1
+        else:
+            for (i, nt) in enumerate(nthistory):
+                output.write(format_john("%s_history%d" % (sam, i), nt, 'NT') + "\n")
+                lines += 1
+            for (i, lm) in enumerate(lmhistory):
+                output.write(format_john("%s_history%d" % (sam, i), lm, 'LM') + "\n")
+                lines += 1
+    return lines
+
+def dsIterKerberosKeys(dsDatabase):
+    '''
+    Yields (sam, rid, key type, key) for the current Kerberos keys of every
+    account having supplemental credentials, the keys hex encoded
+    '''
+    pek = ntds.dsfielddictionary.dsPEK
+    index = ntds.dsfielddictionary.dsSupplementalCredentialsIndex
+    for (sam, rid, value) in dsGetEncryptedColumn(dsDatabase, index):
+        try:
+            credentials = dsSupplCredentials(dsDecryptWithPEK(pek, unhexlify(value[16:])), kerberosonly=True)
+        except Exception:
+            print("[!] Warning! Unable to parse the supplemental credentials of %s (RID: %d)" % (sam, rid))
+            continue
+        for key in credentials.getKerberosKeys():
+            yield (sam, rid, key.KeyType, hexlify(key.Key).decode('ascii'))
+
+def dsWriteKerberosKeys(dsDatabase, output):
+    '''
+    Writes the current Kerberos keys of every account to the file object
+    output, one key per line (<sam>:<key type>:<key>). Returns the number of
+    lines written.
+    '''
+    lines = 0
+    for (sam, rid, keytype, key) in dsIterKerberosKeys(dsDatabase):
+        output.write(format_kerberos(sam, keytype, key) + "\n")
+        lines += 1
+    return lines
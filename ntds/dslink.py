@@ -19,27 +19,29 @@
 @contact:       csaba.barta@gmail.com
 '''
 import ntds.dsfielddictionary
+import ntds.dsdatabase
 from ntds.dstime import *
 import sys
+from array import array
 from lib.map import *
-import pickle
+from lib.index import *
 from os import path
 
-dsMapLinks         = {}
-dsMapBackwardLinks = {}
+dsMapLinks         = dsAdjacencyMap() #Map that can be used to find the (source, deltime) of the links to a record
+dsMapBackwardLinks = dsAdjacencyMap() #Map that can be used to find the (target, deltime) of the links from a record
+
+dsLinkIndexFileName = "links.idx"
+dsLinkIndex = None #The open index file, the loaded maps point into it
 
 def dsInitLinks(dsESEFile, workdir):
-    dl = open(dsESEFile , 'rb', 0)
-    dl.seek(0)
-    line = dl.readline()
-    line = line.decode('utf-8')
-    if line == "":
+    dl = ntds.dsdatabase.dsOpenTable(dsESEFile)
+    record = dl.getFieldNames()
+    if len(record) == 0:
         print("[-] Warning! Error processing the first line!")
         sys.exit(1)
     else:
-        ntds.dsfielddictionary.dsFieldNameRecord = line.split('\t')
-        record = line.split('\t')
-        for cid in range(0, len(record)-1):
+        ntds.dsfielddictionary.dsFieldNameRecord = record
+        for cid in range(0, len(record)):
 #------------------------------------------------------------------------------ 
 # filling indexes for membership attributes
 #------------------------------------------------------------------------------ 
@@ -49,75 +51,53 @@ def dsInitLinks(dsESEFile, workdir):
                 ntds.dsfielddictionary.dsSourceRecordIdIndex = cid
             if (record[cid] == "link_deltime"):
                 ntds.dsfielddictionary.dsLinkDeleteTimeIndex = cid
-    dl.seek(0)
     dsCheckMaps(dl, workdir)
     #dsBuildLinkMaps(dl)
+    return dl
 
 def dsCheckMaps(dsDatabase, workdir): 
+    global dsLinkIndex
     try:
-        global dsMapLinks
-        global dsMapBackwardLinks
-
         print("\n[+] Loading saved map files (Stage 2)...")
-        dsLoadMap(path.join(workdir, "links.map"), dsMapLinks)
-        dsLoadMap(path.join(workdir, "backlinks.map"), dsMapBackwardLinks)
-        
+        dsLinkIndex = IndexFile(path.join(workdir, dsLinkIndexFileName))
+        dsMapLinks.load(dsLinkIndex, "links")
+        dsMapBackwardLinks.load(dsLinkIndex, "backlinks")
     except Exception as e:
         print("[+] Rebuilding maps...")
+        dsMapLinks.clear()
+        dsMapBackwardLinks.clear()
+        if dsLinkIndex != None:
+            dsLinkIndex.close()
+            dsLinkIndex = None
         dsBuildLinkMaps(dsDatabase, workdir)
-        pass
 
 def dsBuildLinkMaps(dsLinks, workdir):
-    global dsMapLinks
-    global dsMapBackwardLinks
-    
+    '''
+    Reads the links once into flat arrays, then sorts them by target
+    (forward links) and by source (backward links) into the adjacency maps
+    and saves them to the link index
+    '''
     print("[+] Extracting object links...")
     sys.stderr.flush()
-    lineid = 0
-    while True:
-        line = dsLinks.readline()
-        line = line.decode('utf-8')
-        if line == "":
-            break
-        record = line.split('\t')
-        if lineid != 0:
-            source = int(record[ntds.dsfielddictionary.dsSourceRecordIdIndex])
-            target = int(record[ntds.dsfielddictionary.dsTargetRecordIdIndex])
-            
-            deltime = -1
-            if record[ntds.dsfielddictionary.dsLinkDeleteTimeIndex] != "":
-                deltime = dsVerifyDSTime(record[ntds.dsfielddictionary.dsLinkDeleteTimeIndex])
-                
-            try: 
-                tmp = dsMapLinks[target]
-            except KeyError:
-                dsMapLinks[target] = []
-                pass
-            
-            try:
-                dsMapLinks[target].append((source, deltime))
-            except KeyError:
-                dsMapLinks[target] = []
-                dsMapLinks[target].append((source, deltime))
-           
-            
-            try: 
-                tmp = dsMapBackwardLinks[source]
-            except KeyError:
-                dsMapBackwardLinks[source] = []
-                pass
+    sources = array('i')
+    targets = array('i')
+    deltimes = array('q')
+    for offset, record in dsLinks.records():
+        source = int(record[ntds.dsfielddictionary.dsSourceRecordIdIndex])
+        target = int(record[ntds.dsfielddictionary.dsTargetRecordIdIndex])
+        
+        deltime = -1
+        if record[ntds.dsfielddictionary.dsLinkDeleteTimeIndex] != "":
+            deltime = dsVerifyDSTime(record[ntds.dsfielddictionary.dsLinkDeleteTimeIndex])
             
-            try:
-                dsMapBackwardLinks[source].append((target, deltime))
-            except KeyError:
-                dsMapBackwardLinks[source] = []
-                dsMapBackwardLinks[source].append((target, deltime))
-        lineid += 1
-    
-    links = open(path.join(workdir, "links.map"), "wb")
-    pickle.dump(dsMapLinks, links)
-    links.close()
-    
-    backlinks = open(path.join(workdir, "backlinks.map"), "wb")
-    pickle.dump(dsMapBackwardLinks, backlinks)
-    backlinks.close()
+        sources.append(source)
+        targets.append(target)
+        deltimes.append(deltime)
+
+    dsMapLinks.build(targets, sources, deltimes)
+    dsMapBackwardLinks.build(sources, targets, deltimes)
+
+    index = IndexWriter(path.join(workdir, dsLinkIndexFileName))
+    dsMapLinks.save(index, "links")
+    dsMapBackwardLinks.save(index, "backlinks")
+    index.close()
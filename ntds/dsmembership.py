@@ -0,0 +1,243 @@
+'''
+Group membership index.
+
+The groups of the domain are loaded once, then the groups of an account
+are resolved from its primary group id and its links instead of
+instantiating every group of the domain for every account.
+
+Effective (nested) memberships come from a closure of the membership graph
+computed once and saved next to the datatable index. The graph has an edge
+from every object to each group it is a live member of, and from every
+account to its primary group. Cycles of nested groups are condensed into
+strongly connected components; the closure lists, for every component, the
+group components it reaches (and the transposed lists for the members), so
+a query is a slice of the mapped index.
+'''
+from os import path
+from ntds.dsrecord import *
+from ntds.dsobjects import *
+from lib.map import *
+from lib.index import *
+
+dsMapGroupNameByRecordId = {} #Map that can be used to find the name of a group
+dsMapGroupRIDByRecordId  = {} #Map that can be used to find the RID of a group
+dsMapGroupIdsByRID       = {} #Map that can be used to find the groups having a RID
+
+dsMapComponentByRecordId = dsArrayMap() #Map that can be used to find the component of a record
+dsMapRecordIdsByComponent = dsListMap() #Map that can be used to find the records of a component
+dsMapGroupsByComponent   = dsListMap() #Map that can be used to find the group components a component is a member of
+dsMapMembersByComponent  = dsListMap() #Map that can be used to find the components that are members of a component
+
+dsMembershipIndexFileName = "memberships.idx"
+dsMembershipIndex = None #The open index file, the loaded maps point into it
+
+def dsInitMemberships(dsDatabase, workdir=None):
+    '''
+    Loads the name and the RID of every group. When workdir is given, also
+    loads the closure of the membership graph saved there, or computes and
+    saves it.
+    '''
+    dsMapGroupNameByRecordId.clear()
+    dsMapGroupRIDByRecordId.clear()
+    dsMapGroupIdsByRID.clear()
+    try:
+        groupids = sorted(set(dsMapRecordIdByTypeId[dsGetTypeIdByTypeName(dsDatabase, "Group")]))
+    except KeyError:
+        groupids = []
+    for (recordid, record) in zip(groupids, dsGetRecordsByRecordIds(dsDatabase, groupids)):
+        try:
+            group = dsGroup(dsDatabase, recordid, record)
+            (name, rid) = (group.Name, group.SID.RID)
+        except:
+            print("\n[!] Unable to instantiate group object (record id: %d)" % recordid)
+            continue
+        dsMapGroupNameByRecordId[recordid] = name
+        dsMapGroupRIDByRecordId[recordid] = rid
+        try:
+            dsMapGroupIdsByRID[rid].append(recordid)
+        except KeyError:
+            dsMapGroupIdsByRID[rid] = [recordid]
+    if workdir != None:
+        dsCheckClosure(dsDatabase, workdir)
+
+def dsGetMemberOfIds(dsAccount):
+    '''
+    Returns the record ids of the groups of an account, sorted: the groups
+    whose RID is the primary group id of the account, then the groups it is
+    linked to (once per link)
+    '''
+    groupids = list(dsMapGroupIdsByRID.get(dsAccount.PrimaryGroupID, []))
+    for (groupid, deltime) in dsAccount.getMemberOf():
+        rid = dsMapGroupRIDByRecordId.get(groupid)
+        if rid != None and rid != dsAccount.PrimaryGroupID:
+            groupids.append(groupid)
+    groupids.sort()
+    return groupids
+
+def dsGetMemberOfNames(dsAccount):
+    '''
+    Returns the names of the groups of an account, see dsGetMemberOfIds
+    '''
+    return [dsMapGroupNameByRecordId[groupid] for groupid in dsGetMemberOfIds(dsAccount)]
+
+def dsGetNestedMemberOfNames(dsAccount):
+    '''
+    Returns the names of the groups an account is a member of only through
+    nested groups
+    '''
+    direct = set(dsGetMemberOfIds(dsAccount))
+    return [dsMapGroupNameByRecordId[groupid] for groupid in dsGetEffectiveGroups(dsAccount.RecordId)
+            if not groupid in direct and groupid in dsMapGroupNameByRecordId]
+
+def dsCheckClosure(dsDatabase, workdir):
+    global dsMembershipIndex
+    try:
+        dsMembershipIndex = IndexFile(path.join(workdir, dsMembershipIndexFileName))
+        dsMapComponentByRecordId.load(dsMembershipIndex, "comprid")
+        dsMapRecordIdsByComponent.load(dsMembershipIndex, "ridscomp")
+        dsMapGroupsByComponent.load(dsMembershipIndex, "groupscomp")
+        dsMapMembersByComponent.load(dsMembershipIndex, "memberscomp")
+    except Exception as e:
+        print("[+] Computing nested group memberships...")
+        dsMapComponentByRecordId.clear()
+        dsMapRecordIdsByComponent.clear()
+        dsMapGroupsByComponent.clear()
+        dsMapMembersByComponent.clear()
+        if dsMembershipIndex != None:
+            dsMembershipIndex.close()
+            dsMembershipIndex = None
+        dsBuildClosure(dsDatabase)
+        index = IndexWriter(path.join(workdir, dsMembershipIndexFileName))
+        dsMapComponentByRecordId.save(index, "comprid")
+        dsMapRecordIdsByComponent.save(index, "ridscomp")
+        dsMapGroupsByComponent.save(index, "groupscomp")
+        dsMapMembersByComponent.save(index, "memberscomp")
+        index.close()
+
+def dsGetMembershipGraph(dsDatabase):
+    '''
+    Returns the membership graph as a map from record ids to the sorted
+    record ids of the groups they are a direct member of
+    '''
+    gtype = dsGetTypeIdByTypeName(dsDatabase, "Group")
+    graph = {}
+    for (member, links) in dsMapBackwardLinks.items():
+        for (group, deltime) in links:
+            # Deleted links and links to objects other than groups
+            # (manager, ...) do not make anyone a member
+            if deltime == -1 and dsGetRecordType(dsDatabase, group) == gtype:
+                graph.setdefault(member, set()).add(group)
+    for (account, group) in dsMapPrimaryGroupByRecordId.items():
+        graph.setdefault(account, set()).add(group)
+    for member in graph:
+        graph[member] = sorted(graph[member])
+    return graph
+
+def dsGetComponents(graph):
+    '''
+    Returns the strongly connected components of graph (Tarjan), as lists of
+    nodes. A component is returned after all the components it reaches.
+    '''
+    index = {}
+    low = {}
+    stack = []
+    onstack = set()
+    components = []
+    for root in sorted(graph):
+        if root in index:
+            continue
+        work = [(root, 0)]
+        while work:
+            (node, i) = work[-1]
+            if i == 0:
+                index[node] = low[node] = len(index)
+                stack.append(node)
+                onstack.add(node)
+            successors = graph.get(node, ())
+            if i < len(successors):
+                work[-1] = (node, i + 1)
+                successor = successors[i]
+                if not successor in index:
+                    work.append((successor, 0))
+                elif successor in onstack:
+                    low[node] = min(low[node], index[successor])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    onstack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(sorted(component))
+    return components
+
+def dsBuildClosure(dsDatabase):
+    '''
+    Computes the transitive closure of the membership graph over its
+    strongly connected components
+    '''
+    graph = dsGetMembershipGraph(dsDatabase)
+    components = dsGetComponents(graph)
+    for (c, component) in enumerate(components):
+        dsMapRecordIdsByComponent[c] = component
+        for recordid in component:
+            dsMapComponentByRecordId[recordid] = c
+    # Only group components are ever reached, number them densely so that
+    # the bitsets stay as small as the number of groups
+    targets = sorted(set(dsMapComponentByRecordId[group] for groups in graph.values() for group in groups))
+    bitbycomponent = dict((g, i) for (i, g) in enumerate(targets))
+    # The group components reached by a group component, as a bitset.
+    # Components come after the ones they reach, so those are complete.
+    reached = {}
+    for (c, component) in enumerate(components):
+        bits = 0
+        for recordid in component:
+            for group in graph.get(recordid, ()):
+                g = dsMapComponentByRecordId[group]
+                # A cycle of groups makes them members of themselves
+                bits |= (1 << bitbycomponent[g]) | reached.get(g, 0)
+        if bits and c in bitbycomponent:
+            reached[c] = bits
+        groups = []
+        while bits:
+            low = bits & -bits
+            groups.append(targets[low.bit_length() - 1])
+            bits ^= low
+        dsMapGroupsByComponent[c] = groups
+        for g in groups:
+            try:
+                dsMapMembersByComponent[g].append(c)
+            except KeyError:
+                dsMapMembersByComponent[g] = [c]
+
+def dsExpandComponents(components, recordid):
+    recordids = []
+    for c in components:
+        recordids.extend(dsMapRecordIdsByComponent[c])
+    return sorted(set(recordids) - set([recordid]))
+
+def dsGetEffectiveGroups(dsRecordId):
+    '''
+    Returns the record ids of all the groups dsRecordId is a member of,
+    directly, through nested groups or as its primary group
+    '''
+    c = dsMapComponentByRecordId.get(dsRecordId)
+    if c == None:
+        return []
+    return dsExpandComponents(dsMapGroupsByComponent.get(c, ()), dsRecordId)
+
+def dsGetEffectiveMembers(dsRecordId):
+    '''
+    Returns the record ids of all the objects that are a member of the
+    group dsRecordId, directly, through nested groups or by primary group
+    '''
+    c = dsMapComponentByRecordId.get(dsRecordId)
+    if c == None:
+        return []
+    return dsExpandComponents(dsMapMembersByComponent.get(c, ()), dsRecordId)
@@ -25,63 +25,118 @@ from ntds.dsrecord import *
 from ntds.dstime import *
 from ntds.dsencryption import *
 
+from struct import Struct
 from lib.guid import *
 from lib.sid import *
 from lib.dump import *
 
-class dsObject:
+class dsLazyAttribute(object):
+    '''
+    An attribute decoded from the record on first access. The decoded value
+    is kept in the slot named after the attribute with a leading underscore.
+    '''
+    def __init__(self, decode):
+        self.Decode = decode
+        self.Slot = None
+
+    def __set_name__(self, owner, name):
+        self.Slot = "_" + name
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.Slot)
+        except AttributeError:
+            value = self.Decode(obj)
+            setattr(obj, self.Slot, value)
+            return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.Slot, value)
+
+def dsLazyField(index):
+    '''
+    Returns a dsLazyAttribute for the raw value of a column, index being the
+    name of its dsfielddictionary entry
+    '''
+    def decode(obj):
+        return obj.Record[getattr(dsfielddictionary, index)]
+    return dsLazyAttribute(decode)
+
+def dsLazyInt(index, default=-1):
+    '''
+    Returns a dsLazyAttribute for the integer value of a column
+    '''
+    def decode(obj):
+        value = obj.Record[getattr(dsfielddictionary, index)]
+        if value != "":
+            return int(value)
+        return default
+    return dsLazyAttribute(decode)
+
+def dsLazyTimeStamp(index):
+    '''
+    Returns a dsLazyAttribute for a timestamp column
+    '''
+    def decode(obj):
+        return dsVerifyDSTimeStamp(obj.Record[getattr(dsfielddictionary, index)])
+    return dsLazyAttribute(decode)
+
+def dsLazyGUID(index):
+    '''
+    Returns a dsLazyAttribute for a GUID column, None if empty
+    '''
+    def decode(obj):
+        value = obj.Record[getattr(dsfielddictionary, index)]
+        if value != "":
+            return GUID(value)
+        return None
+    return dsLazyAttribute(decode)
+
+def dsDecodeWhenCreated(obj):
+    if obj.Record[dsfielddictionary.dsWhenCreatedIndex] != "":
+        return dsConvertToDSTimeStamp(obj.Record[dsfielddictionary.dsWhenCreatedIndex])
+    return dsConvertToDSTimeStamp(obj.Record[dsfielddictionary.dsRecordTimeIndex])
+
+def dsDecodeWhenChanged(obj):
+    if obj.Record[dsfielddictionary.dsWhenChangedIndex] != "":
+        return dsConvertToDSTimeStamp(obj.Record[dsfielddictionary.dsWhenChangedIndex])
+    return -1
+
+class dsObject(object):
     '''
     The main AD class
+
+    Objects only keep their record (a view of the projected columns) and
+    decode attributes the first time they are read.
     '''
-    Record      = None
-    Name        = ""
-    RecordId    = -1
-    TypeId      = -1
-    Type        = ""
-    GUID        = None
-    WhenCreated = -1
-    WhenChanged = -1
-    USNCreated  = -1
-    USNChanged  = -1
-    IsDeleted   = False
+    __slots__ = ('Database', 'Record', 'RecordId', 'TypeId',
+                 '_Name', '_Type', '_GUID', '_WhenCreated', '_WhenChanged',
+                 '_USNCreated', '_USNChanged', '_IsDeleted')
+
+    Name        = dsLazyField("dsObjectName2Index")
+    Type        = dsLazyAttribute(lambda obj: dsGetTypeName(obj.Database, obj.TypeId))
+    GUID        = dsLazyGUID("dsObjectGUIDIndex")
+    WhenCreated = dsLazyAttribute(dsDecodeWhenCreated)
+    WhenChanged = dsLazyAttribute(dsDecodeWhenChanged)
+    USNCreated  = dsLazyInt("dsUSNCreatedIndex")
+    USNChanged  = dsLazyInt("dsUSNChangedIndex")
+    IsDeleted   = dsLazyAttribute(lambda obj: obj.Record[dsfielddictionary.dsIsDeletedIndex] != "")
     
-    def __init__(self, dsDatabase, dsRecordId):
+    def __init__(self, dsDatabase, dsRecordId, dsRecord=None):
         '''
-        Constructor
+        Constructor. dsRecord is the record of dsRecordId when it has
+        already been read (see dsGetRecordsByRecordIds).
         '''
+        self.Database = dsDatabase
         self.RecordId = dsRecordId
-        self.Record = dsGetRecordByRecordId(dsDatabase, self.RecordId)
+        self.Record = dsRecord
+        if self.Record == None:
+            self.Record = dsGetRecordByRecordId(dsDatabase, self.RecordId)
         if self.Record == None:
             raise BaseException
-        self.Name   = self.Record[dsfielddictionary.dsObjectName2Index]
         self.TypeId = dsGetRecordType(dsDatabase, self.RecordId)
-        self.Type   = dsGetTypeName(dsDatabase, self.TypeId)
-
-        if self.Record[dsfielddictionary.dsObjectGUIDIndex] != "":
-            self.GUID = GUID(self.Record[dsfielddictionary.dsObjectGUIDIndex])
-        
-        if self.Record[dsfielddictionary.dsWhenCreatedIndex] != "":
-            self.WhenCreated = dsConvertToDSTimeStamp(
-                                self.Record[dsfielddictionary.dsWhenCreatedIndex]
-                                                      )
-        else:
-            self.WhenCreated = dsConvertToDSTimeStamp(
-                                self.Record[dsfielddictionary.dsRecordTimeIndex]
-                                                      )
-        
-        if self.Record[dsfielddictionary.dsWhenChangedIndex] != "":
-            self.WhenChanged = dsConvertToDSTimeStamp(
-                                self.Record[dsfielddictionary.dsWhenChangedIndex]
-                                                      )
-
-        if self.Record[dsfielddictionary.dsUSNCreatedIndex] != "":
-            self.USNCreated = int(self.Record[dsfielddictionary.dsUSNCreatedIndex])
-        
-        if self.Record[dsfielddictionary.dsUSNChangedIndex] != "":
-            self.USNChanged = int(self.Record[dsfielddictionary.dsUSNChangedIndex])
-            
-        if self.Record[dsfielddictionary.dsIsDeletedIndex] != "":
-            self.IsDeleted = True
             
     def getChilds(self):
         '''
@@ -113,116 +168,48 @@ class dsFVERecoveryInformation(dsObject):
     '''
     The class used for representing BitLocker recovery information stored in AD
     '''
-    RecoveryGUID = None
-    VolumeGUID = None
-    RecoveryPassword = ""
-    FVEKeyPackage = ""
-    
-    def __init__(self, dsDatabase, dsRecordId):
-        '''
-        Constructor
-        '''
-        dsObject.__init__(self, dsDatabase, dsRecordId)
-        if self.Record[dsfielddictionary.dsRecoveryGUIDIndex] != "":
-            self.RecoveryGUID = GUID(self.Record[dsfielddictionary.dsRecoveryGUIDIndex])
-        if self.Record[dsfielddictionary.dsVolumeGUIDIndex] != "":
-            self.VolumeGUID = GUID(self.Record[dsfielddictionary.dsVolumeGUIDIndex])
-        self.RecoveryPassword = self.Record[dsfielddictionary.dsRecoveryPasswordIndex]
-        self.FVEKeyPackage = self.Record[dsfielddictionary.dsFVEKeyPackageIndex]
-        
+    __slots__ = ('_RecoveryGUID', '_VolumeGUID', '_RecoveryPassword', '_FVEKeyPackage')
+
+    RecoveryGUID = dsLazyGUID("dsRecoveryGUIDIndex")
+    VolumeGUID = dsLazyGUID("dsVolumeGUIDIndex")
+    RecoveryPassword = dsLazyField("dsRecoveryPasswordIndex")
+    FVEKeyPackage = dsLazyField("dsFVEKeyPackageIndex")
         
                 
 class dsAccount(dsObject):
     '''
     The main account class
     '''
-    SID                = None
-    SAMAccountName     = ""
-    PrincipalName  = ""
-    SAMAccountType     = -1
-    UserAccountControl = -1
-    LogonCount         = -1
-    LastLogon          = -1
-    LastLogonTimeStamp = -1
-    PasswordLastSet    = -1
-    AccountExpires     = -1
-    BadPwdTime         = -1
-    SupplementalCredentials = ""
-    PrimaryGroupID     = -1
-    BadPwdCount        = -1
-    
-    def __init__(self, dsDatabase, dsRecordId):
-        '''
-        Constructor
-        '''
-        dsObject.__init__(self, dsDatabase, dsRecordId)
-        
-        self.SID = SID(self.Record[dsfielddictionary.dsSIDIndex])
-        self.SAMAccountName = self.Record[dsfielddictionary.dsSAMAccountNameIndex]
-        self.PrincipalName = self.Record[dsfielddictionary.dsUserPrincipalNameIndex]
-        if self.Record[dsfielddictionary.dsSAMAccountTypeIndex] != "":
-            self.SAMAccountType = int(self.Record[dsfielddictionary.dsSAMAccountTypeIndex])
-        if self.Record[dsfielddictionary.dsUserAccountControlIndex] != "":
-            self.UserAccountControl = int(self.Record[dsfielddictionary.dsUserAccountControlIndex])
-        if self.Record[dsfielddictionary.dsPrimaryGroupIdIndex] != "":
-            self.PrimaryGroupID = int(self.Record[dsfielddictionary.dsPrimaryGroupIdIndex])
-        if self.Record[dsfielddictionary.dsLogonCountIndex] != "":
-            self.LogonCount = int(self.Record[dsfielddictionary.dsLogonCountIndex])
-        else:
-            self.BadPwdCount = -1
-        if self.Record[dsfielddictionary.dsBadPwdCountIndex] != "":
-            self.BadPwdCount = int(self.Record[dsfielddictionary.dsBadPwdCountIndex])
-        else:
-            self.BadPwdCount = -1
-                        
-        self.LastLogon = dsVerifyDSTimeStamp(self.Record[dsfielddictionary.dsLastLogonIndex])
-        
-        self.LastLogonTimeStamp = dsVerifyDSTimeStamp(self.Record[dsfielddictionary.dsLastLogonTimeStampIndex])
-        
-        self.PasswordLastSet = dsVerifyDSTimeStamp(self.Record[dsfielddictionary.dsPasswordLastSetIndex])
-        
-        self.AccountExpires = dsVerifyDSTimeStamp(self.Record[dsfielddictionary.dsAccountExpiresIndex])
-        
-        self.BadPwdTime = dsVerifyDSTimeStamp(self.Record[dsfielddictionary.dsBadPwdTimeIndex])
+    __slots__ = ('_SID', '_SAMAccountName', '_PrincipalName', '_SAMAccountType',
+                 '_UserAccountControl', '_LogonCount', '_LastLogon',
+                 '_LastLogonTimeStamp', '_PasswordLastSet', '_AccountExpires',
+                 '_BadPwdTime', '_SupplementalCredentials', '_PrimaryGroupID',
+                 '_BadPwdCount')
+
+    SID                = dsLazyAttribute(lambda obj: SID(obj.Record[dsfielddictionary.dsSIDIndex]))
+    SAMAccountName     = dsLazyField("dsSAMAccountNameIndex")
+    PrincipalName      = dsLazyField("dsUserPrincipalNameIndex")
+    SAMAccountType     = dsLazyInt("dsSAMAccountTypeIndex")
+    UserAccountControl = dsLazyInt("dsUserAccountControlIndex")
+    LogonCount         = dsLazyInt("dsLogonCountIndex")
+    LastLogon          = dsLazyTimeStamp("dsLastLogonIndex")
+    LastLogonTimeStamp = dsLazyTimeStamp("dsLastLogonTimeStampIndex")
+    PasswordLastSet    = dsLazyTimeStamp("dsPasswordLastSetIndex")
+    AccountExpires     = dsLazyTimeStamp("dsAccountExpiresIndex")
+    BadPwdTime         = dsLazyTimeStamp("dsBadPwdTimeIndex")
+    SupplementalCredentials = dsLazyAttribute(lambda obj: "")
+    PrimaryGroupID     = dsLazyInt("dsPrimaryGroupIdIndex")
+    BadPwdCount        = dsLazyInt("dsBadPwdCountIndex")
     
     def getPasswordHashes(self):
-        lmhash = ""
-        nthash = ""
-        enclmhash = unhexlify(self.Record[dsfielddictionary.dsLMHashIndex][16:])
-        encnthash = unhexlify(self.Record[dsfielddictionary.dsNTHashIndex][16:])
-        if enclmhash != '':
-            lmhash = dsDecryptWithPEK(dsfielddictionary.dsPEK, enclmhash)
-            lmhash = hexlify(dsDecryptSingleHash(self.SID.RID, lmhash))
-            if lmhash == '':
-                lmhash = "NO PASSWORD"
-        if encnthash != '':
-            nthash = dsDecryptWithPEK(dsfielddictionary.dsPEK, encnthash)
-            nthash = hexlify(dsDecryptSingleHash(self.SID.RID, nthash))
-            if nthash == '':
-                nthash = "NO PASSWORD"
+        ciphers = dsGetDESCiphers(self.SID.RID)
+        lmhash = dsDecryptHash(dsfielddictionary.dsPEK, self.SID.RID, self.Record[dsfielddictionary.dsLMHashIndex], ciphers)
+        nthash = dsDecryptHash(dsfielddictionary.dsPEK, self.SID.RID, self.Record[dsfielddictionary.dsNTHashIndex], ciphers)
         return (lmhash, nthash)
     
     def getPasswordHistory(self):
-        lmhistory = []
-        nthistory = []
-        enclmhistory = unhexlify(self.Record[dsfielddictionary.dsLMHashHistoryIndex][16:])
-        encnthistory = unhexlify(self.Record[dsfielddictionary.dsNTHashHistoryIndex][16:])
-        slmhistory = dsDecryptWithPEK(dsfielddictionary.dsPEK, enclmhistory)
-        snthistory = dsDecryptWithPEK(dsfielddictionary.dsPEK, encnthistory)
-        if slmhistory != "":
-            for hindex in range(0,len(slmhistory)/16):
-                lmhash   = dsDecryptSingleHash(self.SID.RID, slmhistory[hindex*16:(hindex+1)*16])
-                if lmhash == '':
-                    lmhistory.append('NO PASSWORD')
-                else:
-                    lmhistory.append(hexlify(lmhash))
-        if snthistory != "":
-            for hindex in range(0,len(snthistory)/16):
-                nthash = dsDecryptSingleHash(self.SID.RID, snthistory[hindex*16:(hindex+1)*16])
-                if nthash == '':
-                    nthistory.append('NO PASSWORD')
-                else:
-                    nthistory.append(hexlify(nthash))
+        lmhistory = dsDecryptHashHistory(dsfielddictionary.dsPEK, self.SID.RID, self.Record[dsfielddictionary.dsLMHashHistoryIndex])
+        nthistory = dsDecryptHashHistory(dsfielddictionary.dsPEK, self.SID.RID, self.Record[dsfielddictionary.dsNTHashHistoryIndex])
         return (lmhistory, nthistory)
     
     def getSupplementalCredentials(self):
@@ -299,32 +286,20 @@ class dsUser(dsAccount):
     '''
     The class used for representing User objects stored in AD
     '''
-    Certificate = ""
-    
-    def __init__(self, dsDatabase, dsRecordId):
-        '''
-        Constructor
-        '''
-        dsAccount.__init__(self, dsDatabase, dsRecordId)
-        if self.Record[dsfielddictionary.dsADUserObjectsIndex] != "":
-            self.Certificate = unhexlify(self.Record[dsfielddictionary.dsADUserObjectsIndex])
+    __slots__ = ('_Certificate',)
+
+    Certificate = dsLazyAttribute(lambda obj: unhexlify(obj.Record[dsfielddictionary.dsADUserObjectsIndex])
+                                  if obj.Record[dsfielddictionary.dsADUserObjectsIndex] != "" else "")
         
 class dsComputer(dsAccount):
     '''
     The class used for representing Computer objects stored in AD
     '''
-    DNSHostName = ""
-    OSName = ""
-    OSVersion = ""
+    __slots__ = ('_DNSHostName', '_OSName', '_OSVersion')
 
-    def __init__(self, dsDatabase, dsRecordId):
-        '''
-        Constructor
-        '''
-        dsAccount.__init__(self, dsDatabase, dsRecordId)
-        self.DNSHostName = self.Record[dsfielddictionary.dsDNSHostNameIndex]
-        self.OSName = self.Record[dsfielddictionary.dsOSNameIndex]
-        self.OSVersion = self.Record[dsfielddictionary.dsOSVersionIndex]
+    DNSHostName = dsLazyField("dsDNSHostNameIndex")
+    OSName = dsLazyField("dsOSNameIndex")
+    OSVersion = dsLazyField("dsOSVersionIndex")
     
     def getRecoveryInformations(self, dsDatabase):
         rinfos = []
@@ -338,14 +313,9 @@ class dsGroup(dsObject):
     '''
     The class used for representing Group objects stored in AD
     '''
-    SID     = None
-    
-    def __init__(self, dsDatabase, dsRecordId):
-        '''
-        Constructor
-        '''
-        dsObject.__init__(self, dsDatabase, dsRecordId)
-        self.SID = SID(self.Record[dsfielddictionary.dsSIDIndex])
+    __slots__ = ('_SID',)
+
+    SID = dsLazyAttribute(lambda obj: SID(obj.Record[dsfielddictionary.dsSIDIndex]))
     
     def getMembers(self):
         memberlist = []
@@ -355,16 +325,19 @@ class dsGroup(dsObject):
         except KeyError:
             return []
 
-class dsKerberosKey:
-    IterationCount = None
+class dsKerberosKey(object):
     # for list of encryption codes see NTSecAPI.h header in Microsoft SDK
     # normally you'll see the following codes:
     #define KERB_ETYPE_DES_CBC_MD5      3
     #define KERB_ETYPE_AES128_CTS_HMAC_SHA1_96    17
     #define KERB_ETYPE_AES256_CTS_HMAC_SHA1_96    18
     #define KERB_ETYPE_RC4_PLAIN        -140
-    KeyType = None
-    Key = None
+    __slots__ = ('KeyType', 'Key', 'IterationCount')
+
+    def __init__(self, keytype=None, key=None, iterationcount=None):
+        self.KeyType = keytype
+        self.Key = key
+        self.IterationCount = iterationcount
     
 class dsKerberosNewKeys:
     DefaultSalt = None
@@ -391,18 +364,38 @@ class dsKerberosNewKeys:
             for key in self.OlderCredentials:
                 print("{0}  {1} {2}".format(indent, key.KeyType, hexlify(key.Key)))
 
+# Layouts of the supplemental credentials structures (little endian)
+dsUserPropertiesHeader    = Struct('<IIHH96xHH')      # USER_PROPERTIES
+dsUserPropertyHeader      = Struct('<HHH')            # USER_PROPERTY
+dsWDigestHeader           = Struct('<BBBB3I')         # WDIGEST_CREDENTIALS
+dsKerbCredentialNewHeader = Struct('<HHHHHHHHII')     # KERB_STORED_CREDENTIAL_NEW
+dsKerbCredentialHeader    = Struct('<HHHHHHI')        # KERB_STORED_CREDENTIAL
+dsKerbKeyDataNew          = Struct('<HHIIiII')        # KERB_KEY_DATA_NEW
+dsKerbKeyData             = Struct('<HHIiII')         # KERB_KEY_DATA
+
+# Property names as stored (UTF-16) so that they are compared undecoded
+dsKerberosNewerKeysName = u"Primary:Kerberos-Newer-Keys".encode('utf-16-le')
+dsKerberosName          = u"Primary:Kerberos".encode('utf-16-le')
+dsWDigestName           = u"Primary:WDigest".encode('utf-16-le')
+dsPackagesName          = u"Packages".encode('utf-16-le')
+dsCleartextName         = u"Primary:CLEARTEXT".encode('utf-16-le')
+
 class dsSupplCredentials:
     '''
     Supplemental credentials structures are documented in
     http://msdn.microsoft.com/en-us/library/cc245499.aspx
+
+    The structures are read in place through a memoryview with precompiled
+    layouts. When kerberosonly is True, only the Kerberos keys are parsed.
     '''
-    def __init__(self, text):
+    def __init__(self, text, kerberosonly=False):
         self.KerberosNewerKeys = None
         self.KerberosKeys = None
         self.WDigestHashes = None
         self.Packages = None
         self.Password = None
         self.Text = text
+        self.KerberosOnly = kerberosonly
         self.ParseUserProperties(text)
     
     def Print(self, indent=""):
@@ -424,122 +417,90 @@ class dsSupplCredentials:
             print("{0}Password: {1}".format(indent, self.Password))
         print("Debug: ")
         print(dump(self.Text,16,16))
+
+    def getKerberosKeys(self):
+        '''
+        Returns the current Kerberos keys, the newer ones if present
+        '''
+        for keys in (self.KerberosNewerKeys, self.KerberosKeys):
+            if keys != None:
+                return keys.Credentials
+        return []
     
     def ParseUserProperties(self, text):
-        offset = 0
-        reserved1 = unpack('I', text[offset:offset+4])[0]
+        view = memoryview(text)
+        (reserved1, lengthOfStructure, reserved2, reserved3,
+         PropertySignature, PropertyCount) = dsUserPropertiesHeader.unpack_from(view, 0)
         assert reserved1 == 0
-        offset += 4
-        lengthOfStructure = unpack('I', text[offset:offset+4])[0]
-        assert len(text) == lengthOfStructure + 3*4 + 1
-        offset += 4
-        reserved2 = unpack('H', text[offset:offset+2])[0]
+        assert len(view) == lengthOfStructure + 3*4 + 1
         assert reserved2 == 0
-        offset += 2
-        reserved3 = unpack('H', text[offset:offset+2])[0]
         assert reserved3 == 0
-        offset += 2
-        offset += 96 # reserved4
-        PropertySignature = unpack('H', text[offset:offset+2])[0]
         assert PropertySignature == 0x50
-        offset += 2
-        # The number of USER_PROPERTY elements in the UserProperties field.
-        PropertyCount = unpack('H', text[offset:offset+2])[0]
-        offset += 2
+        offset = dsUserPropertiesHeader.size
+        # PropertyCount is the number of USER_PROPERTY elements
         for i in range(PropertyCount):
-            offset = self.ParseUserProperty(text, offset)
-        assert offset == len(text) - 1
-        reserved5 = ord(text[offset:offset+1])
-        # must be 0 according to documentation, but in practice contains arbitrary value
-        #assert reserved5 == 0
+            offset = self.ParseUserProperty(view, offset)
+        assert offset == len(view) - 1
+        # reserved5 must be 0 according to documentation, but in practice
+        # contains arbitrary value
   
-    def ParseUserProperty(self, text, offset):
-        NameLength = unpack('H', text[offset:offset+2])[0]
-        offset += 2
-        ValueLength = unpack('H', text[offset:offset+2])[0]
-        offset += 2
-        reserved = unpack('H', text[offset:offset+2])[0]
-        offset += 2
-        Name = text[offset:offset+NameLength].decode('utf-16')
+    def ParseUserProperty(self, view, offset):
+        (NameLength, ValueLength, reserved) = dsUserPropertyHeader.unpack_from(view, offset)
+        offset += dsUserPropertyHeader.size
+        Name = view[offset:offset+NameLength]
         offset += NameLength
-        if Name == u"Primary:Kerberos-Newer-Keys":
-            self.KerberosNewerKeys = self.ParseKerberosNewerKeysPropertyValue(unhexlify(text[offset:offset+ValueLength]))
-        elif Name == u"Primary:Kerberos":
-            self.KerberosKeys = self.ParseKerberosPropertyValue(unhexlify(text[offset:offset+ValueLength]))
-        elif Name == u"Primary:WDigest":
-            self.WDigestHashes = self.ParseWDigestPropertyValue(unhexlify(text[offset:offset+ValueLength]))
-        elif Name == u"Packages":
-            self.Packages = unhexlify(text[offset:offset+ValueLength]).decode('utf-16').split("\x00")
-        elif Name == u"Primary:CLEARTEXT":
-            self.Password = unhexlify(text[offset:offset+ValueLength]).decode('utf-16')
+        # Values are stored hex encoded
+        value = view[offset:offset+ValueLength]
+        if Name == dsKerberosNewerKeysName:
+            self.KerberosNewerKeys = self.ParseKerberosNewerKeysPropertyValue(unhexlify(value))
+        elif Name == dsKerberosName:
+            self.KerberosKeys = self.ParseKerberosPropertyValue(unhexlify(value))
+        elif self.KerberosOnly:
+            pass
+        elif Name == dsWDigestName:
+            self.WDigestHashes = self.ParseWDigestPropertyValue(unhexlify(value))
+        elif Name == dsPackagesName:
+            self.Packages = unhexlify(value).decode('utf-16').split("\x00")
+        elif Name == dsCleartextName:
+            self.Password = unhexlify(value).decode('utf-16')
         else:
-            print(Name)
+            print(bytes(Name).decode('utf-16'))
         return offset + ValueLength
 
     def ParseWDigestPropertyValue(self, text):
         try:
-            offset = 0
-            Reserved1 = ord(text[offset:offset+1])
-            offset += 1
-            Reserved2 = ord(text[offset:offset+1])
+            (Reserved1, Reserved2, Version, NumberOfHashes,
+             Reserved3a, Reserved3b, Reserved3c) = dsWDigestHeader.unpack_from(text, 0)
             assert Reserved2 == 0
-            offset += 1
-            Version = ord(text[offset:offset+1])
             assert Version == 1
-            offset += 1
-            NumberOfHashes = ord(text[offset:offset+1])
             assert NumberOfHashes == 29
-            offset += 1
-            for i in range(3):
-                Reserved3 = unpack('I', text[offset:offset+4])[0]
-                assert Reserved3 == 0
-                offset += 4
-            hashes = []
-            for i in range(NumberOfHashes):
-                hashes.append(text[offset:offset+16])
-                offset += 16
-            return hashes
+            assert Reserved3a == 0 and Reserved3b == 0 and Reserved3c == 0
+            offset = dsWDigestHeader.size
+            assert len(text) >= offset + NumberOfHashes*16
+            return [text[offset + i*16:offset + (i+1)*16] for i in range(NumberOfHashes)]
         except:
             return None
     
     def ParseKerberosNewerKeysPropertyValue(self, text):
         try:
-            offset = 0
+            view = memoryview(text)
             keys = dsKerberosNewKeys()
-            Revision = unpack('H', text[offset:offset+2])[0]
+            (Revision, Flags, CredentialCount, ServiceCredentialCount,
+             OldCredentialCount, OlderCredentialCount, DefaultSaltLength,
+             DefaultSaltMaximumLength, DefaultSaltOffset,
+             DefaultIterationCount) = dsKerbCredentialNewHeader.unpack_from(view, 0)
             assert Revision == 4
-            offset += 2
-            Flags = unpack('H', text[offset:offset+2])[0]
             assert Flags == 0
-            offset += 2
-            CredentialCount = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            ServiceCredentialCount = unpack('H', text[offset:offset+2])[0]
             assert ServiceCredentialCount == 0
-            offset += 2
-            OldCredentialCount = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            OlderCredentialCount = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            DefaultSaltLength = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            DefaultSaltMaximumLength = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            DefaultSaltOffset = unpack('I', text[offset:offset+4])[0]
-            offset += 4
-            DefaultIterationCount = unpack('I', text[offset:offset+4])[0]
-            offset += 4
-            for i in range(CredentialCount):
-                offset, key = self.KerberosKeyDataNew(text, offset)
-                keys.Credentials.append(key)
-            for i in range(OldCredentialCount):
-                offset, key = self.KerberosKeyDataNew(text, offset)
-                keys.OldCredentials.append(key)
-            for i in range(OlderCredentialCount):
-                offset, key = self.KerberosKeyDataNew(text, offset)
-                keys.OlderCredentials.append(key)
-            # + one blank KeyDataNew record. Record length is 24 bytes,
-            offset += 24
+            offset = dsKerbCredentialNewHeader.size
+            for (count, credentials) in ((CredentialCount, keys.Credentials),
+                                         (OldCredentialCount, keys.OldCredentials),
+                                         (OlderCredentialCount, keys.OlderCredentials)):
+                for i in range(count):
+                    offset, key = self.KerberosKeyDataNew(view, offset)
+                    credentials.append(key)
+            # + one blank KeyDataNew record
+            offset += dsKerbKeyDataNew.size
             assert offset == DefaultSaltOffset
             keys.DefaultSalt = text[offset:offset+DefaultSaltMaximumLength].decode("utf-16")
             return keys
@@ -548,83 +509,37 @@ class dsSupplCredentials:
 
     def ParseKerberosPropertyValue(self, text):
         try:
-            offset = 0
+            view = memoryview(text)
             keys = dsKerberosNewKeys()
-            Revision = unpack('H', text[offset:offset+2])[0]
+            (Revision, Flags, CredentialCount, OldCredentialCount,
+             DefaultSaltLength, DefaultSaltMaximumLength,
+             DefaultSaltOffset) = dsKerbCredentialHeader.unpack_from(view, 0)
             assert Revision == 3
-            offset += 2
-            Flags = unpack('H', text[offset:offset+2])[0]
             assert Flags == 0
-            offset += 2
-            CredentialCount = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            OldCredentialCount = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            DefaultSaltLength = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            DefaultSaltMaximumLength = unpack('H', text[offset:offset+2])[0]
-            offset += 2
-            DefaultSaltOffset = unpack('I', text[offset:offset+4])[0]
-            offset += 4
-            for i in range(CredentialCount):
-                offset, key = self.KerberosKeyData(text, offset)
-                keys.Credentials.append(key)
-            for i in range(OldCredentialCount):
-                offset, key = self.KerberosKeyData(text, offset)
-                keys.OldCredentials.append(key)
-            # + one blank KeyDataNew record. Record length is 20 bytes,
-            offset += 20
+            offset = dsKerbCredentialHeader.size
+            for (count, credentials) in ((CredentialCount, keys.Credentials),
+                                         (OldCredentialCount, keys.OldCredentials)):
+                for i in range(count):
+                    offset, key = self.KerberosKeyData(view, offset)
+                    credentials.append(key)
+            # + one blank KeyData record
+            offset += dsKerbKeyData.size
             assert offset == DefaultSaltOffset
             keys.DefaultSalt = text[offset:offset+DefaultSaltMaximumLength].decode("utf-16")
             return keys
         except:
             return None
 
-    def KerberosKeyDataNew(self, text, offset):
-        try:
-            key = dsKerberosKey()
-            Reserved1 = unpack('H', text[offset:offset+2])[0]
-            assert Reserved1 == 0
-            offset += 2
-            Reserved2 = unpack('H', text[offset:offset+2])[0]
-            assert Reserved2 == 0
-            offset += 2
-            Reserved3 = unpack('I', text[offset:offset+4])[0]
-            assert Reserved3 == 0
-            offset += 4
-            key.IterationCount = unpack('I', text[offset:offset+4])[0]
-            offset += 4
-            key.KeyType = unpack('i', text[offset:offset+4])[0]
-            offset += 4
-            KeyLength = unpack('I', text[offset:offset+4])[0]
-            offset += 4
-            KeyOffset = unpack('I', text[offset:offset+4])[0]
-            offset += 4
-            key.Key = text[KeyOffset:KeyOffset+KeyLength]
-            return offset, key
-        except:
-            return None
-    
-    def KerberosKeyData(self, text, offset):
-        try:
-            key = dsKerberosKey()
-            Reserved1 = unpack('H', text[offset:offset+2])[0]
-            assert Reserved1 == 0
-            offset += 2
-            Reserved2 = unpack('H', text[offset:offset+2])[0]
-            assert Reserved2 == 0
-            offset += 2
-            Reserved3 = unpack('I', text[offset:offset+4])[0]
-            assert Reserved3 == 0
-            offset += 4
-            key.KeyType = unpack('i', text[offset:offset+4])[0]
-            offset += 4
-            KeyLength = unpack('I', text[offset:offset+4])[0]
-            offset += 4
-            KeyOffset = unpack('I', text[offset:offset+4])[0]
-            offset += 4
-            key.Key = text[KeyOffset:KeyOffset+KeyLength]
-            return offset, key
-        except:
-            return None
+    def KerberosKeyDataNew(self, view, offset):
+        (Reserved1, Reserved2, Reserved3, IterationCount,
+         KeyType, KeyLength, KeyOffset) = dsKerbKeyDataNew.unpack_from(view, offset)
+        assert Reserved1 == 0 and Reserved2 == 0 and Reserved3 == 0
+        assert KeyOffset + KeyLength <= len(view)
+        return offset + dsKerbKeyDataNew.size, dsKerberosKey(KeyType, bytes(view[KeyOffset:KeyOffset+KeyLength]), IterationCount)
     
+    def KerberosKeyData(self, view, offset):
+        (Reserved1, Reserved2, Reserved3,
+         KeyType, KeyLength, KeyOffset) = dsKerbKeyData.unpack_from(view, offset)
+        assert Reserved1 == 0 and Reserved2 == 0 and Reserved3 == 0
+        assert KeyOffset + KeyLength <= len(view)
+        return offset + dsKerbKeyData.size, dsKerberosKey(KeyType, bytes(view[KeyOffset:KeyOffset+KeyLength]))
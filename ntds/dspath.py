@@ -0,0 +1,124 @@
+'''
+Distinguished name and ancestor path resolver.
+
+The name, parent and RDN type of every object on a path are read once and
+kept by DNT, and so is the path of every object resolved so far. Resolving
+an object therefore only reads its own record and walks up to the first
+ancestor already resolved, which in a bulk enumeration is its container.
+'''
+from ntds.dsrecord import *
+import ntds.dsfielddictionary
+
+dsMapNodeByRecordId  = {} #Map that can be used to find (name, parent, RDN type) of a record
+dsMapChainByRecordId = {} #Map that can be used to find the ancestor chain of a record
+dsMapDNByRecordId    = {} #Map that can be used to find the distinguished name of a record
+dsMapRDNTypeByTypeId = {} #Map that can be used to find the RDN attribute of an object type
+
+# RDN attribute of the structural classes not named by their cn
+dsRDNTypes = {
+    "Domain-DNS"          : "DC",
+    "Dns-Zone"            : "DC",
+    "Dns-Node"            : "DC",
+    "Organizational-Unit" : "OU",
+    "Organization"        : "O",
+    "Country"             : "C",
+    "Locality"            : "L"
+}
+
+def dsGetRDNType(dsDatabase, dsTypeId):
+    '''
+    Returns the RDN attribute (CN, OU, DC...) of an object type
+    '''
+    try:
+        return dsMapRDNTypeByTypeId[dsTypeId]
+    except KeyError:
+        rdntype = dsRDNTypes.get(dsGetTypeName(dsDatabase, dsTypeId), "CN")
+        dsMapRDNTypeByTypeId[dsTypeId] = rdntype
+        return rdntype
+
+def dsGetNode(dsDatabase, dsRecordId):
+    '''
+    Returns (name, parent record id, RDN type) of a record, or None if the
+    record does not exist
+    '''
+    try:
+        return dsMapNodeByRecordId[dsRecordId]
+    except KeyError:
+        pass
+    record = dsGetRecordByRecordId(dsDatabase, dsRecordId)
+    if record == None:
+        node = None
+    else:
+        try:
+            parent = int(record[ntds.dsfielddictionary.dsParentRecordIdIndex])
+        except ValueError:
+            parent = -1
+        node = (record[ntds.dsfielddictionary.dsObjectName2Index],
+                parent,
+                dsGetRDNType(dsDatabase, dsGetRecordType(dsDatabase, dsRecordId)))
+    dsMapNodeByRecordId[dsRecordId] = node
+    return node
+
+def dsGetUnresolvedPath(dsDatabase, dsRecordId, cache):
+    '''
+    Returns the record ids from dsRecordId up to (excluding) the first
+    ancestor found in cache or the root, and that ancestor (or None)
+    '''
+    path = []
+    seen = set()
+    recordid = dsRecordId
+    while not recordid in cache:
+        node = dsGetNode(dsDatabase, recordid)
+        if node == None or recordid in seen:
+            return path, None
+        seen.add(recordid)
+        path.append(recordid)
+        recordid = node[1]
+    return path, recordid
+
+def dsGetAncestorChain(dsDatabase, dsRecordId):
+    '''
+    Returns the names of the ancestors of a record, from the root down to
+    the record itself, joined by "->"
+    '''
+    (path, top) = dsGetUnresolvedPath(dsDatabase, dsRecordId, dsMapChainByRecordId)
+    chain = None if top == None else dsMapChainByRecordId[top]
+    for recordid in reversed(path):
+        name = dsMapNodeByRecordId[recordid][0]
+        chain = name if chain == None else chain + "->" + name
+        dsMapChainByRecordId[recordid] = chain
+    return "" if chain == None else chain
+
+def dsEscapeRDN(value):
+    '''
+    Escapes an attribute value for use in a DN (RFC 4514)
+    '''
+    escaped = ""
+    for c in value:
+        if c in ',+"\\<>;=':
+            escaped += "\\" + c
+        else:
+            escaped += c
+    if escaped.startswith(" ") or escaped.startswith("#"):
+        escaped = "\\" + escaped
+    if escaped.endswith(" ") and not escaped.endswith("\\ "):
+        escaped = escaped[:-1] + "\\ "
+    return escaped
+
+def dsGetDN(dsDatabase, dsRecordId):
+    '''
+    Returns the distinguished name of a record. The root object has an
+    empty DN.
+    '''
+    (path, top) = dsGetUnresolvedPath(dsDatabase, dsRecordId, dsMapDNByRecordId)
+    if top == None and path:
+        # The last object of the path has no parent, it is the root
+        top = path.pop()
+        dsMapDNByRecordId[top] = ""
+    dn = "" if top == None else dsMapDNByRecordId[top]
+    for recordid in reversed(path):
+        (name, parent, rdntype) = dsMapNodeByRecordId[recordid]
+        rdn = "%s=%s" % (rdntype, dsEscapeRDN(name))
+        dn = rdn if dn == "" else rdn + "," + dn
+        dsMapDNByRecordId[recordid] = dn
+    return dn
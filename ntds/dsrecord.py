@@ -20,33 +20,162 @@
 '''
 from ntds.dsdatabase import *
 import ntds.dsfielddictionary
+from collections import OrderedDict
+
+class dsRecordCache:
+    '''
+    Size bounded LRU cache of parsed records.
+
+    Records are keyed by line id: every DNT has exactly one line, so the
+    records fetched by record id and by line id share the same entries.
+    The size of a record is estimated from the length of its fields.
+    '''
+    def __init__(self, capacity):
+        self.Capacity = capacity
+        self.Size = 0
+        self.Hits = 0
+        self.Misses = 0
+        self.Evictions = 0
+        self.Database = None
+        self.Records = OrderedDict()
+
+    def clear(self):
+        self.Records.clear()
+        self.Size = 0
+
+    def setCapacity(self, capacity):
+        self.Capacity = capacity
+        self._evict()
+
+    def _evict(self):
+        while self.Size > self.Capacity and self.Records:
+            (lineid, (record, size)) = self.Records.popitem(last=False)
+            self.Size -= size
+            self.Evictions += 1
+
+    def _check(self, dsDatabase):
+        if dsDatabase is not self.Database:
+            # Another table (or a rebuilt one), line ids mean something else
+            self.clear()
+            self.Database = dsDatabase
+
+    def lookup(self, dsDatabase, lineid):
+        '''
+        Returns the cached record of lineid, or None
+        '''
+        self._check(dsDatabase)
+        try:
+            (record, size) = self.Records[lineid]
+            self.Records.move_to_end(lineid)
+            self.Hits += 1
+            return record
+        except KeyError:
+            return None
+
+    def add(self, lineid, record):
+        if record != None and self.Capacity > 0 and not lineid in self.Records:
+            size = dsGetRecordSize(record)
+            self.Records[lineid] = (record, size)
+            self.Size += size
+            self._evict()
+
+    def get(self, dsDatabase, lineid):
+        record = self.lookup(dsDatabase, lineid)
+        if record != None:
+            return record
+        self.Misses += 1
+        record = dsDatabase.getRecord(lineid)
+        self.add(lineid, record)
+        return record
+
+def dsGetRecordSize(record):
+    '''
+    Returns the estimated memory footprint of a parsed record in bytes
+    '''
+    if isinstance(record, dsRecordView):
+        size = 200 + len(record.Line)
+        if record.Fields != None:
+            size += sum(56 + len(field) for field in record.Fields)
+        if record.Record != None:
+            size += sum(56 + len(field) for field in record.Record)
+        return size
+    return 64 + sum(56 + len(str(field)) for field in record)
+
+dsRecordCacheSize = 64 * 1024 * 1024 #Default memory cap of the record cache, in bytes
+dsMapRecordByLineId = dsRecordCache(dsRecordCacheSize) #Map that can be used to find the cached record of a line
+
+def dsSetRecordCacheSize(size):
+    '''
+    Sets the memory cap of the record cache in bytes, 0 disables the cache
+    '''
+    dsMapRecordByLineId.setCapacity(size)
+
+def dsGetRecordCacheStats():
+    '''
+    Returns (hits, misses, evictions, cached records, estimated bytes)
+    '''
+    return (dsMapRecordByLineId.Hits, dsMapRecordByLineId.Misses, dsMapRecordByLineId.Evictions, len(dsMapRecordByLineId.Records), dsMapRecordByLineId.Size)
 
 def dsGetRecordByLineId(dsDatabase, dsLineId):
     '''
     Returns the parsed record for lineid by reading the appropriate line from
     the database
     '''
-    offset = dsMapOffsetByLineId[int(dsLineId)]
-    dsDatabase.seek(offset)
-    line = dsDatabase.readline()
-    line = line.decode('utf-8')
-    if line == "":
-        return None
-    else:
-        record = line.split('\t')
-        return record
+    return dsMapRecordByLineId.get(dsDatabase, int(dsLineId))
 
 def dsGetRecordByRecordId(dsDatabase, dsRecordId):
     '''
     Returns the parsed record for recordid
     '''
-    lineid = -1
     try:
-        lineid = int(dsMapLineIdByRecordId[int(dsRecordId)])
-        return dsGetRecordByLineId(dsDatabase, lineid)
+        lineid = dsMapLineIdByRecordId.Values[int(dsRecordId)]
+        if lineid == -1 or int(dsRecordId) < 0:
+            return None
+        return dsMapRecordByLineId.get(dsDatabase, lineid)
     except:
         return None
 
+dsRecordBatchSize = 4096 #Number of records fetched per batch by dsGetRecordsByRecordIds
+
+def dsGetRecordsByRecordIds(dsDatabase, dsRecordIds):
+    '''
+    Yields the parsed records of dsRecordIds (None for the ones that do not
+    exist), in the order of dsRecordIds. The records that are not cached
+    are read per batch in the order of their offsets, adjacent lines
+    together, so that the table is read sequentially.
+    '''
+    offsets = dsDatabase.Offsets
+    recordids = iter(dsRecordIds)
+    while True:
+        batch = []
+        for recordid in recordids:
+            batch.append(int(recordid))
+            if len(batch) == dsRecordBatchSize:
+                break
+        if not batch:
+            return
+        lineids = []
+        records = {}
+        for recordid in batch:
+            lineid = dsMapLineIdByRecordId.get(recordid, -1)
+            lineids.append(lineid)
+            if lineid == -1 or lineid in records:
+                continue
+            records[lineid] = dsMapRecordByLineId.lookup(dsDatabase, lineid)
+        missing = sorted((lineid for (lineid, record) in records.items() if record == None), key=lambda lineid: offsets[lineid])
+        dsMapRecordByLineId.Misses += len(missing)
+        for (lineid, record) in dsDatabase.getRecords(missing):
+            records[lineid] = record
+            dsMapRecordByLineId.add(lineid, record)
+        for lineid in lineids:
+            yield records.get(lineid)
+
+def dsIterRecordIds():
+    '''
+    Yields the record ids (DNTs) present in the database
+    '''
+    return iter(dsMapLineIdByRecordId)
+
 def dsGetPreviousRecord(dsDatabase, dsRecordId):
     '''
     Returns the previous parsed record for recordid
@@ -73,10 +202,10 @@ def dsGetRecordType(dsDatabase, dsRecordId):
     '''
     Returns the object type of the record
     '''
-    typeid = -1
     try:
-        typeid = int(dsMapTypeByRecordId[int(dsRecordId)])
-        return typeid
+        if int(dsRecordId) < 0:
+            return -1
+        return dsMapTypeByRecordId.Values[int(dsRecordId)]
     except:
         return -1
 
@@ -102,3 +231,135 @@ def dsGetTypeIdByTypeName(dsDatabase, dsTypeName):
         return TypeId
     except:
         return -1
+
+dsMapClassByTypeId = {} #Map that can be used to find (governsID, subClassOf, default category, schemaIDGUID) of a class
+dsMapSubClassesByGovernsId = {} #Map that can be used to find the direct subclasses of a class
+dsMapTypeIdByGovernsId = {} #Map that can be used to find the class having a governsID
+dsMapClassGUIDsByTypeId = {} #Map that can be used to find the schemaIDGUIDs of the classes of an object type
+dsSchemaDatabase = None #The database the schema class maps were read from
+
+def dsInitSchemaClasses(dsDatabase):
+    '''
+    Reads the governsID, subClassOf, defaultObjectCategory and schemaIDGUID
+    of every class of the schema once per database
+    '''
+    global dsSchemaDatabase
+    if dsSchemaDatabase is dsDatabase:
+        return
+    dsMapClassByTypeId.clear()
+    dsMapSubClassesByGovernsId.clear()
+    dsMapTypeIdByGovernsId.clear()
+    dsMapClassGUIDsByTypeId.clear()
+    for (name, typeid) in dsMapTypeIdByTypeName.items():
+        record = dsGetRecordByRecordId(dsDatabase, typeid)
+        if record == None:
+            continue
+        try:
+            governsid = int(record[ntds.dsfielddictionary.dsGovernsIdIndex])
+            subclassof = int(record[ntds.dsfielddictionary.dsSubClassOfIndex])
+        except (ValueError, IndexError):
+            # Attribute schema objects have no governsID
+            continue
+        try:
+            category = int(record[ntds.dsfielddictionary.dsDefaultObjectCategoryIndex])
+        except (ValueError, IndexError):
+            category = int(typeid)
+        try:
+            guid = str(GUID(record[ntds.dsfielddictionary.dsSchemaIdGuidIndex]))
+        except Exception:
+            guid = ""
+        dsMapClassByTypeId[int(typeid)] = (governsid, subclassof, category, guid)
+        dsMapTypeIdByGovernsId[governsid] = int(typeid)
+        if subclassof != governsid:
+            try:
+                dsMapSubClassesByGovernsId[subclassof].append(int(typeid))
+            except KeyError:
+                dsMapSubClassesByGovernsId[subclassof] = [int(typeid)]
+    dsSchemaDatabase = dsDatabase
+
+def dsGetSubClassIds(dsDatabase, dsTypeId):
+    '''
+    Returns the type ids of a class and of all the classes derived from it
+    '''
+    dsInitSchemaClasses(dsDatabase)
+    typeids = [dsTypeId]
+    seen = set(typeids)
+    i = 0
+    while i < len(typeids):
+        cls = dsMapClassByTypeId.get(typeids[i])
+        i += 1
+        if cls == None:
+            continue
+        for subclass in dsMapSubClassesByGovernsId.get(cls[0], ()):
+            if not subclass in seen:
+                seen.add(subclass)
+                typeids.append(subclass)
+    return typeids
+
+def dsGetCategoryIds(dsDatabase, dsTypeName, subclasses=True):
+    '''
+    Returns the object types (objectCategory) holding the instances of the
+    class identified by the name, and of its subclasses unless subclasses is
+    False. Objects are indexed by category, so instances of a class having
+    a shared category (User objects are of category Person) are enumerated
+    with the other instances of that category.
+    '''
+    typeid = dsGetTypeIdByTypeName(dsDatabase, dsTypeName)
+    if typeid == -1:
+        return []
+    if not subclasses:
+        return [typeid]
+    categories = set([typeid])
+    for classid in dsGetSubClassIds(dsDatabase, typeid):
+        cls = dsMapClassByTypeId.get(classid)
+        if cls != None:
+            categories.add(cls[2])
+    return sorted(categories)
+
+def dsGetClassGUIDs(dsDatabase, dsTypeId):
+    '''
+    Returns the schemaIDGUIDs (strings) of the classes whose instances are
+    of the object type (objectCategory) dsTypeId, and of all the classes
+    they derive from (a computer is also a user)
+    '''
+    dsInitSchemaClasses(dsDatabase)
+    try:
+        return dsMapClassGUIDsByTypeId[dsTypeId]
+    except KeyError:
+        pass
+    guids = set()
+    seen = set()
+    for (classid, cls) in dsMapClassByTypeId.items():
+        if cls[2] != dsTypeId:
+            continue
+        # Walk up the subClassOf chain, top is its own superclass
+        while cls != None and not classid in seen:
+            seen.add(classid)
+            if cls[3] != "":
+                guids.add(cls[3])
+            classid = dsMapTypeIdByGovernsId.get(cls[1])
+            cls = dsMapClassByTypeId.get(classid)
+    guids = frozenset(guids)
+    dsMapClassGUIDsByTypeId[dsTypeId] = guids
+    return guids
+
+def dsIterObjects(dsDatabase, dsTypeName, subclasses=True):
+    '''
+    Yields the record ids of the objects of a type, and of its subclasses
+    unless subclasses is False, from the type index instead of a scan of
+    every record. Record ids come sorted by their offset in the table, so
+    that the records are then read sequentially.
+    '''
+    recordids = set()
+    for typeid in dsGetCategoryIds(dsDatabase, dsTypeName, subclasses):
+        recordids.update(dsMapRecordIdByTypeId.get(typeid, ()))
+    offsets = dsDatabase.Offsets
+    lineids = dsMapLineIdByRecordId
+    located = []
+    for recordid in recordids:
+        lineid = lineids.get(recordid, -1)
+        if lineid != -1:
+            located.append((offsets[lineid], recordid))
+    located.sort()
+    for (offset, recordid) in located:
+        yield recordid
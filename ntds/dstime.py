@@ -61,15 +61,10 @@ def dsGetDSTimeStampStr(dsTimeStamp):
         return str(_FILETIME_null_date + datetime.timedelta(microseconds=int(dsTimeStamp) / 10))
     
 def dsGetPOSIXTimeStamp(dsTimeStamp):
-    ts = 0
     if  dsVerifyDSTimeStamp(dsTimeStamp) == -1:
         return 0
-    else:
-        try:
-            ts = int(calendar.timegm(time.strptime(dsGetDSTimeStampStr(dsTimeStamp), '%Y-%m-%d %H:%M:%S')))
-        except ValueError:
-            ts = int(calendar.timegm(time.strptime(dsGetDSTimeStampStr(dsTimeStamp), '%Y-%m-%d %H:%M:%S.%f')))
-    return ts
+    # FILETIME counts 100ns intervals since 1601-01-01
+    return (int(dsTimeStamp) - 116444736000000000) // 10000000
 
 def dsGetDBLogTimeStampStr(dsDBLogTimeStamp):
     if len(dsDBLogTimeStamp) < 8:
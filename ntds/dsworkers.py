@@ -0,0 +1,86 @@
+'''
+Parallel materialization of objects.
+
+The record ids of a type are split into chunks, and a pool of processes
+reads their records, instantiates the objects and serializes them (report
+text, JSON...). The chunks come back in the order they were handed out, so
+the output is the same as a sequential run whatever the number of workers.
+
+Workers are forked: they inherit the loaded maps, the open tables and the
+per-run caches (memberships, schema, security descriptors) instead of
+rebuilding them. Tables are only read through their read-only memory maps,
+and the maps of the datatable and of the links are pointed into their index
+files, mapped read-only and shared by all the workers through the page
+cache.
+'''
+import multiprocessing
+from ntds.dsrecord import *
+import ntds.dsdatabase
+import ntds.dslink
+
+dsObjectChunkSize = 256 #Number of objects materialized per task of the pool
+
+dsWorkerDatabase = None #The datatable read by the workers
+dsWorkerFunction = None #The function materializing one object in the workers
+
+def dsCanFork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+def dsInitObjectWorker(workdir):
+    # When the maps were built by this run, use the saved indexes rather
+    # than the copy-on-write pages of the parent
+    if ntds.dsdatabase.dsIndex == None:
+        dsWorkerDatabase.setOffsets(dsLoadIndex(workdir))
+    if ntds.dslink.dsLinkIndex == None:
+        ntds.dslink.dsLinkIndex = IndexFile(path.join(workdir, ntds.dslink.dsLinkIndexFileName))
+        ntds.dslink.dsMapLinks.load(ntds.dslink.dsLinkIndex, "links")
+        ntds.dslink.dsMapBackwardLinks.load(ntds.dslink.dsLinkIndex, "backlinks")
+
+def dsMaterializeChunk(recordids):
+    '''
+    Returns the non-None results of the worker function for a chunk of
+    record ids
+    '''
+    results = []
+    for (recordid, record) in zip(recordids, dsGetRecordsByRecordIds(dsWorkerDatabase, recordids)):
+        result = dsWorkerFunction(dsWorkerDatabase, recordid, record)
+        if result != None:
+            results.append(result)
+    return results
+
+def dsGetRecordIdChunks(dsRecordIds):
+    return [dsRecordIds[i:i + dsObjectChunkSize] for i in range(0, len(dsRecordIds), dsObjectChunkSize)]
+
+def dsMapObjects(dsDatabase, dsRecordIds, function, workdir, workers=None):
+    '''
+    Yields function(dsDatabase, recordid, record) for dsRecordIds, in their
+    order, skipping None results. function must only read the database and
+    the maps and return something that can be pickled (strings). Runs in
+    workers processes (default: number of CPUs), sequentially when there
+    is a single worker, a single chunk or no fork on this platform.
+    '''
+    global dsWorkerDatabase
+    global dsWorkerFunction
+
+    recordids = list(dsRecordIds)
+    if workers == None:
+        workers = multiprocessing.cpu_count()
+    chunks = dsGetRecordIdChunks(recordids)
+    if workers <= 1 or len(chunks) < 2 or not dsCanFork():
+        for (recordid, record) in zip(recordids, dsGetRecordsByRecordIds(dsDatabase, recordids)):
+            result = function(dsDatabase, recordid, record)
+            if result != None:
+                yield result
+        return
+    dsWorkerDatabase = dsDatabase
+    dsWorkerFunction = function
+    try:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(min(workers, len(chunks)), dsInitObjectWorker, (workdir,)) as pool:
+            # imap keeps the order of the chunks and only holds a few of them
+            for results in pool.imap(dsMaterializeChunk, chunks):
+                for result in results:
+                    yield result
+    finally:
+        dsWorkerDatabase = None
+        dsWorkerFunction = None
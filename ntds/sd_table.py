@@ -1,19 +1,16 @@
-import sys
-from stat import *
-from os import stat
-from os import path
-import time
-import ntds.dsfielddictionary
-from ntds.dsencryption import *
-from lib.map import *
-from lib.sid import *
-from lib.guid import *
-import pickle
+'''
+Security descriptor engine for the sd_table.
+
+The sd_table holds every distinct security descriptor of the domain once,
+keyed by sd_id, and objects refer to it. The table is scanned once for the
+position of each sd_id; a descriptor is then decoded the first time it is
+requested (owner, group, DACL and SACL) and kept by sd_id, so a descriptor
+shared by thousands of objects is parsed exactly once.
+'''
+import uuid
+from struct import Struct
 from rich.console import Console
-
-import struct
-
-
+from ntds.dsdatabase import dsOpenTable, dsProjection
 
 class SE:
     SE_OWNER_DEFAULTED               = 0x0001
@@ -32,17 +29,17 @@ class SE:
 
 
 
-class Flags(object):
-    class __metaclass__(type):
-        def __getattr__(self, attr):
-            if attr in self._flags_:
-                return self._flags_[attr]
-            raise AttributeError(attr)
-        def __getitem__(self, attr):
+class FlagsType(type):
+    def __getattr__(self, attr):
+        if attr in self._flags_:
             return self._flags_[attr]
-        def __iter__(self):
-            return self._flags_.iteritems()
+        raise AttributeError(attr)
+    def __getitem__(self, attr):
+        return self._flags_[attr]
+    def __iter__(self):
+        return iter(self._flags_.items())
 
+class Flags(object, metaclass=FlagsType):
     _flags_ = {}
     def __init__(self, flags):
         self.flags = flags
@@ -57,44 +54,18 @@ class Flags(object):
 
     def to_json(self):
         j = {}
-        for k,v in self._flags_.iteritems():
+        for k,v in self._flags_.items():
             j[k] = self.test_flag(v)
         return {"value":self.flags,"flags":j}
 
 
 
 
-class SecurityDescriptor(object):
-    def __init__(self, sd):
-        self.raw_sd = sd
-        _rev,_sbz,ctrl,owner,group,sacl,dacl = struct.unpack_from("<BBHIIII", sd)
-        self.ctrl = ctrl
-        self.owner = owner
-        self.group = group
-
-        if self.ctrl & SE.SE_SELF_RELATIVE:
-
-            if self.ctrl & SE.SE_SACL_PRESENT:
-                self.sacl = sd[sacl:dacl]
-            if self.ctrl & SE.SE_DACL_PRESENT:
-                self.dacl = sd[dacl:]
-
-
-class ACL(object):
-    def __init__(self, acl):
-        _rev,_sbz,_sz,_count,_sbz2 = struct.unpack_from("<BBHHH", acl)
-
-
-class ACE(object):
-    def __init__(self, ace):
-        _type,_flags,_size = struct.unpack_from("<BBH", ace)
-
-
 class Enums(object):
     _enum_ = {}
     def __init__(self, val):
         renum = {}
-        for k,v in self._enum_.iteritems():
+        for k,v in self._enum_.items():
             renum[v] = k
         self.renum = renum
         self.val = val
@@ -197,117 +168,185 @@ class AccessMask(Flags):
 
 
 
-def decode_sid(s, endianness="<"):
-    rev,subauthnb = struct.unpack_from("<BB",s)
-    rev &= 0x0f
-    iah,ial = struct.unpack_from(">IH", s[2:])
+# Layouts of the self-relative security descriptor structures
+SDHeader     = Struct("<BBHIIII")   # revision, sbz, control, owner, group, sacl, dacl
+ACLHeader    = Struct("<BBHHH")     # revision, sbz, size, ace count, sbz
+ACEHeader    = Struct("<BBHI")      # type, flags, size, access mask
+ACEObjectHdr = Struct("<I")         # object flags
+SIDHeader    = Struct(">BBIH")      # revision, sub authority count, identifier authority
+
+# ACE types followed by object flags and GUIDs, and the ones holding a SID
+ObjectACETypes = frozenset([5, 6, 7, 8, 11, 12, 15, 16])
+SIDACETypes    = frozenset([0, 1, 2, 3, 5, 6, 7, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18, 19])
+
+
+def decode_sid(s, offset=0):
+    '''
+    Returns the string form of the SID starting at offset
+    '''
+    rev,subauthnb,iah,ial = SIDHeader.unpack_from(s, offset)
     ia = (iah<<16)|ial
-    if subauthnb > 0:
-        subauth = struct.unpack_from("<%iI" % (subauthnb-1), s[8:-4])
-        subauth += struct.unpack_from("%sI"%endianness, s[-4:])
-    else:
-        subauth = ()
-    sid = "S-%i-%s" % (rev, "-".join(["%i"%x for x in ((ia,)+subauth)]))
-    return sid
+    subauth = Struct("<%dI" % subauthnb).unpack_from(s, offset + 8)
+    return "S-%i-%s" % (rev & 0x0f, "-".join(["%i"%x for x in ((ia,)+subauth)]))
+
+def decode_guid(s, offset=0):
+    return str(uuid.UUID(bytes_le=bytes(s[offset:offset+16])))
+
 
+class ACE(object):
+    '''
+    An access control entry. ObjectType and InheritedObjectType are GUID
+    strings, or None when not present.
+    '''
+    __slots__ = ('Type', 'Flags', 'Mask', 'ObjectFlags', 'ObjectType', 'InheritedObjectType', 'SID')
+
+    def __init__(self, view, offset):
+        (self.Type, self.Flags, size, self.Mask) = ACEHeader.unpack_from(view, offset)
+        self.ObjectFlags = 0
+        self.ObjectType = None
+        self.InheritedObjectType = None
+        self.SID = None
+        pos = offset + ACEHeader.size
+        if self.Type in ObjectACETypes:
+            (self.ObjectFlags,) = ACEObjectHdr.unpack_from(view, pos)
+            pos += ACEObjectHdr.size
+            if self.ObjectFlags & ACEObjectFlags.ObjectTypePresent:
+                self.ObjectType = decode_guid(view, pos)
+                pos += 16
+            if self.ObjectFlags & ACEObjectFlags.InheritedObjectTypePresent:
+                self.InheritedObjectType = decode_guid(view, pos)
+                pos += 16
+        if self.Type in SIDACETypes:
+            self.SID = decode_sid(view, pos)
 
+    def to_json(self):
+        ace = {}
+        ace["Type"] = ACEType(self.Type).to_json()
+        ace["Flags"] = ACEFlags(self.Flags).to_json()
+        ace["AccessMask"] = AccessMask(self.Mask).to_json()
+        if self.Type in ObjectACETypes:
+            ace["ObjectFlags"] = ACEObjectFlags(self.ObjectFlags).to_json()
+            if self.ObjectType != None:
+                ace["ObjectType"] = self.ObjectType
+            if self.InheritedObjectType != None:
+                ace["InheritedObjectType"] = self.InheritedObjectType
+        if self.SID != None:
+            ace["SID"] = self.SID
+        return ace
+
+
+def parse_acl(view, offset):
+    '''
+    Returns the ACEs of the ACL starting at offset, as a tuple
+    '''
+    _rev,_sbz,size,count,_sbz2 = ACLHeader.unpack_from(view, offset)
+    aces = []
+    pos = offset + ACLHeader.size
+    for i in range(count):
+        (_type, _flags, acesize) = ACEHeader.unpack_from(view, pos)[:3]
+        if acesize < ACEHeader.size:
+            raise ValueError("Invalid ACE size %d" % acesize)
+        aces.append(ACE(view, pos))
+        pos += acesize
+    return tuple(aces)
 
 
+class SecurityDescriptor(object):
+    '''
+    A decoded self-relative security descriptor. DACL and SACL are tuples
+    of ACE, or None when the descriptor has none.
+    '''
+    __slots__ = ('Control', 'Owner', 'Group', 'DACL', 'SACL')
 
+    def __init__(self, sd):
+        view = memoryview(sd)
+        if len(view) < SDHeader.size:
+            raise ValueError("Security descriptor too short (%d bytes)" % len(view))
+        rev,_sbz,ctrl,owner,group,sacl,dacl = SDHeader.unpack_from(view, 0)
+        if rev != 1 or not ctrl & SE.SE_SELF_RELATIVE:
+            raise ValueError("Invalid security descriptor header (revision %d, control 0x%04x)" % (rev, ctrl))
+        self.Control = ctrl
+        self.Owner = decode_sid(view, owner) if owner else None
+        self.Group = decode_sid(view, group) if group else None
+        self.SACL = parse_acl(view, sacl) if ctrl & SE.SE_SACL_PRESENT and sacl else None
+        self.DACL = parse_acl(view, dacl) if ctrl & SE.SE_DACL_PRESENT and dacl else None
 
+    def to_json(self):
+        sd = {}
+        sd["Control"] = ControlFlags(self.Control).to_json()
+        sd["Owner"] = self.Owner
+        sd["Group"] = self.Group
+        for (name, acl) in (("DACL", self.DACL), ("SACL", self.SACL)):
+            if acl != None:
+                sd[name] = {"Count" : len(acl), "ACEList" : [ace.to_json() for ace in acl]}
+        return sd
 
-def acl_to_json(acl):
-    rev,_sbz,size,count,_sbz2 = struct.unpack_from("<BBHHH", acl)
-    ACL = {}
-    ACL["Revision"] = rev
-    ACL["Size"] = size
-    ACL["Count"] = count
-    ACL["ACEList"] = ACEList = []
-    acestr = acl[8:]
-    while count > 0:
-        typeraw,flags,size = struct.unpack_from("<BBH", acestr)
-        type_ = ACEType(typeraw)
-        ACE = {}
-        ACE["Type"] = type_.to_json()
-        ACE["Flags"] = ACEFlags(flags).to_json()
-        ACE["Size"] = size
-        amask, = struct.unpack_from("<I", acestr[4:])
-        ACE["AccessMask"] = AccessMask(amask).to_json()
-        sstr = acestr[8:size]
-        if typeraw in [5, 6, 7, 8]:
-            objflagsraw, = struct.unpack_from("<I", sstr)
-            sstr = sstr[4:]
-            objflags = ACEObjectFlags(objflagsraw)
-            ACE["ObjectFlags"] = objflags.to_json()
-            if objflags.ObjectTypePresent:
-                ACE["ObjectType"] = bta.tools.decoding.decode_guid(sstr[:16])
-                sstr = sstr[16:]
-            if objflags.InheritedObjectTypePresent:
-                ACE["InheritedObjectType"] = bta.tools.decoding.decode_guid(sstr[:16])
-                sstr = sstr[16:]
-
-        if typeraw in [0, 1, 2, 3, 5, 6, 7, 8]:
-            ACE["SID"] = bta.tools.decoding.decode_sid(sstr)
-
-        if type == 0: # ACCESS_ALLOWED
-            pass
-        elif type == 1: # ACCESS_DENIED
-            pass
-        elif type == 2: # SYSTEM_AUDIT
-            pass
-        elif type == 3: # SYSTEM_ALARM
-            pass
-        elif type == 4: # ACCESS_ALLOWED_COMPOUND
-            pass
-        elif type == 5: # ACCESS_ALLOWED_OBJECT
-            pass
-        elif type == 6: # ACCESS_DENIED_OBJECT
-            pass
-        elif type == 7: # SYSTEM_AUDIT_OBJECT
-            pass
-        elif type == 8: # SYSTEM_ALARM_OBJECT
-            pass
-
-        ACEList.append(ACE)
-        acestr = acestr[size:]
-        count -= 1
-    return ACL
 
+def acl_to_json(acl):
+    '''
+    Returns the JSON form of a raw ACL
+    '''
+    view = memoryview(acl)
+    rev,_sbz,size,count,_sbz2 = ACLHeader.unpack_from(view, 0)
+    return {"Revision" : rev, "Size" : size, "Count" : count,
+            "ACEList" : [ace.to_json() for ace in parse_acl(view, 0)]}
 
 
+dsMapPositionBySdId = {} #Map that can be used to find the position of a descriptor in the sd_table
+dsMapSDBySdId       = {} #Map that can be used to find the decoded descriptor of a sd_id
+dsSdTable = None #The open sd_table
+dsSdValueIndex = -1 #sd_value
 
 def dsInitSdTable(dsESEFile, workdir):
-    global dsDatabaseSize
-    dsDatabaseSize = stat(dsESEFile).st_size
-    db = open(dsESEFile , 'rb', 0)
-    db.seek(0)
-    #line = str([x.decode('utf8').strip() for x in db.readlines()])
-    lines = db.readlines()
-    if lines == "":
-        print("[!] Warning! Error processing the first line!\n")
-        sys.exit()
-    else:
-        i=0
-        for line in lines:
-            record = line.decode('utf-8').replace('\n','').split('\t')
-            if i>0:
-                sd = SecurityDescriptor(record[3].encode('utf-8'))
-
-                print( str(sd.ctrl).encode("utf-8").hex() )
-                print(sd.ctrl)
-                try:
-                    """
-                    acestr = sacl[8:]
-                    typeraw,flags,size = struct.unpack_from("<BBH", acestr)
-                    type_ = ACEType(typeraw)
-                    ACE = {}
-                    ACE["Type"] = type_.to_json()
-                    ACE["Flags"] = ACEFlags(flags).to_json()
-                    ACE["Size"] = size
-                    amask, = struct.unpack_from("<I", acestr[4:])
-                    ACE["AccessMask"] = AccessMask(amask).to_json()
-                    """
-                except Exception as e:
-                    pass
-            i+=1
-        
\ No newline at end of file
+    '''
+    Opens the sd_table (the path of an esedbexport TSV file or a table opened
+    by lib.esedb) and records the position of every sd_id. Descriptors are
+    decoded on request by dsGetSecurityDescriptor.
+    '''
+    global dsSdTable
+    global dsSdValueIndex
+    table = dsOpenTable(dsESEFile)
+    names = table.getFieldNames()
+    try:
+        idindex = names.index("sd_id")
+        dsSdValueIndex = names.index("sd_value")
+    except ValueError:
+        raise ValueError("The sd_table has no sd_id or sd_value column")
+    dsMapPositionBySdId.clear()
+    dsMapSDBySdId.clear()
+    # Only the ids are read by the scan, the values when first requested
+    table.setProjection(dsProjection([idindex]))
+    console = Console()
+    i = 0
+    with console.status("[bold green][+] Scanning sd_table...") as status:
+        for (position, record) in table.records():
+            try:
+                dsMapPositionBySdId[int(record[idindex])] = position
+            except ValueError:
+                continue
+            i += 1
+            if i % 1024 == 0:
+                status.update("[bold green][+] Scanning sd_table - %d%% -> %d records processed" % (table.getProgress(), i))
+    print("[+] Scanning sd_table - %d records processed" % i)
+    dsSdTable = table
+    return table
+
+def dsGetSecurityDescriptor(dsSdId):
+    '''
+    Returns the decoded SecurityDescriptor of a sd_id, or None if the sd_id
+    is unknown or its descriptor cannot be decoded
+    '''
+    try:
+        return dsMapSDBySdId[dsSdId]
+    except KeyError:
+        pass
+    sd = None
+    position = dsMapPositionBySdId.get(dsSdId)
+    if position != None:
+        record = dsSdTable.getRecordAt(position)
+        try:
+            sd = SecurityDescriptor(bytes.fromhex(record[dsSdValueIndex]))
+        except Exception:
+            print("[!] Warning! Unable to decode the security descriptor %d" % dsSdId)
+    dsMapSDBySdId[dsSdId] = sd
+    return sd
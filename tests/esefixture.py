@@ -0,0 +1,88 @@
+'''
+Builders of small ESE pages and databases for the tests
+'''
+import struct
+
+def tags(entries, large=False):
+    '''
+    Returns the data and the tag array of a page. entries is a list of
+    (flags, data), tag 0 first.
+    '''
+    data = b""
+    array = b""
+    for (flags, value) in entries:
+        if large:
+            # The flags are the upper bits of the first key size
+            if flags:
+                value = bytearray(value)
+                value[1] |= flags << 5
+                value = bytes(value)
+            array = struct.pack("<HH", len(value), len(data)) + array
+        else:
+            array = struct.pack("<HH", len(value), len(data) | (flags << 13)) + array
+        data += value
+    return data, array
+
+def page(entries, flags, pagesize=8192, nextpage=0, previous=0):
+    large = pagesize > 8192
+    headersize = 80 if large else 40
+    (data, array) = tags(entries, large)
+    header = struct.pack("<8x8xIIIHHHHI", previous, nextpage, 0, 0, 0, 0, len(entries), flags)
+    header += bytes(headersize - len(header))
+    return header + data + bytes(pagesize - headersize - len(data) - len(array)) + array
+
+def entry(key, data, common=None):
+    if common is None:
+        return struct.pack("<H", len(key)) + key + data
+    return struct.pack("<HH", common, len(key)) + key + data
+
+def record(lastfixed, fixed, nullbits=b"", variable=(), tagged=(), large=False):
+    '''
+    Returns the data of a record. variable is a list of values (None when
+    null), tagged a list of (identifier, flags, value).
+    '''
+    nullbits = bytes(nullbits).ljust((lastfixed + 7) // 8, b"\x00")
+    varoffset = 4 + len(fixed) + len(nullbits)
+    offsets = b""
+    values = b""
+    for value in variable:
+        if value is None:
+            offsets += struct.pack("<H", len(values) | 0x8000)
+        else:
+            values += value
+            offsets += struct.pack("<H", len(values))
+    data = struct.pack("<BBH", lastfixed, 127 + len(variable), varoffset) + fixed + nullbits + offsets + values
+    array = b""
+    items = b""
+    for (identifier, flags, value) in tagged:
+        array += struct.pack("<HH", identifier, (4 * len(tagged) + len(items)) | (0 if large else 0x4000))
+        items += bytes([flags]) + value
+    return data + array + items
+
+def column(objid, identifier, coltype, size, name, codepage=0, recordoffset=None):
+    '''
+    Returns the catalog record of a column (of a table when coltype is
+    the root page number and identifier the object id)
+    '''
+    fixed = struct.pack("<IHIIIIIBH", objid, 2, identifier, coltype, size, 0, codepage, 0, recordoffset or 0)
+    return record(9, fixed, b"\x00\x01" if recordoffset is None else b"", [name.encode("ascii")])
+
+def table(objid, root, name):
+    fixed = struct.pack("<IHIIIIIBH", objid, 1, objid, root, 0, 0, 0, 0, 0)
+    return record(9, fixed, b"\x00\x01", [name.encode("ascii")])
+
+def longvalue(objid, root):
+    fixed = struct.pack("<IHIIIIIBH", objid, 4, objid, root, 0, 0, 0, 0, 0)
+    return record(9, fixed, b"\x00\x01", [b"LV"])
+
+def database(pages, pagesize=8192):
+    '''
+    Returns an ESE database file made of pages ({page number: page})
+    '''
+    revision = 0x14 if pagesize > 8192 else 0x0c
+    data = bytearray(pagesize * (max(pages) + 2))
+    struct.pack_into("<II", data, 4, 0x89abcdef, 0x620)
+    struct.pack_into("<II", data, 232, revision, pagesize)
+    for (number, content) in pages.items():
+        data[(number + 1) * pagesize:(number + 2) * pagesize] = content
+    return bytes(data)
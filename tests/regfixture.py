@@ -0,0 +1,66 @@
+'''
+Builder of small registry hives for the tests
+'''
+import struct
+
+class Hive(object):
+    '''
+    Cells are appended to a single hive bin. Keys are built children
+    first, every builder returning the offset of its cell.
+    '''
+    def __init__(self):
+        self.data = bytearray(b"hbin" + bytes(28))
+
+    def cell(self, data):
+        offset = len(self.data)
+        size = (4 + len(data) + 7) // 8 * 8
+        self.data += struct.pack("<i", -size) + data + bytes(size - 4 - len(data))
+        return offset
+
+    def value(self, name, valuetype, data):
+        if len(data) <= 4:
+            (dataoffset,) = struct.unpack("<I", data.ljust(4, b"\x00"))
+            size = len(data) | 0x80000000
+        else:
+            dataoffset = self.cell(data)
+            size = len(data)
+        name = name.encode("ascii")
+        return self.cell(struct.pack("<2sHIIIH2x", b"vk", len(name), size, dataoffset, valuetype, 1) + name)
+
+    def key(self, name, subkeys=(), values=(), classname=None):
+        subkeylist = 0
+        if subkeys:
+            subkeylist = self.cell(b"lf" + struct.pack("<H", len(subkeys)) +
+                                   b"".join(struct.pack("<I4s", offset, b"\x00" * 4) for offset in subkeys))
+        valuelist = 0
+        if values:
+            valuelist = self.cell(b"".join(struct.pack("<I", offset) for offset in values))
+        classoffset = 0
+        classlength = 0
+        if classname != None:
+            classname = classname.encode("utf-16-le")
+            classoffset = self.cell(classname)
+            classlength = len(classname)
+        name = name.encode("ascii")
+        return self.cell(struct.pack("<2sH8x4x4xI4xI4xII4xI16x4xHH", b"nk", 0x20, len(subkeys), subkeylist,
+                                     len(values), valuelist, classoffset, len(name), classlength) + name)
+
+    def save(self, filename, root):
+        base = struct.pack("<4s32xI", b"regf", root)
+        with open(filename, "wb") as f:
+            f.write(base + bytes(4096 - len(base)) + self.data)
+
+def system(filename, scrambled, current=1):
+    '''
+    Writes a SYSTEM hive holding the scrambled boot key (16 bytes) in the
+    Lsa key of the control set current
+    '''
+    hive = Hive()
+    parts = []
+    for (i, name) in enumerate(("JD", "Skew1", "GBG", "Data")):
+        parts.append(hive.key(name, classname=scrambled[4 * i:4 * i + 4].hex()))
+    lsa = hive.key("Lsa", parts)
+    control = hive.key("Control", [hive.key("Session Manager"), lsa])
+    controlset = hive.key("ControlSet%03d" % current, [control])
+    select = hive.key("Select", values=[hive.value("Current", 4, struct.pack("<I", current))])
+    hive.save(filename, hive.key("ROOT", [controlset, select]))
@@ -0,0 +1,41 @@
+'''
+Builders of self-relative security descriptors for the tests
+'''
+import struct
+import uuid
+
+DOMAIN = "S-1-5-21-1111-2222-3333"
+
+def sid(s):
+    parts = s.split("-")
+    subauths = [int(x) for x in parts[3:]]
+    return (struct.pack("<BB", int(parts[1]), len(subauths)) + int(parts[2]).to_bytes(6, "big") +
+            b"".join(struct.pack("<I", x) for x in subauths))
+
+def ace(acetype, flags, mask, principal, objecttype=None, inheritedobjecttype=None):
+    body = struct.pack("<I", mask)
+    if acetype in (5, 6, 7, 8):
+        objectflags = (1 if objecttype else 0) | (2 if inheritedobjecttype else 0)
+        body += struct.pack("<I", objectflags)
+        if objecttype:
+            body += uuid.UUID(objecttype).bytes_le
+        if inheritedobjecttype:
+            body += uuid.UUID(inheritedobjecttype).bytes_le
+    body += sid(principal)
+    return struct.pack("<BBH", acetype, flags, 4 + len(body)) + body
+
+def acl(aces):
+    data = b"".join(aces)
+    return struct.pack("<BBHHH", 4, 0, 8 + len(data), len(aces), 0) + data
+
+def descriptor(owner, group, dacl, sacl=None, control=0):
+    owner = sid(owner)
+    group = sid(group)
+    dacl = acl(dacl)
+    sacl = acl(sacl) if sacl != None else b""
+    control |= 0x8004 | (0x10 if sacl else 0)
+    saclofs = 20 if sacl else 0
+    daclofs = 20 + len(sacl)
+    ownerofs = daclofs + len(dacl)
+    groupofs = ownerofs + len(owner)
+    return struct.pack("<BBHIIII", 1, 0, control, ownerofs, groupofs, saclofs, daclofs) + sacl + dacl + owner + group
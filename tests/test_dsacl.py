@@ -0,0 +1,78 @@
+import unittest
+
+from ntds.dsacl import *
+from sdfixture import *
+
+MEMBER = "bf9679c0-0de6-11d0-a285-00aa003049e2"
+USER_FORCE_CHANGE_PASSWORD = "00299570-246d-11d0-a768-00aa006e0529"
+GET_CHANGES_ALL = "1131f6ad-9c07-11d1-f79f-00c04fc2dcd2"
+USER_CLASS = "bf967aba-0de6-11d0-a285-00aa003049e2"
+COMPUTER_CLASS = "bf967a86-0de6-11d0-a285-00aa003049e2"
+GROUP_CLASS = "bf967a9c-0de6-11d0-a285-00aa003049e2"
+
+USER_CLASSES = frozenset([USER_CLASS])
+COMPUTER_CLASSES = frozenset([COMPUTER_CLASS, USER_CLASS])
+GROUP_CLASSES = frozenset([GROUP_CLASS])
+
+HELPDESK = DOMAIN + "-1101"
+
+
+def edges(dacl, classguids, objecttype, owner=DOMAIN + "-512"):
+    return dsGetDescriptorEdges(SecurityDescriptor(descriptor(owner, DOMAIN + "-513", dacl)), classguids, objecttype)
+
+
+class DescriptorEdgesTest(unittest.TestCase):
+    def test_owner(self):
+        self.assertEqual(edges([], USER_CLASSES, "User"), [(DOMAIN + "-512", "Owns", False)])
+        self.assertEqual(edges([], USER_CLASSES, "User", owner="S-1-3-0"), [])
+
+    def test_generic_all(self):
+        self.assertIn((HELPDESK, "GenericAll", False), edges([ace(0, 0, 0x000F01FF, HELPDESK)], USER_CLASSES, "User"))
+        self.assertIn((HELPDESK, "GenericAll", True), edges([ace(0, 0x10, 0x10000000, HELPDESK)], USER_CLASSES, "User"))
+
+    def test_deny_ace(self):
+        self.assertEqual(edges([ace(1, 0, 0x000F01FF, HELPDESK), ace(6, 0, 0x20, HELPDESK, MEMBER)], GROUP_CLASSES, "Group"),
+                         [(DOMAIN + "-512", "Owns", False)])
+
+    def test_inherit_only_ace(self):
+        self.assertEqual(edges([ace(0, 0x0a, 0x000F01FF, HELPDESK)], USER_CLASSES, "User"), [(DOMAIN + "-512", "Owns", False)])
+
+    def test_ignored_principals(self):
+        self.assertEqual(edges([ace(0, 0, 0x000F01FF, "S-1-5-10"), ace(0, 0, 0x40000, "S-1-5-18")], USER_CLASSES, "User"),
+                         [(DOMAIN + "-512", "Owns", False)])
+
+    def test_object_ace(self):
+        dacl = [ace(5, 0, 0x20, HELPDESK, MEMBER), ace(5, 0, 0x08, HELPDESK, MEMBER)]
+        self.assertEqual(edges(dacl, GROUP_CLASSES, "Group"),
+                         [(HELPDESK, "AddMember", False), (HELPDESK, "AddSelf", False), (DOMAIN + "-512", "Owns", False)])
+        # member of a user is not a group membership
+        self.assertEqual(edges(dacl, USER_CLASSES, "User"), [(DOMAIN + "-512", "Owns", False)])
+
+    def test_object_ace_types(self):
+        reset = [ace(5, 0, 0x100, HELPDESK, USER_FORCE_CHANGE_PASSWORD)]
+        self.assertIn((HELPDESK, "ForceChangePassword", False), edges(reset, USER_CLASSES, "User"))
+        self.assertIn((HELPDESK, "ForceChangePassword", False), edges(reset, COMPUTER_CLASSES, "Computer"))
+        self.assertNotIn((HELPDESK, "ForceChangePassword", False), edges(reset, GROUP_CLASSES, "Group"))
+        dcsync = [ace(5, 0, 0x100, HELPDESK, GET_CHANGES_ALL)]
+        self.assertIn((HELPDESK, "GetChangesAll", False), edges(dcsync, frozenset(), "Domain"))
+        self.assertNotIn((HELPDESK, "GetChangesAll", False), edges(dcsync, USER_CLASSES, "User"))
+
+    def test_full_control_on_object_type(self):
+        found = edges([ace(5, 0, 0x000F01FF, HELPDESK, MEMBER)], GROUP_CLASSES, "Group")
+        self.assertNotIn((HELPDESK, "GenericAll", False), found)
+        self.assertIn((HELPDESK, "AddMember", False), found)
+
+    def test_inherited_object_type(self):
+        # Reset password on descendant user objects, computers are users
+        dacl = [ace(5, 0x12, 0x100, HELPDESK, USER_FORCE_CHANGE_PASSWORD, USER_CLASS)]
+        self.assertIn((HELPDESK, "ForceChangePassword", True), edges(dacl, COMPUTER_CLASSES, "Computer"))
+        self.assertEqual(edges(dacl, GROUP_CLASSES, "Group"), [(DOMAIN + "-512", "Owns", False)])
+
+    def test_generic_rights(self):
+        found = edges([ace(0, 0, 0x40000000 | 0x100 | 0x80000, HELPDESK)], USER_CLASSES, "User")
+        for right in ("GenericWrite", "AllExtendedRights", "WriteOwner"):
+            self.assertIn((HELPDESK, right, False), found)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from binascii import hexlify, unhexlify
+
+from Crypto.Cipher import ARC4, DES
+from Crypto.Hash import MD5
+
+import ntds.dsfielddictionary
+from ntds.dsdatabase import dsInitEncryption
+from ntds.dsencryption import *
+from ntds.dshashes import dsDecryptHashChunk
+from regfixture import system
+
+PEK = unhexlify("00112233445566778899aabbccddeeff")
+SALT = unhexlify("0f1e2d3c4b5a69788796a5b4c3d2e1f0")
+RID = 500
+# DES keys of RID 500 (0x1f4), before the parity expansion
+RID_KEY1 = unhexlify("f4010000f40100")
+RID_KEY2 = unhexlify("00f4010000f401")
+LM = "e52cac67419a9a224a3b108f3fa6cb6d"
+NT = "8846f7eaee8fb117ad06bdd830b7586c"
+
+
+def encrypt_hash(pek, salt, *hashes, extra=b""):
+    d1 = DES.new(str_to_key(RID_KEY1), DES.MODE_ECB)
+    d2 = DES.new(str_to_key(RID_KEY2), DES.MODE_ECB)
+    data = b""
+    for hash in hashes:
+        hash = unhexlify(hash)
+        data += d1.encrypt(hash[:8]) + d2.encrypt(hash[8:])
+    rc4 = ARC4.new(MD5.new(pek + salt).digest())
+    return "1100000000000000" + hexlify(salt + rc4.encrypt(data + extra)).decode("ascii")
+
+
+class DESKeyTest(unittest.TestCase):
+    def test_str_to_key(self):
+        # The LM hash of an empty password
+        d = DES.new(str_to_key(bytes(7)), DES.MODE_ECB)
+        self.assertEqual(hexlify(d.encrypt(b"KGS!@#$%")), b"aad3b435b51404ee")
+
+    def test_sid_to_key(self):
+        self.assertEqual(sid_to_key(RID), (str_to_key(RID_KEY1), str_to_key(RID_KEY2)))
+
+
+class HashTest(unittest.TestCase):
+    def test_decrypt_hash(self):
+        self.assertEqual(dsDecryptHash(PEK, RID, encrypt_hash(PEK, SALT, NT)), NT)
+        self.assertEqual(dsDecryptHash(PEK, RID, encrypt_hash(PEK, SALT, LM), dsGetDESCiphers(RID)), LM)
+
+    def test_empty(self):
+        self.assertEqual(dsDecryptHash(PEK, RID, ""), "")
+        self.assertEqual(dsDecryptHash(PEK, RID, "1100000000000000" + SALT.hex()), dsNoPassword)
+
+    def test_decrypt_chunk(self):
+        ntds.dsfielddictionary.dsPEK = PEK
+        self.addCleanup(setattr, ntds.dsfielddictionary, "dsPEK", "")
+        chunk = [("Administrator", RID, encrypt_hash(PEK, SALT, LM), encrypt_hash(PEK, SALT, NT)),
+                 ("krbtgt", RID, "", encrypt_hash(PEK, SALT[::-1], NT))]
+        self.assertEqual(dsDecryptHashChunk(chunk), [("Administrator", RID, LM, NT), ("krbtgt", RID, "", NT)])
+
+
+class HistoryTest(unittest.TestCase):
+    def test_decrypt_history(self):
+        self.assertEqual(dsDecryptHashHistory(PEK, RID, encrypt_hash(PEK, SALT, NT, LM, NT)), [NT, LM, NT])
+
+    def test_partial_entry(self):
+        # A trailing partial entry is ignored
+        self.assertEqual(dsDecryptHashHistory(PEK, RID, encrypt_hash(PEK, SALT, NT, LM, extra=b"\x01" * 7)), [NT, LM])
+        self.assertEqual(dsDecryptHashHistory(PEK, RID, encrypt_hash(PEK, SALT, extra=b"\x01" * 15)), [])
+
+    def test_empty(self):
+        self.assertEqual(dsDecryptHashHistory(PEK, RID, ""), [])
+        self.assertEqual(dsDecryptHashHistory(PEK, RID, "1100000000000000" + SALT.hex()), [])
+
+
+class PEKTest(unittest.TestCase):
+    def setUp(self):
+        (fd, self.filename) = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.filename)
+        self.scrambled = bytes(range(0x10, 0x20))
+        self.bootkey = bytes(0x10 + i for i in dsBootKeyPermutation)
+        system(self.filename, self.scrambled, 2)
+        self.addCleanup(setattr, ntds.dsfielddictionary, "dsEncryptedPEK", "")
+
+    def encrypt_pek(self, version):
+        md5 = MD5.new(self.bootkey)
+        for i in range(1000):
+            md5.update(SALT)
+        data = ARC4.new(md5.digest()).encrypt(bytes(36) + PEK)
+        return "%02x00000001000000" % version + hexlify(SALT + data).decode("ascii")
+
+    def test_get_syskey(self):
+        self.assertEqual(get_syskey(self.filename), self.bootkey)
+
+    def test_not_a_hive(self):
+        with open(self.filename, "wb") as f:
+            f.write(bytes(8192))
+        self.assertRaises(RegistryError, get_syskey, self.filename)
+
+    def test_init_encryption(self):
+        ntds.dsfielddictionary.dsEncryptedPEK = self.encrypt_pek(2)
+        dsInitEncryption(self.filename)
+        self.assertEqual(ntds.dsfielddictionary.dsPEK, PEK)
+
+    def test_unsupported_pek(self):
+        ntds.dsfielddictionary.dsEncryptedPEK = self.encrypt_pek(3)
+        self.assertRaises(Exception, dsInitEncryption, self.filename)
+
+
+if __name__ == "__main__":
+    unittest.main()
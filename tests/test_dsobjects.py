@@ -0,0 +1,120 @@
+import struct
+import unittest
+from binascii import hexlify
+
+from ntds.dsobjects import *
+from lib.hashoutput import format_kerberos
+
+SALT = "CORP.COMalice".encode("utf-16-le")
+
+
+def kerberos_newer_keys(credentials, oldcredentials=(), iterations=4096):
+    '''
+    KERB_STORED_CREDENTIAL_NEW of (key type, key) lists
+    '''
+    keys = list(credentials) + list(oldcredentials)
+    saltoffset = dsKerbCredentialNewHeader.size + dsKerbKeyDataNew.size * (len(keys) + 1)
+    keyoffset = saltoffset + len(SALT)
+    data = dsKerbCredentialNewHeader.pack(4, 0, len(credentials), 0, len(oldcredentials), 0,
+                                          len(SALT), len(SALT), saltoffset, iterations)
+    values = b""
+    for (keytype, key) in keys:
+        data += dsKerbKeyDataNew.pack(0, 0, 0, iterations, keytype, len(key), keyoffset + len(values))
+        values += key
+    return data + bytes(dsKerbKeyDataNew.size) + SALT + values
+
+def kerberos_keys(credentials):
+    '''
+    KERB_STORED_CREDENTIAL of a (key type, key) list
+    '''
+    saltoffset = dsKerbCredentialHeader.size + dsKerbKeyData.size * (len(credentials) + 1)
+    keyoffset = saltoffset + len(SALT)
+    data = dsKerbCredentialHeader.pack(3, 0, len(credentials), 0, len(SALT), len(SALT), saltoffset)
+    values = b""
+    for (keytype, key) in credentials:
+        data += dsKerbKeyData.pack(0, 0, 0, keytype, len(key), keyoffset + len(values))
+        values += key
+    return data + bytes(dsKerbKeyData.size) + SALT + values
+
+def user_properties(properties):
+    '''
+    USER_PROPERTIES of (name, value) pairs, the values hex encoded
+    '''
+    data = b""
+    for (name, value) in properties:
+        name = name.encode("utf-16-le")
+        value = hexlify(value)
+        data += dsUserPropertyHeader.pack(len(name), len(value), 0) + name + value
+    header = dsUserPropertiesHeader.pack(0, dsUserPropertiesHeader.size + len(data) + 1 - 13, 0, 0, 0x50, len(properties))
+    return header + data + b"\x07"
+
+AES256 = (18, b"\xa1" * 32)
+AES128 = (17, b"\xa2" * 16)
+DES_MD5 = (3, b"\xa3" * 8)
+WDIGEST = struct.pack("<BBBB12x", 0, 0, 1, 29) + b"".join(bytes([i]) * 16 for i in range(29))
+
+
+class SupplCredentialsTest(unittest.TestCase):
+    def setUp(self):
+        self.blob = user_properties([
+            ("Primary:Kerberos-Newer-Keys", kerberos_newer_keys([AES256, AES128, DES_MD5], [(18, b"\xb1" * 32)])),
+            ("Primary:Kerberos", kerberos_keys([DES_MD5, (1, b"\xc1" * 8)])),
+            ("Primary:WDigest", WDIGEST),
+            ("Packages", "Kerberos\x00WDigest".encode("utf-16-le")),
+            ("Primary:CLEARTEXT", "Secret1".encode("utf-16-le"))])
+
+    def test_kerberos_newer_keys(self):
+        keys = dsSupplCredentials(self.blob).KerberosNewerKeys
+        self.assertEqual(keys.DefaultSalt, "CORP.COMalice")
+        self.assertEqual([(k.KeyType, k.Key, k.IterationCount) for k in keys.Credentials],
+                         [AES256 + (4096,), AES128 + (4096,), DES_MD5 + (4096,)])
+        self.assertEqual([(k.KeyType, k.Key) for k in keys.OldCredentials], [(18, b"\xb1" * 32)])
+        self.assertEqual(keys.OlderCredentials, [])
+
+    def test_kerberos_keys(self):
+        keys = dsSupplCredentials(self.blob).KerberosKeys
+        self.assertEqual(keys.DefaultSalt, "CORP.COMalice")
+        self.assertEqual([(k.KeyType, k.Key, k.IterationCount) for k in keys.Credentials],
+                         [DES_MD5 + (None,), (1, b"\xc1" * 8, None)])
+
+    def test_other_properties(self):
+        credentials = dsSupplCredentials(self.blob)
+        self.assertEqual(len(credentials.WDigestHashes), 29)
+        self.assertEqual(bytes(credentials.WDigestHashes[28]), b"\x1c" * 16)
+        self.assertEqual(credentials.Packages, ["Kerberos", "WDigest"])
+        self.assertEqual(credentials.Password, "Secret1")
+
+    def test_kerberos_only(self):
+        credentials = dsSupplCredentials(self.blob, kerberosonly=True)
+        self.assertEqual([k.KeyType for k in credentials.getKerberosKeys()], [18, 17, 3])
+        self.assertIsNone(credentials.WDigestHashes)
+        self.assertIsNone(credentials.Packages)
+        self.assertIsNone(credentials.Password)
+
+    def test_kerberos_keys_without_newer_keys(self):
+        blob = user_properties([("Primary:Kerberos", kerberos_keys([DES_MD5]))])
+        self.assertEqual([(k.KeyType, k.Key) for k in dsSupplCredentials(blob).getKerberosKeys()], [DES_MD5])
+
+    def test_invalid_kerberos_keys(self):
+        value = bytearray(kerberos_newer_keys([AES256]))
+        value[0] = 3
+        credentials = dsSupplCredentials(user_properties([("Primary:Kerberos-Newer-Keys", bytes(value))]))
+        self.assertIsNone(credentials.KerberosNewerKeys)
+        self.assertEqual(credentials.getKerberosKeys(), [])
+
+    def test_invalid_wdigest(self):
+        value = bytearray(WDIGEST)
+        value[4] = 1
+        self.assertIsNone(dsSupplCredentials(user_properties([("Primary:WDigest", bytes(value))])).WDigestHashes)
+
+    def test_invalid_length(self):
+        self.assertRaises(AssertionError, dsSupplCredentials, self.blob + b"\x00")
+
+    def test_format_kerberos(self):
+        self.assertEqual(format_kerberos("alice", 18, "a1" * 32), "alice:aes256-cts-hmac-sha1-96:" + "a1" * 32)
+        self.assertEqual(format_kerberos("alice", -140, "00"), "alice:rc4_hmac:00")
+        self.assertEqual(format_kerberos("alice", 99, "00"), "alice:99:00")
+
+
+if __name__ == "__main__":
+    unittest.main()
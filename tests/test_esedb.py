@@ -0,0 +1,166 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from lib.esedb import *
+from lib.esedb import _decompress, _decompress7bit, _decompressXpress
+from esefixture import *
+
+
+def pack7bit(text, unicode=False):
+    value = 0
+    bits = 0
+    out = bytearray()
+    for ch in text.encode("ascii"):
+        value |= ch << bits
+        bits += 7
+        while bits >= 8:
+            out.append(value & 0xff)
+            value >>= 8
+            bits -= 8
+    final = bits if bits else 8
+    if bits:
+        out.append(value)
+    ctype = COMPRESSION_7BIT_UNICODE if unicode else COMPRESSION_7BIT_ASCII
+    return bytes([(ctype << 3) | (final - 1)]) + bytes(out)
+
+
+class DecompressTest(unittest.TestCase):
+    def test_7bit_ascii(self):
+        for text in ("a", "abcdefg", "abcdefgh", "Compressed7bit ASCII"):
+            self.assertEqual(_decompress(pack7bit(text)), text.encode("ascii"))
+
+    def test_7bit_unicode(self):
+        data = pack7bit("Name1", True)
+        self.assertEqual(_decompress7bit(data, True), "Name1".encode("utf-16-le"))
+        self.assertEqual(_decompress(data), "Name1".encode("utf-16-le"))
+
+    def test_xpress_literals(self):
+        data = struct.pack("<I", 0) + b"abc"
+        self.assertEqual(_decompressXpress(data), b"abc")
+
+    def test_xpress_match(self):
+        # abc, then 6 bytes from 3 bytes back
+        data = struct.pack("<I", 0x10000000) + b"abc" + struct.pack("<H", (2 << 3) | 3)
+        self.assertEqual(_decompressXpress(data), b"abcabcabc")
+        self.assertEqual(_decompress(b"\x18\x09\x00" + data), b"abcabcabc")
+
+    def test_xpress_long_matches(self):
+        # 29 and 11 bytes copies: the two extra lengths share one byte
+        data = (struct.pack("<I", 0x50000000) + b"a" + struct.pack("<H", 7) + b"\x1f" + b"\x04" +
+                b"b" + struct.pack("<H", 7))
+        self.assertEqual(_decompressXpress(data), b"a" * 30 + b"b" * 12)
+
+    def test_xpress_invalid_reference(self):
+        data = struct.pack("<I", 0x80000000) + struct.pack("<H", 0)
+        self.assertRaises(ESEError, _decompressXpress, data)
+
+    def test_unsupported(self):
+        self.assertEqual(_decompress(b""), b"")
+        self.assertRaises(ESEError, _decompress, b"\x20\x00")
+
+
+class PageTest(unittest.TestCase):
+    def open(self, pages, pagesize):
+        (fd, self.filename) = tempfile.mkstemp()
+        os.write(fd, database(pages, pagesize))
+        os.close(fd)
+        self.addCleanup(os.remove, self.filename)
+        db = ESEDB(self.filename)
+        self.addCleanup(db.close)
+        return db
+
+    def check(self, pagesize):
+        pages = {4 : page([(0, b""), (0, entry(b"a", table(5, 5, "t")))], PAGE_FLAG_ROOT | PAGE_FLAG_LEAF, pagesize)}
+        pages[5] = page([(0, b"key"),
+                         (0, entry(b"a1", b"one")),
+                         (TAG_FLAG_COMMON, entry(b"2", b"two", 2)),
+                         (TAG_FLAG_DEFUNCT, entry(b"a3", b"three"))],
+                        PAGE_FLAG_LEAF, pagesize, nextpage=6, previous=3)
+        db = self.open(pages, pagesize)
+        self.assertEqual(db.LargePages, pagesize > 8192)
+        p = db.getPage(5)
+        self.assertEqual((p.TagCount, p.NextPageNumber, p.PreviousPageNumber), (4, 6, 3))
+        self.assertTrue(p.isLeaf())
+        self.assertEqual(bytes(p.getTag(0)[1]), b"key")
+        self.assertEqual(p.getTag(3)[0], TAG_FLAG_DEFUNCT)
+        (flags, key, data) = p.getEntry(1)
+        self.assertEqual((flags, key, bytes(data)), (0, b"a1", b"one"))
+        (flags, key, data) = p.getEntry(2)
+        self.assertEqual((flags, key, bytes(data)), (TAG_FLAG_COMMON, b"ke2", b"two"))
+        self.assertEqual(p.getEntry(3)[0], TAG_FLAG_DEFUNCT)
+        self.assertRaises(ESEError, db.getPage, 7)
+
+    def test_small_pages(self):
+        self.check(8192)
+
+    def test_large_pages(self):
+        self.check(32768)
+
+    def test_not_ese(self):
+        (fd, filename) = tempfile.mkstemp()
+        os.write(fd, bytes(8192))
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        self.assertRaises(ESEError, ESEDB, filename)
+
+
+class TableTest(PageTest):
+    def build(self, pagesize=8192, recordoffset=True):
+        large = pagesize > 8192
+        # Fixed column 2 was deleted from the catalog, 3 is a DateTime
+        columns = [column(5, 1, JET_coltypLong, 4, "DNT_col", recordoffset=4 if recordoffset else None),
+                   column(5, 3, JET_coltypDateTime, 8, "time_col", recordoffset=12 if recordoffset else None),
+                   column(5, 4, JET_coltypShort, 2, "short_col", recordoffset=20 if recordoffset else None),
+                   column(5, 128, JET_coltypText, 0, "ATTm3", 1200),
+                   column(5, 256, JET_coltypLongText, 0, "ATTm589825", 1200),
+                   column(5, 257, JET_coltypLong, 0, "ATTj589836"),
+                   column(5, 258, JET_coltypLongBinary, 0, "ATTk36")]
+        pages = {4 : page([(0, b"")] + [(0, entry(b"%02d" % i, c)) for (i, c) in
+                                        enumerate([table(5, 5, "datatable")] + columns + [longvalue(5, 8)])],
+                          PAGE_FLAG_ROOT | PAGE_FLAG_LEAF, pagesize)}
+        fixed = struct.pack("<iid", 3, 99, 2.5) + struct.pack("<h", -2)
+        first = record(4, fixed, b"\x00", ["abc".encode("utf-16-le")],
+                       [(256, TAGGED_FLAG_COMPRESSED, pack7bit("Name1", True)),
+                        (257, TAGGED_FLAG_MULTI_VALUE, struct.pack("<HH", 4, 8) + struct.pack("<ii", 1, 2)),
+                        (258, TAGGED_FLAG_SEPARATED, struct.pack("<I", 1))], large)
+        second = record(4, fixed, b"\x08", [None],
+                        [(258, TAGGED_FLAG_TWO_VALUES, b"\x02abcd")], large)
+        pages[5] = page([(0, b""), (0, entry(b"\x7f", struct.pack("<I", 6))), (0, entry(b"", struct.pack("<I", 7)))],
+                        PAGE_FLAG_ROOT | PAGE_FLAG_PARENT, pagesize)
+        pages[6] = page([(0, b""), (0, entry(b"k1", first))], PAGE_FLAG_LEAF, pagesize, nextpage=7)
+        pages[7] = page([(0, b""), (TAG_FLAG_DEFUNCT, entry(b"k2", first)), (0, entry(b"k3", second))],
+                        PAGE_FLAG_LEAF, pagesize, previous=6)
+        # Long value 1 in two chunks
+        pages[8] = page([(0, b""), (0, entry(struct.pack(">I", 1), struct.pack("<II", 1, 6))),
+                         (0, entry(struct.pack(">II", 1, 0), b"\xde\xad\xbe")),
+                         (0, entry(struct.pack(">II", 1, 3), b"\xef\x00\x01"))],
+                        PAGE_FLAG_ROOT | PAGE_FLAG_LEAF | PAGE_FLAG_LONG_VALUE, pagesize)
+        return self.open(pages, pagesize).getTable("datatable")
+
+    def check(self, pagesize):
+        t = self.build(pagesize)
+        self.assertEqual(t.getFieldNames(), ["DNT_col", "time_col", "short_col", "ATTm3", "ATTm589825", "ATTj589836", "ATTk36"])
+        records = list(t.records())
+        self.assertEqual([position for (position, r) in records], [(6 << 16) | 1, (7 << 16) | 2])
+        self.assertEqual(records[0][1], ["3", "2.5", "-2", "abc", "Name1", "1;2", "deadbeef0001"])
+        self.assertEqual(records[1][1], ["3", "2.5", "", "", "", "", "6162;6364"])
+        self.assertEqual(t.getRecordAt((7 << 16) | 2), records[1][1])
+        t.setOffsets([(7 << 16) | 2, (6 << 16) | 1])
+        self.assertEqual(t.getRecord(1), records[0][1])
+        self.assertEqual([lineid for (lineid, r) in t.getRecords([1, 0])], [1, 0])
+        self.assertIsNone(t.getRecordAt(99 << 16))
+
+    def test_offsets_without_catalog(self):
+        # Without RecordOffset, nothing is decoded after the missing column 2
+        t = self.build(recordoffset=False)
+        self.assertEqual([c.FixedOffset for c in t.Columns[:3]], [4, -1, -1])
+        self.assertEqual(list(t.records())[0][1][:3], ["3", "", ""])
+
+    def test_missing_table(self):
+        self.assertRaises(ESEError, self.build()._db.getTable, "link_table")
+
+
+if __name__ == "__main__":
+    unittest.main()
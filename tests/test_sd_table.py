@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+
+from ntds.sd_table import *
+from sdfixture import *
+
+USER_FORCE_CHANGE_PASSWORD = "00299570-246d-11d0-a768-00aa006e0529"
+USER_CLASS = "bf967aba-0de6-11d0-a285-00aa003049e2"
+
+
+class SecurityDescriptorTest(unittest.TestCase):
+    def setUp(self):
+        self.sd = SecurityDescriptor(descriptor(
+            DOMAIN + "-512", DOMAIN + "-513",
+            [ace(0, 0, 0x000F01FF, DOMAIN + "-512"),
+             ace(5, 0x12, 0x100, "S-1-1-0", USER_FORCE_CHANGE_PASSWORD, USER_CLASS),
+             ace(0, 0x0a, 0x00040000, DOMAIN + "-1101"),
+             ace(1, 0, 0x00080000, DOMAIN + "-1100")],
+            [ace(2, 0xc0, 0x20, "S-1-1-0")],
+            control=SE.SE_DACL_PROTECTED))
+
+    def test_header(self):
+        self.assertEqual(self.sd.Owner, DOMAIN + "-512")
+        self.assertEqual(self.sd.Group, DOMAIN + "-513")
+        self.assertTrue(self.sd.Control & SE.SE_DACL_PROTECTED)
+        self.assertEqual(len(self.sd.DACL), 4)
+        self.assertEqual(len(self.sd.SACL), 1)
+
+    def test_ace(self):
+        ace = self.sd.DACL[0]
+        self.assertEqual((ace.Type, ace.Flags, ace.Mask, ace.SID), (0, 0, 0x000F01FF, DOMAIN + "-512"))
+        self.assertEqual(ace.ObjectType, None)
+        self.assertEqual(ace.InheritedObjectType, None)
+
+    def test_object_ace(self):
+        ace = self.sd.DACL[1]
+        self.assertEqual((ace.Type, ace.Flags, ace.Mask, ace.SID), (5, 0x12, 0x100, "S-1-1-0"))
+        self.assertEqual(ace.ObjectFlags, 3)
+        self.assertEqual(ace.ObjectType, USER_FORCE_CHANGE_PASSWORD)
+        self.assertEqual(ace.InheritedObjectType, USER_CLASS)
+
+    def test_inherit_only_and_deny_aces(self):
+        self.assertEqual(self.sd.DACL[2].Flags & 0x08, 0x08)
+        self.assertEqual(self.sd.DACL[3].Type, 1)
+        self.assertEqual(self.sd.DACL[3].SID, DOMAIN + "-1100")
+
+    def test_to_json(self):
+        j = self.sd.to_json()
+        self.assertTrue(j["Control"]["flags"]["DACLProtected"])
+        self.assertEqual(j["DACL"]["Count"], 4)
+        self.assertEqual(j["DACL"]["ACEList"][1]["Type"], "AccessAllowedObject")
+        self.assertEqual(j["DACL"]["ACEList"][1]["ObjectType"], USER_FORCE_CHANGE_PASSWORD)
+        self.assertEqual(j["SACL"]["ACEList"][0]["Type"], "SystemAudit")
+
+    def test_no_dacl(self):
+        data = bytearray(descriptor(DOMAIN + "-512", DOMAIN + "-513", []))
+        data[2] &= ~SE.SE_DACL_PRESENT
+        self.assertEqual(SecurityDescriptor(bytes(data)).DACL, None)
+
+
+class ParseACLTest(unittest.TestCase):
+    def test_parse_acl(self):
+        aces = parse_acl(memoryview(acl([ace(0, 0, 1, "S-1-5-18"), ace(1, 0, 2, "S-1-5-10")])), 0)
+        self.assertEqual([(a.Type, a.Mask, a.SID) for a in aces], [(0, 1, "S-1-5-18"), (1, 2, "S-1-5-10")])
+
+    def test_invalid_ace_size(self):
+        data = bytearray(acl([ace(0, 0, 1, "S-1-5-18")]))
+        data[10:12] = b"\x04\x00"
+        self.assertRaises(ValueError, parse_acl, memoryview(bytes(data)), 0)
+
+    def test_acl_to_json(self):
+        j = acl_to_json(acl([ace(0, 0x10, 0x20, "S-1-5-18")]))
+        self.assertEqual(j["Count"], 1)
+        self.assertTrue(j["ACEList"][0]["Flags"]["flags"]["InheritedAce"])
+        self.assertEqual(j["ACEList"][0]["SID"], "S-1-5-18")
+
+
+class SdTableTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workdir, "sd_table")
+        good = descriptor(DOMAIN + "-512", DOMAIN + "-513", [ace(0, 0, 0x20, "S-1-5-18")])
+        bad = bytearray(good)
+        bad[0] = 2
+        with open(self.filename, "w") as f:
+            f.write("sd_id\tsd_hash\tsd_refcount\tsd_value\n")
+            f.write("1\t00\t1\t%s\n" % good.hex())
+            f.write("2\t00\t1\t%s\n" % bytes(bad).hex())
+            f.write("3\t00\t1\t0100\n")
+
+    def tearDown(self):
+        for filename in os.listdir(self.workdir):
+            os.remove(os.path.join(self.workdir, filename))
+        os.rmdir(self.workdir)
+
+    def test_invalid_header(self):
+        self.assertRaises(ValueError, SecurityDescriptor, b"\x01\x00")
+        self.assertRaises(ValueError, SecurityDescriptor, b"\x02" + bytes(19))
+
+    def test_get_security_descriptor(self):
+        dsInitSdTable(self.filename, self.workdir)
+        self.assertEqual(dsGetSecurityDescriptor(1).Owner, DOMAIN + "-512")
+        self.assertIsNone(dsGetSecurityDescriptor(2))
+        self.assertIsNone(dsGetSecurityDescriptor(3))
+        self.assertIsNone(dsGetSecurityDescriptor(4))
+
+    def test_missing_columns(self):
+        with open(self.filename, "w") as f:
+            f.write("sd_id\tsd_hash\n")
+        self.assertRaises(ValueError, dsInitSdTable, self.filename, self.workdir)
+
+
+if __name__ == "__main__":
+    unittest.main()